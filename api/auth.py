@@ -1,8 +1,14 @@
 from functools import wraps
-from flask import request, jsonify
-from database import DatabaseManager
+from flask import request, jsonify, g
+from database import get_db
 
-db = DatabaseManager()
+db = get_db()
+
+def get_api_key_info():
+    """Looks up the x-api-key header once per request, the decorators below share the result"""
+    if 'api_key_info' not in g:
+        g.api_key_info = db.lookup_api_key(request.headers.get("x-api-key"))
+    return g.api_key_info
 
 def require_api_key(f):
     @wraps(f)
@@ -10,22 +16,22 @@ def require_api_key(f):
         api_key = request.headers.get("x-api-key")
         if not api_key:
             return jsonify({"message": "API key missing"}), 401
-        
-        if not db.validate_api_key(api_key):
+
+        if not get_api_key_info():
             return jsonify({"message": "Invalid API key"}), 403
         else:
             return f(*args, **kwargs)
-        
+
     return decorated
 
 def require_administrator(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        api_key = request.headers.get("x-api-key")
-        
-        if db.validate_api_administration(api_key) == 0:
-            return jsonify({"message": "Authorized 403"})
+        key_info = get_api_key_info()
+
+        if not key_info or not key_info['administrator']:
+            return jsonify({"message": "Authorized 403"}), 403
         else:
             return f(*args, **kwargs)
-        
-    return decorated   
\ No newline at end of file
+
+    return decorated
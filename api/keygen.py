@@ -1,14 +1,33 @@
-import random
+import secrets
+import hashlib
 import string
 
+PREFIX_LENGTH = 8
+
 def generate_key(length=25, use_upper=True, use_digits=True):
+    """
+    Makes a key like CS_<prefix>_<secret>. The prefix is stored as is so a key can be
+    recognised (and found) without knowing the secret, the whole key is only stored hashed.
+    """
     characters = string.ascii_lowercase
-    
+
     if use_upper:
         characters += string.ascii_uppercase
     if use_digits:
         characters += string.digits
-    
+
     # Generate password
-    password = "CS_" + ''.join(random.choice(characters) for _ in range(length))
+    prefix = ''.join(secrets.choice(string.ascii_lowercase + string.digits) for _ in range(PREFIX_LENGTH))
+    password = "CS_" + prefix + "_" + ''.join(secrets.choice(characters) for _ in range(length))
     return password
+
+def key_prefix(key):
+    """The public part of a key, old keys (CS_<secret>) use the start of their secret"""
+    parts = key.split("_")
+    if len(parts) == 3:
+        return parts[1]
+    return key[3:3 + PREFIX_LENGTH]
+
+def hash_key(key):
+    """Fixed width digest that gets stored instead of the key (keys are random so no salt needed)"""
+    return hashlib.sha256(key.encode()).hexdigest()
@@ -1,10 +1,25 @@
-from flask import Blueprint, jsonify, request
-from database import DatabaseManager
+from flask import Blueprint, jsonify, request, Response, url_for
+from mysql.connector import Error
+from database import get_db, validate_person
+from httpcache import versioned
+from imagestore import safe_image_path
+import exporter
+import threading
+import json
+import time
+import os
 from api.auth import require_api_key # makes auth for the API
 from api.auth import require_administrator
 
+BULK_BATCH_SIZE = 500
+MAX_BULK_BATCH_SIZE = 5000
+MAX_BATCH_IDS = 1000 # /api/people/batch
+exportconcurrency = int(os.getenv("EXPORT_CONCURRENCY", "2")) # downloads at once per worker process, each has its own connection
+
+export_slots = threading.BoundedSemaphore(exportconcurrency)
+
 api = Blueprint("people", __name__)
-db = DatabaseManager()
+db = get_db()
 
 @api.route("/api/token_validate", methods=['GET'])
 @require_api_key
@@ -20,43 +35,370 @@ def get_users():
     users = db.get_all_users()
     return jsonify(users)
 
+@api.route("/api/stats/pool", methods=["GET"])
+@require_api_key
+@require_administrator
+def get_pool_stats():
+    return jsonify(db.pool_stats())
+
+def add_next_link(response, endpoint, **args):
+    next_url = url_for(endpoint, _external=True, **args)
+    response.headers['Link'] = f'<{next_url}>; rel="next"'
+
+def add_image_variants(people):
+    """Next to 'images' (the originals) every person gets 'image_variants' with the thumb/web copies"""
+    for person in people:
+        person['image_variants'] = [db.image_store.variants(path) for path in person.get('images') or []]
+    return people
+
+def image_paths_error(data, key):
+    """Error message if data[key] isn't a list of image paths inside static/images, None if it is (or isn't there)"""
+    paths = data.get(key, [])
+    if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+        return f"{key} has to be a list of image paths"
+    for path in paths:
+        # the thumbnail threads read (and write next to) these files
+        if not safe_image_path(path):
+            return f"{key} can't have absolute paths or '..' ({path})"
+    return None
+
+def stream_people(after=None):
+    """
+    Streams the people table as one JSON array without loading it into memory, on a connection
+    of its own so a slow client doesn't hold a pooled one
+    """
+    yield '['
+    try:
+        for i, person in enumerate(db.iter_people_with_images(after=after, dedicated=True)):
+            yield (',' if i else '') + json.dumps(add_image_variants([person])[0])
+    except Error as e:
+        print(f"[-] Error streaming people: {e}")
+        # the response is cut off without the closing ']', so the client sees it's incomplete
+        raise
+    yield ']'
+
 @api.route("/api/people", methods=["GET"])
 @require_api_key
+@versioned(db.get_page_version)
 def get_people():
-    people = db.get_all_people()
-    
-    return jsonify(people)
+    after = request.args.get('after', type=int)
+
+    if request.args.get('stream') in ('1', 'true'):
+        return Response(stream_people(after), mimetype='application/json')
+
+    label = request.args.get('label') or None
+    try:
+        convicted = exporter.parse_convicted(request.args.get('convicted'))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    people, next_cursor = db.get_people_page(limit=request.args.get('limit', type=int), after=after, with_images=True,
+                                             label=label, convicted=convicted)
+    response = jsonify(add_image_variants(people))
+
+    if next_cursor is not None:
+        add_next_link(response, 'people.get_people', limit=request.args.get('limit', type=int), after=next_cursor,
+                      label=label, convicted=request.args.get('convicted') or None)
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+
+    return response
+
+@api.route("/api/people/changes", methods=["GET"])
+@require_api_key
+def get_changes():
+    limit = request.args.get('limit', type=int)
+    try:
+        changes = db.get_changes(since=request.args.get('since'), limit=limit)
+    except ValueError:
+        return jsonify({"message": f"'{request.args.get('since')}' is not a change token"}), 400
+    if changes is None:
+        return jsonify({"message": "Could not read the changes, try again"}), 500
+    add_image_variants(changes['changed'])
+    response = jsonify(changes)
+
+    if changes['has_more']:
+        add_next_link(response, 'people.get_changes', since=changes['next'], limit=limit)
+
+    return response
+
+@api.route("/api/labels", methods=["GET"])
+@require_api_key
+def get_labels():
+    return jsonify(db.get_label_facets(limit=max(1, min(request.args.get('limit', 100, type=int), 1000))))
+
+@api.route("/api/people/by-ip", methods=["GET"])
+@require_api_key
+def get_people_by_ip():
+    cidr = request.args.get('cidr', '')
+    limit = request.args.get('limit', type=int)
+    try:
+        people, next_cursor = db.get_people_by_ip(cidr, limit=limit, after=request.args.get('after', type=int), with_images=True)
+    except ValueError:
+        return jsonify({"message": f"'{cidr}' is not an IP address or CIDR block"}), 400
+    response = jsonify(add_image_variants(people))
+
+    if next_cursor is not None:
+        add_next_link(response, 'people.get_people_by_ip', cidr=cidr, limit=limit, after=next_cursor)
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+
+    return response
+
+@api.route("/api/people/by-social", methods=["GET"])
+@require_api_key
+def get_people_by_social():
+    handle = request.args.get('handle', '')
+    platform = request.args.get('platform') or None
+    limit = request.args.get('limit', type=int)
+    try:
+        people, next_cursor = db.get_people_by_social(handle, platform=platform, limit=limit,
+                                                      after=request.args.get('after', type=int), with_images=True)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    response = jsonify(add_image_variants(people))
+
+    if next_cursor is not None:
+        add_next_link(response, 'people.get_people_by_social', handle=handle, platform=platform, limit=limit, after=next_cursor)
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+
+    return response
+
+@api.route("/api/people/suggest", methods=["GET"])
+@require_api_key
+def suggest_people():
+    return jsonify(db.suggest_people(request.args.get('q', ''), limit=request.args.get('limit', type=int)))
+
+@api.route("/api/people/search", methods=["GET"])
+@require_api_key
+def search_people():
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', type=int)
+    page = request.args.get('page', 1, type=int)
+
+    people, has_next = db.search_people(query, limit=limit, page=page, with_images=True)
+    response = jsonify(add_image_variants(people))
+
+    if has_next:
+        add_next_link(response, 'people.search_people', q=query, limit=limit, page=page + 1)
+
+    return response
+
+@api.route("/api/people/duplicates", methods=["GET"])
+@require_api_key
+@require_administrator
+def get_duplicates():
+    min_score = request.args.get('min_score', 0.5, type=float)
+    limit = request.args.get('limit', type=int)
+    page = request.args.get('page', 1, type=int)
+
+    pairs, has_next = db.get_duplicates(min_score=min_score, limit=limit, page=page)
+    response = jsonify(pairs)
+
+    if has_next:
+        add_next_link(response, 'people.get_duplicates', min_score=min_score, limit=limit, page=page + 1)
+
+    return response
+
+@api.route("/api/people/<int:person_id>/duplicates", methods=["GET"])
+@require_api_key
+def get_duplicates_of(person_id):
+    return jsonify(db.get_duplicates_of(person_id, min_score=request.args.get('min_score', 0.0, type=float)))
+
+@api.route("/api/people/photo-match", methods=["POST"])
+@require_api_key
+def match_photo():
+    # multipart upload (field "image") or the raw image as the request body
+    upload = request.files.get('image')
+    stream = upload.stream if upload else request.stream
+    try:
+        matches = db.match_photo(stream, max_distance=request.args.get('max_distance', 10, type=int),
+                                 limit=request.args.get('limit', type=int))
+    except ImportError:
+        return jsonify({"message": "Photo matching needs Pillow on the server (pip install pillow)"}), 501
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    if matches is None:
+        response = jsonify({"message": "The photo index is still loading, try again in a moment"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    return jsonify(matches)
+
+@api.route("/api/people/batch", methods=["GET", "POST"])
+@require_api_key
+@versioned(db.get_page_version)
+def get_people_batch():
+    # ?ids=1,2,3 or a JSON body {"ids": [1, 2, 3]}
+    if request.method == 'POST':
+        ids = (request.get_json(silent=True) or {}).get('ids')
+    else:
+        ids = [part for value in request.args.getlist('ids') for part in value.split(',') if part.strip()]
+    if not isinstance(ids, list):
+        return jsonify({"message": "ids has to be a list of person IDs"}), 400
+    try:
+        ids = [int(person_id) for person_id in ids]
+    except (TypeError, ValueError):
+        return jsonify({"message": "ids has to be a list of person IDs"}), 400
+    if len(ids) > MAX_BATCH_IDS:
+        return jsonify({"message": f"at most {MAX_BATCH_IDS} IDs per request"}), 400
+
+    result = db.get_people(ids)
+    if result is None:
+        return jsonify({"message": "Could not read the people, try again"}), 500
+    people, missing = result
+    return jsonify({'people': add_image_variants(people), 'missing': missing})
 
 @api.route("/api/people/<int:person_id>", methods=["GET"])
 @require_api_key
+@versioned(db.get_page_version)
 def get_person(person_id):
     person = db.get_person(person_id=person_id)
 
     if person:
-        return jsonify(person)
+        return jsonify(add_image_variants([person])[0])
     else:
         return jsonify({
             'message': 'Person is not found in database.'
         }), 404
 
+@api.route("/api/people/<int:person_id>", methods=["PATCH"])
+@require_api_key
+def patch_person(person_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"message": "body has to be a JSON object"}), 400
+    fields, error = validate_person({field: value for field, value in data.items() if field not in ('add_images', 'remove_images')}, partial=True)
+    if error is None:
+        error = image_paths_error(data, 'add_images') or image_paths_error(data, 'remove_images')
+    if error is not None:
+        return jsonify({"message": error}), 400
+
+    changed = db.patch_person(person_id, fields, add_images=data.get('add_images', []), remove_images=data.get('remove_images', []))
+    if changed is None:
+        return jsonify({'message': 'Person is not found in database.'}), 404
+    if changed is False:
+        return jsonify({"message": "Could not update the person, try again"}), 500
+    person = db.get_person(person_id)
+    return jsonify({'changed': changed, 'person': add_image_variants([person])[0] if person else None})
+
 @api.route("/api/people/add", methods=['POST'])
 @require_api_key
 def add_person():
     data = request.get_json()
 
-    name = data.get('name')
-    address = data.get('address')
-    phone = data.get('phone')
-    email = data.get('email')
-    ipaddress = data.get('ipaddress')
-    label = data.get('label')
-    description = data.get('description')
-    convicted = data.get('convicted') # int
-    socials = data.get('socials')
-    
-    db.add_person(name, address, phone, email, ipaddress, label, description, convicted, socials)
+    person, error = validate_person(data)
+    if error is not None:
+        return jsonify({"message": error}), 400
+    images = data.get('images') or []
+    error = image_paths_error({'images': images}, 'images')
+    if error is not None:
+        return jsonify({"message": error}), 400
+
+    person_id = db.add_person(image_paths=images, **person)
+    if person_id is None:
+        return jsonify({"message": f"Could not add {person['name']}, try again"}), 500
+
+    return jsonify({"message": f"Successfully added {person['name']}.", "id": person_id}), 200
+
+def read_bulk_records():
+    """Yields (index, record or None, error or None) from a JSON array or NDJSON (one object per line) body"""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonlines'):
+        # read line by line so a big upload is never in memory at once
+        for index, line in enumerate(request.stream):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line), None
+            except ValueError:
+                yield index, None, "invalid JSON"
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            yield 0, None, "body has to be a JSON array (or NDJSON with Content-Type: application/x-ndjson)"
+            return
+        for index, record in enumerate(data):
+            yield index, record, None
+
+@api.route("/api/people/bulk", methods=['POST'])
+@require_api_key
+def add_people_bulk():
+    batch_size = max(1, min(request.args.get('batch_size', BULK_BATCH_SIZE, type=int), MAX_BULK_BATCH_SIZE))
+    start = time.perf_counter()
+    results = []
+    batch = [] # (result, person) waiting to be inserted
+
+    def flush():
+        ids = db.add_people([person for _, person in batch])
+        for i, (result, _) in enumerate(batch):
+            if ids is None:
+                result['error'] = "database error, batch was not inserted"
+            else:
+                result['id'] = ids[i]
+        batch.clear()
+
+    for index, record, error in read_bulk_records():
+        result = {'index': index}
+        results.append(result)
+        if error is None:
+            person, error = validate_person(record)
+        if error is not None:
+            result['error'] = error
+            continue
+        batch.append((result, person))
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    seconds = time.perf_counter() - start
+    inserted = sum(1 for r in results if 'id' in r)
+    return jsonify({
+        'inserted': inserted,
+        'failed': len(results) - inserted,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(inserted / seconds, 1) if seconds else None,
+        'results': results
+    }), 200
+
+@api.route("/api/export", methods=["GET"])
+@require_api_key
+def export_people():
+    fmt = request.args.get('format', 'ndjson')
+    compression = request.args.get('compress') or None
+    # every export reads on a connection of its own for as long as the download takes
+    if not export_slots.acquire(blocking=False):
+        return jsonify({"message": "Too many exports are running, try again later"}), 429
+    people = chunks = None
+
+    def finished():
+        # closing the generators gives the connection back without reading the rest of the result
+        try:
+            for generator in (chunks, people):
+                if generator is not None:
+                    generator.close()
+        finally:
+            export_slots.release()
+
+    try:
+        convicted = exporter.parse_convicted(request.args.get('convicted'))
+        people = db.iter_people_with_images(label=request.args.get('label'), convicted=convicted, dedicated=True)
+        chunks = exporter.export_chunks(people, fmt, compression)
+        first = next(chunks, b'') # bad options raise here, before anything is sent
+    except ValueError as e:
+        finished()
+        return jsonify({"message": str(e)}), 400
+    except BaseException:
+        finished()
+        raise
+
+    def stream():
+        yield first
+        yield from chunks
 
-    return jsonify({"message": f"Successfully added {name}."}), 200
+    mimetype = 'application/gzip' if compression == 'gzip' else 'application/zstd' if compression else exporter.CONTENT_TYPES[fmt]
+    response = Response(stream(), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={exporter.filename(fmt, compression)}'
+    response.call_on_close(finished)
+    return response
 
 @api.route("/api/users/add", methods=["POST"])
 @require_api_key
@@ -68,9 +410,11 @@ def add_user():
     password = data.get('password')
     is_admin = data.get('is_admin')
 
-    db.add_user(username, password, is_admin)
+    user_id = db.add_user(username, password, is_admin)
+    if user_id is None:
+        return jsonify({"message": f"Could not add {username}, the username may be taken."}), 400
     
-    return jsonify({"message": f"Successfully added {username}."}), 200
+    return jsonify({"message": f"Successfully added {username}.", "id": user_id}), 200
         
 if __name__ == '__main__':
     print("Please run index.py")
\ No newline at end of file
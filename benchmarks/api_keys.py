@@ -0,0 +1,57 @@
+"""
+API key lookup latency for a growing number of keys.
+Uses its own database (cipherstorm_bench by default) and drops it when done.
+
+    python3 benchmarks/api_keys.py
+"""
+import os
+import sys
+import time
+import random
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import DatabaseManager
+from api.keygen import generate_key, hash_key, key_prefix
+
+SIZES = [10, 100, 1000, 10000, 100000]
+LOOKUPS = 2000
+
+def add_keys(db, count):
+    keys = [generate_key() for _ in range(count)]
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        for i in range(0, count, 5000):
+            cursor.executemany("INSERT INTO api_keys (label, key_prefix, key_hash) VALUES (%s, %s, %s)",
+                               [("bench", key_prefix(k), hash_key(k)) for k in keys[i:i + 5000]])
+        conn.commit()
+    return keys
+
+def time_lookups(db, keys):
+    samples = []
+    for _ in range(LOOKUPS):
+        # mix of valid and invalid keys, both have to be a single index probe
+        key = random.choice(keys) if random.random() < 0.9 else generate_key()
+        start = time.perf_counter()
+        db._fetch_api_key(hash_key(key)) # skip the cache, we want the database
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)]
+
+def main():
+    database = os.getenv("BENCH_DATABASE", "cipherstorm_bench")
+    db = DatabaseManager(database=database)
+    keys = []
+    try:
+        print(f"{'keys':>8} {'median us':>10} {'p99 us':>10}")
+        for size in SIZES:
+            keys += add_keys(db, size - len(keys))
+            median, p99 = time_lookups(db, keys)
+            print(f"{size:>8} {median:>10.1f} {p99:>10.1f}")
+    finally:
+        with db.get_connection() as conn:
+            conn.cursor().execute(f"DROP DATABASE {database}")
+
+if __name__ == '__main__':
+    main()
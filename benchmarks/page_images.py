@@ -0,0 +1,75 @@
+"""
+Round trips and time per /api/people page, loading images per person (N+1, how it used to be)
+against one batched query for the whole page.
+Uses its own database (cipherstorm_bench by default) and drops it when done.
+
+    python3 benchmarks/page_images.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import DatabaseManager
+
+PEOPLE = 5000
+IMAGES_PER_PERSON = 3
+PAGE_SIZE = 100
+PAGES = 20
+
+def seed(db):
+    people = [{'name': f'person {i}', 'description': 'bench', 'address': None, 'phone': None, 'email': None,
+               'ipaddress': None, 'label': None, 'convicted': False, 'socials': None,
+               'images': [f'images/bench/{i}_{n}.jpg' for n in range(IMAGES_PER_PERSON)]} for i in range(PEOPLE)]
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        for i in range(0, PEOPLE, 1000):
+            db.insert_people(cursor, people[i:i + 1000])
+        conn.commit()
+
+def questions(db):
+    """Statements sent on the (only) pooled connection so far"""
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SHOW SESSION STATUS LIKE 'Questions'")
+        return int(cursor.fetchone()[1])
+
+def one_by_one(db, after):
+    people, next_cursor = db.get_people_page(limit=PAGE_SIZE, after=after)
+    for person in people:
+        person['images'] = db.get_person_images(person['id'])
+    return next_cursor
+
+def batched(db, after):
+    _, next_cursor = db.get_people_page(limit=PAGE_SIZE, after=after, with_images=True)
+    return next_cursor
+
+def run(db, load_page):
+    before = questions(db)
+    start = time.perf_counter()
+    after = None
+    for _ in range(PAGES):
+        after = load_page(db, after)
+    seconds = time.perf_counter() - start
+    # every questions() call is one statement itself
+    queries = questions(db) - before - 1
+    return queries / PAGES, seconds / PAGES * 1000
+
+def main():
+    database = os.getenv("BENCH_DATABASE", "cipherstorm_bench")
+    # one connection so the session counter sees every query
+    db = DatabaseManager(database=database, pool_size=1)
+    try:
+        seed(db)
+        print(f"{PAGE_SIZE} people per page, {IMAGES_PER_PERSON} images each")
+        print(f"{'':>12} {'queries/page':>13} {'ms/page':>8}")
+        for name, load_page in (("one by one", one_by_one), ("batched", batched)):
+            queries, ms = run(db, load_page)
+            print(f"{name:>12} {queries:>13.0f} {ms:>8.1f}")
+    finally:
+        with db.get_connection() as conn:
+            conn.cursor().execute(f"DROP DATABASE {database}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+import threading
+import tempfile
+import time
+import os
+from dotenv import load_dotenv
+try:
+    import fcntl
+except ImportError: # Windows, start.bat runs a single process there
+    fcntl = None
+
+load_dotenv()
+
+cachedir = os.getenv("CACHE_DIR", tempfile.gettempdir()) # where shared generation files live
+
+MISSING = object()
+
+_bump_lock = threading.Lock() # bumps from threads of this process (all of them without fcntl)
+
+class SharedGeneration:
+    """
+    A counter shared by every worker process on this machine.
+    It's 8 bytes in a small file, current() reads them and bump() adds one under a file lock,
+    so checking for a change is one small read and the value only ever goes up.
+    """
+    def __init__(self, name, directory=cachedir):
+        self.path = os.path.join(directory, f"cipherstorm-{name}.gen")
+
+    def current(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return int.from_bytes(f.read(8), 'big')
+        except FileNotFoundError:
+            return 0
+
+    def changed_at(self):
+        """When it was last bumped (a time.time() value), None if never"""
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def bump(self):
+        """Returns the new value"""
+        with _bump_lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX) # let go of when it's closed
+                value = int.from_bytes(os.read(fd, 8), 'big') + 1
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, value.to_bytes(8, 'big'))
+                return value
+            finally:
+                os.close(fd)
+
+class TTLCache:
+    """
+    Thread safe LRU cache where every entry expires after `ttl` seconds.
+    If a SharedGeneration is given, a bump from any process clears the cache on the next get().
+    """
+    def __init__(self, maxsize=1024, ttl=60, generation=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = generation
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._seen = generation.current() if generation else None
+        self._epoch = 0 # goes up on every clear
+        self.hits = 0
+        self.misses = 0
+
+    def _check_generation(self):
+        current = self.generation.current()
+        if current != self._seen:
+            self._data.clear()
+            self._seen = current
+            self._epoch += 1
+
+    def epoch(self):
+        """Take this before reading from the database and pass it to set(), so a value
+        read before an invalidate() doesn't get cached after it"""
+        with self._lock:
+            if self.generation:
+                self._check_generation()
+            return self._epoch
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            if self.generation:
+                self._check_generation()
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None, epoch=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if epoch is not None:
+                if self.generation:
+                    self._check_generation()
+                if epoch != self._epoch:
+                    return
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=MISSING):
+        """Drop one key, or everything (in every process) when no key is given"""
+        with self._lock:
+            if key is not MISSING:
+                self._data.pop(key, None)
+                return
+            self._data.clear()
+            self._epoch += 1
+        if self.generation:
+            self.generation.bump()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
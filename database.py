@@ -1,7 +1,24 @@
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import PoolError
+from mysql.connector import errorcode
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import threading
 import hashlib
+import time
+import re
+import json
 from colorama import Fore, Style
+from cache import TTLCache, SharedGeneration, MISSING
+from api.keygen import hash_key, key_prefix
+from suggest import PeopleSuggest, parse_labels, parse_social_accounts
+from imagestore import ImageStore
+from thumbnails import ThumbnailPool
+from photomatch import PeoplePhotos, dhash, MAX_DISTANCE
+from readmodel import PeopleReadModel, readmodelenabled
+import dedup
+import ipranges
 import platform
 import os
 from dotenv import load_dotenv
@@ -15,8 +32,265 @@ dbhost = os.getenv("DB_HOST", "localhost") # set localhost if db_host not set
 dbuser = os.getenv("DB_USER", "root") # set root if db_user not set
 dbpassword = os.getenv("DB_PASSWORD", "") # set empty string if db_password not set
 
+# connection pool settings, see ConnectionPool
+dbpoolsize = int(os.getenv("DB_POOL_SIZE", "5")) # max connections per worker process
+dbpoolrecycle = float(os.getenv("DB_POOL_RECYCLE", "3600")) # seconds before a connection gets replaced
+dbpooltimeout = float(os.getenv("DB_POOL_TIMEOUT", "30")) # seconds to wait for a free connection
+dbpoolping = float(os.getenv("DB_POOL_PING_INTERVAL", "30")) # idle seconds before a connection is pinged on checkout
+
+# API key lookup cache, see DatabaseManager.lookup_api_key
+apikeycachesize = int(os.getenv("APIKEY_CACHE_SIZE", "4096"))
+apikeycachettl = float(os.getenv("APIKEY_CACHE_TTL", "60")) # seconds a valid key stays cached
+apikeycachenegativettl = float(os.getenv("APIKEY_CACHE_NEGATIVE_TTL", "5")) # seconds an invalid key stays cached
+
+# logged in user cache, see DatabaseManager.get_session_user
+usercachesize = int(os.getenv("USER_CACHE_SIZE", "1024"))
+usercachettl = float(os.getenv("USER_CACHE_TTL", "30")) # seconds before a session user is read again
+
+# version of the people table (ETags, see httpcache.py), see DatabaseManager.get_people_version
+peopleversionttl = float(os.getenv("PEOPLE_VERSION_TTL", "1")) # seconds before another server's writes are seen
+
+class ConnectionPool:
+    """
+    Keeps up to `size` MySQL connections open and hands them out with connection().
+    Idle connections get pinged on checkout, old ones get recycled, and a forked
+    worker starts with an empty pool instead of sharing the parent's sockets.
+    """
+    def __init__(self, size=dbpoolsize, recycle=dbpoolrecycle, timeout=dbpooltimeout, ping_interval=dbpoolping, **connect_args):
+        self.size = size
+        self.recycle = recycle
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        # consume_results lets a connection be reused even if a cursor wasn't fully read
+        self.connect_args = dict(connect_args, consume_results=True)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = [] # (conn, created_at, last_used) - newest at the end
+        self._in_use = 0
+        self._counters = {
+            'created': 0,
+            'recycled': 0,
+            'failed_checks': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'dedicated': 0
+        }
+
+    def _check_fork(self):
+        # sockets inherited from the parent process belong to the parent, never touch them here
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def _acquire(self):
+        self._check_fork()
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            if not self._idle and self._in_use >= self.size:
+                self._counters['waits'] += 1
+            while not self._idle and self._in_use >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolError(f"No free database connection after {self.timeout}s (pool size {self.size})")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._counters['checkouts'] += 1
+            entry = self._idle.pop() if self._idle else None
+
+        try:
+            return self._checkout(entry)
+        except BaseException:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def _checkout(self, entry):
+        now = time.monotonic()
+        if entry is not None:
+            conn, created_at, last_used = entry
+            if now - created_at > self.recycle:
+                self._discard(conn)
+                self._count('recycled')
+                entry = None
+            elif now - last_used > self.ping_interval:
+                try:
+                    conn.ping(reconnect=False)
+                except Error:
+                    self._discard(conn)
+                    self._count('failed_checks')
+                    entry = None
+
+        if entry is None:
+            conn = mysql.connector.connect(**self.connect_args)
+            created_at = now
+            self._count('created')
+        return conn, created_at
+
+    def _release(self, conn, created_at, pid, rollback=False):
+        if os.getpid() != pid:
+            return # checked out before a fork, belongs to the old pool
+
+        keep = True
+        try:
+            # never hand out a connection with an open transaction (or an old read snapshot)
+            if rollback or conn.in_transaction:
+                conn.rollback()
+        except Error:
+            keep = False
+
+        if not keep:
+            self._discard(conn)
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def _count(self, name):
+        with self._cond:
+            self._counters[name] += 1
+
+    @contextmanager
+    def connection(self):
+        """Check a connection out of the pool, it goes back in when the block ends"""
+        conn, created_at = self._acquire()
+        pid = self._pid
+        try:
+            yield conn
+        except BaseException:
+            self._release(conn, created_at, pid, rollback=True)
+            raise
+        else:
+            self._release(conn, created_at, pid)
+
+    @contextmanager
+    def dedicated(self):
+        """
+        A new connection that isn't part of the pool, closed when the block ends. For reads that
+        last as long as a slow client takes to download them, so they don't hold a pooled one.
+        """
+        # not consume_results like the pooled ones, a client that goes away mid-stream mustn't
+        # make close() read the rest of the table first
+        conn = mysql.connector.connect(**dict(self.connect_args, consume_results=False))
+        self._count('dedicated')
+        try:
+            yield conn
+        finally:
+            if getattr(conn, 'unread_result', False):
+                self._abandon(conn)
+            else:
+                self._discard(conn)
+
+    def _abandon(self, conn):
+        """Close a connection in the middle of an unbuffered result without reading the rest of it"""
+        try:
+            # pure python connector: drop the socket without a QUIT, the server stops the query
+            conn.shutdown()
+            return
+        except NotImplementedError:
+            pass
+        # the C extension reads whatever is left when it closes, so stop the query on the server first
+        try:
+            with self.connection() as other:
+                other.cursor().execute("KILL QUERY %s", (conn.connection_id,))
+        except Error:
+            pass
+        self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                'size': self.size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'pid': self._pid
+            })
+        return stats
+
+    def close(self):
+        """Close every idle connection (connections in use are closed when they come back)"""
+        self._check_fork()
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+# columns a person can be written with (besides id), in the order add_people inserts them
+PERSON_FIELDS = ('name', 'address', 'phone', 'email', 'ipaddress', 'label', 'description', 'convicted', 'socials')
+# longest value the people columns take, in characters for the VARCHARs and bytes for the TEXT ones
+MAX_LENGTHS = {'name': 255, 'address': 255, 'phone': 50, 'email': 255, 'ipaddress': 255,
+               'label': 65535, 'description': 65535, 'socials': 65535}
+TEXT_FIELDS = ('label', 'description', 'socials')
+
+def validate_person(record, partial=False):
+    """
+    Check a person record from outside (API/import), returns (person, None) or (None, error).
+    name is required, convicted can be 1/0/true/false/yes/no and socials a list or a string,
+    nothing can be longer than its column (MAX_LENGTHS). partial is for updates, only the fields that are in record are checked and returned.
+    """
+    if not isinstance(record, dict):
+        return None, "record has to be a JSON object"
+    person = {}
+    for field in PERSON_FIELDS:
+        if partial and field not in record:
+            continue
+        value = record.get(field)
+        if field == 'convicted':
+            if value in (None, ''):
+                value = False
+            elif value in (0, 1):
+                value = bool(value)
+            elif str(value).strip().lower() in ('0', '1', 'true', 'false', 'yes', 'no'):
+                value = str(value).strip().lower() in ('1', 'true', 'yes')
+            else:
+                return None, "convicted has to be 1 or 0"
+        elif field == 'socials' and isinstance(value, list):
+            value = json.dumps(value)
+        elif value is not None and not isinstance(value, (str, int, float)):
+            return None, f"{field} has to be a string"
+        elif value is not None:
+            value = str(value).strip()
+        person[field] = value
+    if not partial or 'name' in person:
+        if not person['name']:
+            return None, "name is required"
+    for field, limit in MAX_LENGTHS.items():
+        # over-long values would fail the whole INSERT (and its batch) in strict mode
+        value = person.get(field)
+        if value and field in TEXT_FIELDS and len(value.encode('utf-8')) > limit:
+            return None, f"{field} is longer than {limit} bytes"
+        if value and field not in TEXT_FIELDS and len(value) > limit:
+            return None, f"{field} is longer than {limit} characters"
+    return person, None
+
+def change_token(seq, person_id):
+    """Position in the change feed, '<change_seq>.<person id>' of the last change a client has"""
+    return f"{seq}.{person_id}"
+
+def parse_change_token(token):
+    """(change_seq, person id) of a change token, (0, 0) (everything) for none, ValueError if it's not one"""
+    if not token:
+        return 0, 0
+    seq, _, person_id = str(token).partition('.')
+    seq, person_id = int(seq), int(person_id or 0)
+    if seq < 0 or person_id < 0:
+        raise ValueError(f"'{token}' is not a change token")
+    return seq, person_id
+
 class DatabaseManager:
-    def __init__(self, host=dbhost, user=dbuser, password=dbpassword, database="cipherstorm"):
+    def __init__(self, host=dbhost, user=dbuser, password=dbpassword, database="cipherstorm", pool_size=dbpoolsize):
         self.host = host
         
         if in_docker() == True:
@@ -27,95 +301,242 @@ class DatabaseManager:
         self.user = user
         self.password = password
         self.database = database
-        self.initialize_database()
-    
-    def get_connection(self):
-        """Return a MySQL connection"""
-        return mysql.connector.connect(
+        self.pool = ConnectionPool(
+            size=pool_size,
             host=self.host,
             user=self.user,
             password=self.password,
             database=self.database
         )
+        # shared generation so add/delete in one worker clears the cache in all of them
+        self.apikey_cache = TTLCache(maxsize=apikeycachesize, ttl=apikeycachettl, generation=SharedGeneration("api_keys"))
+        # users behind flask_login sessions, edit_user/delete_user clear it in every worker
+        self.user_cache = TTLCache(maxsize=usercachesize, ttl=usercachettl, generation=SharedGeneration("users"))
+        # writes from this machine clear it right away, other servers' writes are seen after the ttl
+        self.version_cache = TTLCache(maxsize=1, ttl=peopleversionttl, generation=SharedGeneration("people"))
+        # optional, the people table in memory for get_person/get_people/get_people_page (see readmodel.py)
+        self.read_model = PeopleReadModel(self) if readmodelenabled else None
+        # typeahead index, built in the background the first time it's used
+        self.suggest = PeopleSuggest(self.iter_people, self.get_changes, self.get_change_token)
+        # uploaded image files, deduplicated by content (see add_person_images)
+        self.image_store = ImageStore()
+        # photo hashes for matching the same photo on different people, made after the thumbnails
+        self.photos = PeoplePhotos(self.iter_image_hashes)
+        self.thumbnails = ThumbnailPool(self.image_store, hooks=[self._hash_image])
+        # the schema is checked on the first query, not here (see initialize_database)
+        self._ready = False
+        self._ready_lock = threading.Lock()
+    
+    def get_connection(self):
+        """Check out a pooled MySQL connection, use it as `with self.get_connection() as conn:`"""
+        if not self._ready:
+            self.initialize_database()
+        return self.pool.connection()
+
+    def get_dedicated_connection(self):
+        """A MySQL connection of its own (see ConnectionPool.dedicated), `with self.get_dedicated_connection() as conn:`"""
+        if not self._ready:
+            self.initialize_database()
+        return self.pool.dedicated()
+
+    def pool_stats(self):
+        """Counters for the connection pool of this process"""
+        return self.pool.stats()
     
     def initialize_database(self):
-        """Check if database exists and create tables if needed"""
+        """
+        Make sure the database and tables are up to date, runs once per process.
+        When the schema is current this is a single SELECT on schema_version.
+        """
+        with self._ready_lock:
+            if self._ready:
+                return
+            try:
+                start = time.monotonic()
+                version = self._schema_version()
+                if version is None:
+                    self._create_database()
+                    version = 0
+                if version < self.SCHEMA_VERSION:
+                    self._migrate()
+                self._ready = True
+                print(f"{Fore.GREEN}[+] Database '{self.database}' ready (schema v{self.SCHEMA_VERSION}, {(time.monotonic() - start) * 1000:.0f}ms).{Style.RESET_ALL}")
+            except Error as e:
+                print(f"{Fore.RED}[-] Error initializing database: {e}{Style.RESET_ALL}")
+                raise
+
+    def _schema_version(self):
+        """Current schema version, 0 without a schema_version table, None if the database doesn't exist"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT MAX(version) FROM schema_version")
+                return cursor.fetchone()[0] or 0
+        except Error as e:
+            if e.errno == errorcode.ER_BAD_DB_ERROR:
+                return None
+            if e.errno == errorcode.ER_NO_SUCH_TABLE:
+                return 0
+            raise
+
+    def _create_database(self):
+        conn = mysql.connector.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password
+        )
         try:
-            conn = mysql.connector.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password
-            )
             cursor = conn.cursor()
             cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.database}")
             conn.commit()
+        finally:
             conn.close()
-            print(f"{Fore.GREEN}[+] Database '{self.database}' ready.{Style.RESET_ALL}")
-            self._create_tables()
-        except Error as e:
-            print(f"{Fore.RED}[-] Error initializing database: {e}{Style.RESET_ALL}")
-            raise
+        print(f"{Fore.GREEN}[+] Database '{self.database}' created.{Style.RESET_ALL}")
 
-    def _create_tables(self):
-        """jah wtf this much tables :("""
-        try:
-            conn = self.get_connection()
+    def _migrate(self):
+        """Run every migration newer than schema_version, a named lock keeps other workers from doing it too"""
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
+            cursor.execute("SELECT GET_LOCK(%s, 60)", (f"{self.database}_schema",))
+            if cursor.fetchone()[0] != 1:
+                raise PoolError("Timed out waiting for another worker to update the schema")
+            try:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INT PRIMARY KEY,
+                        description VARCHAR(255),
+                        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # another worker may have done it while we waited for the lock
+                cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+                version = cursor.fetchone()[0]
+                for number, description, migration in self.MIGRATIONS:
+                    if number <= version:
+                        continue
+                    print(f"{Fore.YELLOW}[*] Updating schema to v{number}: {description}{Style.RESET_ALL}")
+                    migration(self, cursor)
+                    cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (number, description))
+                    conn.commit()
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (f"{self.database}_schema",))
+                cursor.fetchone()
 
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(255) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    is_admin BOOLEAN DEFAULT FALSE,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    last_login DATETIME
-                )
-            ''')
+    # -----------------------------
+    # Migrations, add new ones at the end of MIGRATIONS (below) with the next version number
+    # -----------------------------
+    def _create_tables(self, cursor):
+        """jah wtf this much tables :("""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(255) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                is_admin BOOLEAN DEFAULT FALSE,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_login DATETIME
+            )
+        ''')
 
-            # people table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS people (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(255),
-                    address VARCHAR(255),
-                    phone VARCHAR(50),
-                    email VARCHAR(255),
-                    ipaddress VARCHAR(255),
-                    label TEXT,
-                    description TEXT,
-                    convicted BOOLEAN DEFAULT FALSE,
-                    socials TEXT
-                )
-            ''')
-            # Predator images table 
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS people_images (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    person_id INT NOT NULL,
-                    image_path VARCHAR(255) NOT NULL,
-                    FOREIGN KEY (person_id) REFERENCES people(id) ON DELETE CASCADE
-                )
-            ''')
+        # people table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS people (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(255),
+                address VARCHAR(255),
+                phone VARCHAR(50),
+                email VARCHAR(255),
+                ipaddress VARCHAR(255),
+                label TEXT,
+                description TEXT,
+                convicted BOOLEAN DEFAULT FALSE,
+                socials TEXT
+            )
+        ''')
+        # Predator images table 
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS people_images (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                person_id INT NOT NULL,
+                image_path VARCHAR(255) NOT NULL,
+                FOREIGN KEY (person_id) REFERENCES people(id) ON DELETE CASCADE
+            )
+        ''')
+
+        # keys are stored as a sha256 digest, key_prefix is the public part of the key (see api/keygen.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS api_keys (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                label VARCHAR(255),
+                key_prefix VARCHAR(16) NOT NULL,
+                key_hash CHAR(64) NOT NULL,
+                administrator BOOLEAN DEFAULT FALSE,
+                UNIQUE KEY uq_api_keys_hash (key_hash),
+                KEY idx_api_keys_prefix (key_prefix)
+            )
+        ''')
+        # Administrator = accessing everything like an administrator account, as default its false.
+        self._migrate_api_keys(cursor)
+
+        print(f"{Fore.GREEN}[+] Tables created successfully.{Style.RESET_ALL}")
+        self._create_default_users(cursor)
+
+    def _create_people_indexes(self, cursor):
+        for name, definition in self.PEOPLE_INDEXES:
+            self._ensure_index(cursor, 'people', name, definition)
 
+    def _column_exists(self, cursor, table, column):
+        cursor.execute('''
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s AND column_name = %s
+        ''', (self.database, table, column))
+        return cursor.fetchone()[0] > 0
+
+    # secondary indexes on people (search indexes, see search_people)
+    PEOPLE_INDEXES = [
+        ('ft_people_text', 'FULLTEXT INDEX ft_people_text (name, description, label)'),
+        ('idx_people_phone', 'INDEX idx_people_phone (phone)'),
+        ('idx_people_email', 'INDEX idx_people_email (email)'),
+        ('idx_people_ipaddress', 'INDEX idx_people_ipaddress (ipaddress)')
+    ]
+
+    def _ensure_index(self, cursor, table, name, definition):
+        """Add an index to an existing table if it's not there yet"""
+        cursor.execute('''
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = %s AND table_name = %s AND index_name = %s
+        ''', (self.database, table, name))
+        if cursor.fetchone()[0] == 0:
+            print(f"{Fore.YELLOW}[*] Adding index {name} to {table}...{Style.RESET_ALL}")
+            cursor.execute(f"ALTER TABLE {table} ADD {definition}")
+
+    def _migrate_api_keys(self, cursor):
+        """One time: hash the plaintext keys of an older api_keys table and drop the plaintext column"""
+        if not self._column_exists(cursor, 'api_keys', 'api_key'):
+            return
+
+        print(f"{Fore.YELLOW}[*] Hashing stored API keys...{Style.RESET_ALL}")
+        if not self._column_exists(cursor, 'api_keys', 'key_hash'):
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS api_keys (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    label VARCHAR(255),
-                    api_key TEXT NOT NULL,
-                    administrator BOOLEAN DEFAULT FALSE
-                )
+                ALTER TABLE api_keys
+                    ADD COLUMN key_prefix VARCHAR(16) NOT NULL DEFAULT '' AFTER label,
+                    ADD COLUMN key_hash CHAR(64) NULL AFTER key_prefix
             ''')
-            # Administrator = accessing everything like an administrator account, as default its false.
 
-            conn.commit()
-            print(f"{Fore.GREEN}[+] Tables created successfully.{Style.RESET_ALL}")
-            self._create_default_users(cursor)
-            conn.commit()
-            conn.close()
-        except Error as e:
-            print(f"{Fore.RED}[-] Error creating tables: {e}{Style.RESET_ALL}")
-            raise
+        cursor.execute("SELECT id, api_key FROM api_keys")
+        rows = cursor.fetchall()
+        cursor.executemany("UPDATE api_keys SET key_prefix = %s, key_hash = %s WHERE id = %s",
+                           [(key_prefix(key), hash_key(key), key_id) for key_id, key in rows])
+
+        cursor.execute('''
+            ALTER TABLE api_keys
+                MODIFY key_prefix VARCHAR(16) NOT NULL,
+                MODIFY key_hash CHAR(64) NOT NULL,
+                ADD UNIQUE KEY uq_api_keys_hash (key_hash),
+                ADD KEY idx_api_keys_prefix (key_prefix),
+                DROP COLUMN api_key
+        ''')
+        print(f"{Fore.GREEN}[+] Hashed {len(rows)} API key(s).{Style.RESET_ALL}")
 
     def _create_default_users(self, cursor):
         users = [
@@ -140,6 +561,184 @@ class DatabaseManager:
         print(f"{Fore.YELLOW}[+] Use admin account to manage other users.{Style.RESET_ALL}")
 
 
+    def _create_image_blobs(self, cursor):
+        # one row per stored file, people_images.blob_sha256 points here (NULL for older images)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_blobs (
+                sha256 CHAR(64) PRIMARY KEY,
+                image_path VARCHAR(255) NOT NULL,
+                size BIGINT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_image_blobs_path (image_path)
+            )
+        ''')
+        if not self._column_exists(cursor, 'people_images', 'blob_sha256'):
+            cursor.execute("ALTER TABLE people_images ADD COLUMN blob_sha256 CHAR(64) NULL")
+        self._ensure_index(cursor, 'people_images', 'idx_people_images_blob', 'INDEX idx_people_images_blob (blob_sha256)')
+
+    def _add_image_hashes(self, cursor):
+        if not self._column_exists(cursor, 'people_images', 'dhash'):
+            cursor.execute("ALTER TABLE people_images ADD COLUMN dhash BIGINT UNSIGNED NULL")
+        # hashes are stored per image_path (a blob can be on several people)
+        self._ensure_index(cursor, 'people_images', 'idx_people_images_path', 'INDEX idx_people_images_path (image_path)')
+
+    def _create_dedup_tables(self, cursor):
+        # blocking keys, see dedup.py. The primary key is what finds everyone sharing a key
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS people_keys (
+                kind VARCHAR(16) NOT NULL,
+                value VARCHAR(255) NOT NULL,
+                person_id INT NOT NULL,
+                PRIMARY KEY (kind, value, person_id),
+                KEY idx_people_keys_person (person_id),
+                FOREIGN KEY (person_id) REFERENCES people(id) ON DELETE CASCADE
+            )
+        ''')
+        # scored candidate pairs, person_a < person_b
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS people_duplicates (
+                person_a INT NOT NULL,
+                person_b INT NOT NULL,
+                score FLOAT NOT NULL,
+                reasons VARCHAR(255) NOT NULL,
+                PRIMARY KEY (person_a, person_b),
+                KEY idx_people_duplicates_b (person_b),
+                KEY idx_people_duplicates_score (score),
+                FOREIGN KEY (person_a) REFERENCES people(id) ON DELETE CASCADE,
+                FOREIGN KEY (person_b) REFERENCES people(id) ON DELETE CASCADE
+            )
+        ''')
+        self._backfill(cursor, self._index_duplicates)
+
+    def _create_people_ips(self, cursor):
+        # every IP of every person as a 16 byte key (see ipranges.py), a CIDR block is one range of the primary key
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS people_ips (
+                ip BINARY(16) NOT NULL,
+                person_id INT NOT NULL,
+                PRIMARY KEY (ip, person_id),
+                KEY idx_people_ips_person (person_id),
+                FOREIGN KEY (person_id) REFERENCES people(id) ON DELETE CASCADE
+            )
+        ''')
+        self._backfill(cursor, self._index_ips)
+
+    def _create_labels(self, cursor):
+        # people.label stays the text that was typed in, these are the labels parsed out of it.
+        # The counts are kept up to date by _index_labels so facets never need a COUNT(*)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS labels (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                slug VARCHAR(100) NOT NULL,
+                name VARCHAR(100) NOT NULL,
+                people_count INT NOT NULL DEFAULT 0,
+                convicted_count INT NOT NULL DEFAULT 0,
+                UNIQUE KEY uq_labels_slug (slug),
+                KEY idx_labels_people_count (people_count)
+            )
+        ''')
+        # convicted is a copy of people.convicted, so the counts can be taken back without reading people
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS people_labels (
+                label_id INT NOT NULL,
+                person_id INT NOT NULL,
+                convicted BOOLEAN NOT NULL DEFAULT FALSE,
+                PRIMARY KEY (label_id, person_id),
+                KEY idx_people_labels_person (person_id),
+                FOREIGN KEY (label_id) REFERENCES labels(id) ON DELETE CASCADE,
+                FOREIGN KEY (person_id) REFERENCES people(id) ON DELETE CASCADE
+            )
+        ''')
+        self._backfill(cursor, self._index_labels)
+
+    def _create_people_socials(self, cursor):
+        # handle first, so looking up a handle (on any or one platform) is one probe of the primary key.
+        # platform is '' for handles typed in without a URL
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS people_socials (
+                handle VARCHAR(255) NOT NULL,
+                platform VARCHAR(50) NOT NULL DEFAULT '',
+                person_id INT NOT NULL,
+                PRIMARY KEY (handle, platform, person_id),
+                KEY idx_people_socials_person (person_id),
+                FOREIGN KEY (person_id) REFERENCES people(id) ON DELETE CASCADE
+            )
+        ''')
+        self._backfill(cursor, self._index_socials)
+
+    def _create_change_feed(self, cursor):
+        # one counter row, taking the next value locks it until commit, so changes get their
+        # change_seq in commit order and a client never misses one that commits late
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_sequence (
+                name VARCHAR(50) PRIMARY KEY,
+                value BIGINT UNSIGNED NOT NULL
+            )
+        ''')
+        cursor.execute("INSERT IGNORE INTO change_sequence (name, value) VALUES ('people', 0)")
+        # 0 is everything from before the change feed
+        if not self._column_exists(cursor, 'people', 'change_seq'):
+            cursor.execute('''
+                ALTER TABLE people
+                    ADD COLUMN change_seq BIGINT UNSIGNED NOT NULL DEFAULT 0,
+                    ADD COLUMN updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ''')
+        self._ensure_index(cursor, 'people', 'idx_people_change', 'INDEX idx_people_change (change_seq, id)')
+        # what's left of deleted people, so clients can drop them too
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS people_tombstones (
+                person_id INT PRIMARY KEY,
+                change_seq BIGINT UNSIGNED NOT NULL,
+                deleted_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                KEY idx_people_tombstones_change (change_seq, person_id)
+            )
+        ''')
+
+    def _add_change_timestamps(self, cursor):
+        # when the counter last went up, the Last-Modified of everything read from people
+        if not self._column_exists(cursor, 'change_sequence', 'changed_at'):
+            cursor.execute('''
+                ALTER TABLE change_sequence
+                    ADD COLUMN changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ''')
+
+    def _reindex_social_ids(self, cursor):
+        # the handle of every facebook.com/profile.php?id=N link used to be 'profile.php',
+        # which made all of them one person for the social lookup and duplicate detection
+        def index(cursor, people):
+            self._index_socials(cursor, people)
+            self._index_duplicates(cursor, people)
+        self._backfill(cursor, index, where="socials LIKE '%id=%'")
+
+    def _backfill(self, cursor, index, where=None):
+        """One time fill of a table derived from people (or the ones matching where), from then on index_people keeps it up to date"""
+        last_id = 0
+        while True:
+            cursor.execute(f'SELECT {self.PEOPLE_COLUMNS} FROM people WHERE id > %s {"AND " + where if where else ""} ORDER BY id LIMIT 500',
+                           (last_id,))
+            people = [self._person_from_row(row) for row in cursor.fetchall()]
+            if not people:
+                break
+            index(cursor, people)
+            last_id = people[-1]['id']
+
+    # (version, description, method), the tables of installs from before schema_version
+    # already exist, so every migration has to work on those too
+    MIGRATIONS = [
+        (1, "base tables and default users", _create_tables),
+        (2, "people search indexes", _create_people_indexes),
+        (3, "content addressed image blobs", _create_image_blobs),
+        (4, "photo hashes", _add_image_hashes),
+        (5, "duplicate detection", _create_dedup_tables),
+        (6, "IP address index", _create_people_ips),
+        (7, "labels and label counts", _create_labels),
+        (8, "social handle index", _create_people_socials),
+        (9, "change feed", _create_change_feed),
+        (10, "table version timestamps", _add_change_timestamps),
+        (11, "social handles of profile links with an id", _reindex_social_ids)
+    ]
+    SCHEMA_VERSION = MIGRATIONS[-1][0]
+
     def _hash_password(self, password):
         return hashlib.sha256(password.encode()).hexdigest()
 
@@ -149,16 +748,15 @@ class DatabaseManager:
     def authenticate_user(self, username, password):
         """Authenticate user credentials"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            password_hash = self._hash_password(password)
-            cursor.execute('''
-                SELECT id, username, is_admin
-                FROM users
-                WHERE username = %s AND password_hash = %s
-            ''', (username, password_hash))
-            user_data = cursor.fetchone()
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                password_hash = self._hash_password(password)
+                cursor.execute('''
+                    SELECT id, username, is_admin
+                    FROM users
+                    WHERE username = %s AND password_hash = %s
+                ''', (username, password_hash))
+                user_data = cursor.fetchone()
 
             if user_data:
                 self.update_last_login(user_data[0])
@@ -174,40 +772,39 @@ class DatabaseManager:
 
     def update_last_login(self, user_id):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = %s', (user_id,))
-            conn.commit()
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = %s', (user_id,))
+                conn.commit()
         except Error as e:
             print(f"{Fore.RED}[-] Error updating last login: {e}{Style.RESET_ALL}")
 
     def add_user(self, username, password, is_admin=False):
+        """Returns the new user's id, None if the username is taken or on errors"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            password_hash = self._hash_password(password)
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, is_admin)
-                VALUES (%s, %s, %s)
-            ''', (username, password_hash, int(is_admin)))
-            conn.commit()
-            conn.close()
-            return True
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                password_hash = self._hash_password(password)
+                cursor.execute('''
+                    INSERT INTO users (username, password_hash, is_admin)
+                    VALUES (%s, %s, %s)
+                ''', (username, password_hash, int(is_admin)))
+                user_id = cursor.lastrowid
+                conn.commit()
+            return user_id
         except mysql.connector.IntegrityError:
             print(f"{Fore.YELLOW}[*] User '{username}' already exists.{Style.RESET_ALL}")
-            return False
+            return None
         except Error as e:
             print(f"{Fore.RED}[-] Error adding user: {e}{Style.RESET_ALL}")
-            return False
+            return None
 
     def get_user_by_id(self, user_id):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, username, is_admin FROM users WHERE id = %s', (user_id,))
-            row = cursor.fetchone()
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT id, username, is_admin FROM users WHERE id = %s', (user_id,))
+                row = cursor.fetchone()
             if row:
                 return {'id': row[0], 'username': row[1], 'is_admin': bool(row[2])}
             return None
@@ -215,13 +812,24 @@ class DatabaseManager:
             print(f"{Fore.RED}[-] Error getting user by ID: {e}{Style.RESET_ALL}")
             return None
 
+    def get_session_user(self, user_id):
+        """get_user_by_id for flask_login, cached so a page view doesn't need a query"""
+        user = self.user_cache.get(user_id)
+        if user is not MISSING:
+            return user
+        epoch = self.user_cache.epoch()
+        user = self.get_user_by_id(user_id)
+        if user:
+            # unknown ids and errors aren't cached, a deleted user just keeps missing
+            self.user_cache.set(user_id, user, epoch=epoch)
+        return user
+
     def get_all_users(self):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, username, is_admin, created_at, last_login FROM users ORDER BY username')
-            rows = cursor.fetchall()
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT id, username, is_admin, created_at, last_login FROM users ORDER BY username')
+                rows = cursor.fetchall()
             users = []
             for row in rows:
                 users.append({
@@ -237,18 +845,25 @@ class DatabaseManager:
             return []
 
     def edit_user(self, user_id, username=None, password=None, is_admin=None):
+        """One UPDATE for whatever is given, a row that ends up the same isn't written by MySQL"""
+        values = {}
+        if username:
+            values['username'] = username
+        if password:
+            values['password_hash'] = self._hash_password(password)
+        if is_admin is not None:
+            values['is_admin'] = int(is_admin)
+        if not values:
+            return True
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            if username:
-                cursor.execute('UPDATE users SET username = %s WHERE id = %s', (username, user_id))
-            if password:
-                password_hash = self._hash_password(password)
-                cursor.execute('UPDATE users SET password_hash = %s WHERE id = %s', (password_hash, user_id))
-            if is_admin is not None:
-                cursor.execute('UPDATE users SET is_admin = %s WHERE id = %s', (int(is_admin), user_id))
-            conn.commit()
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"UPDATE users SET {', '.join(f'{column} = %s' for column in values)} WHERE id = %s",
+                               list(values.values()) + [user_id])
+                changed = cursor.rowcount
+                conn.commit()
+            if changed:
+                self.user_cache.invalidate()
             return True
         except Error as e:
             print(f"{Fore.RED}[-] Error editing user: {e}{Style.RESET_ALL}")
@@ -256,11 +871,11 @@ class DatabaseManager:
 
     def delete_user(self, user_id):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
-            conn.commit()
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
+                conn.commit()
+            self.user_cache.invalidate()
             return True
         except Error as e:
             print(f"{Fore.RED}[-] Error deleting user: {e}{Style.RESET_ALL}")
@@ -270,143 +885,753 @@ class DatabaseManager:
     # Predator methods (when adding a new info storer you need to add it here insert it)
     # -----------------------------
     
-    def add_person(self, name, description, address=None, phone=None, email=None, ipaddress=None, label=None, convicted=False, socials=None, image_paths=None):
+    def add_person(self, name, description, address=None, phone=None, email=None, ipaddress=None, label=None, convicted=False, socials=None, image_paths=None, uploads=()):
+        """
+        Add a person with their images (stored image paths and/or uploads, a list of (file object,
+        filename) like add_person_images) in one transaction. Returns the new id, or None if nothing
+        was added; files stored for the uploads are removed again then.
+        """
         import json
+        # Convert socials list to JSON string if needed
+        if socials and isinstance(socials, list):
+            socials = json.dumps(socials)
+        staged = []
+        created = []
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            for stream, filename in uploads:
+                staged.append(self.image_store.stage(stream, filename))
 
-            # Convert socials list to JSON string if needed
-            if socials and isinstance(socials, list):
-                socials = json.dumps(socials)
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    # Insert predator
+                    cursor.execute('''
+                        INSERT INTO people (name, address, phone, email, ipaddress, label, description, convicted, socials)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ''', (name, address, phone, email, ipaddress, label, description, int(convicted), socials))
 
-            # Insert predator
-            cursor.execute('''
-                INSERT INTO people (name, address, phone, email, ipaddress, label, description, convicted, socials)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (name, address, phone, email, ipaddress, label, description, int(convicted), socials))
+                    person_id = cursor.lastrowid  # the new predator's ID, from this connection's own insert
+                    self.index_people(cursor, [{'id': person_id, 'name': name, 'phone': phone, 'email': email, 'ipaddress': ipaddress, 'socials': socials, 'label': label, 'convicted': convicted}])
 
-            person_id = cursor.lastrowid  # get the new predator's ID
+                    images = self._insert_image_rows(cursor, person_id, list(image_paths or []) + self._place_uploads(cursor, staged, created))
+                    self.record_changes(cursor, [person_id])
+                    conn.commit()
+                except BaseException:
+                    # nobody else can see these files yet, the blob rows are still locked
+                    for path in created:
+                        self.image_store.remove(path)
+                    raise
+            self.people_changed()
+            self.suggest.update({'id': person_id, 'name': name, 'email': email, 'socials': socials})
+            if images:
+                self.thumbnails.submit(images)
+            return person_id
+        except (Error, OSError) as e:
+            print(f"{Fore.RED}[-] Error adding predator: {e}{Style.RESET_ALL}")
+            return None
+        finally:
+            for image in staged:
+                self.image_store.discard(image)
 
-            # Insert images if provided
-            if image_paths:
-                for path in image_paths:
-                    cursor.execute('''
-                        INSERT INTO people_images (person_id, image_path)
-                        VALUES (%s, %s)
-                    ''', (person_id, path))
 
-            conn.commit()
-            conn.close()
-            return True
+    def insert_people(self, cursor, people):
+        """
+        Insert validated people (see validate_person) and their 'images' (list of paths, optional)
+        without committing. Returns the new ids in the same order.
+        Their derived rows (see index_people) and change feed entry are added in the same transaction.
+        """
+        # one INSERT per person: with innodb_autoinc_lock_mode=2 (the MySQL 8 default) a multi-row
+        # INSERT doesn't have to get consecutive ids, and a row is at most a few 64KB TEXT values
+        # so no statement gets near max_allowed_packet
+        ids = []
+        for person in people:
+            cursor.execute(f'''
+                INSERT INTO people ({', '.join(PERSON_FIELDS)})
+                VALUES ({', '.join(['%s'] * len(PERSON_FIELDS))})
+            ''', tuple(int(person[f]) if f == 'convicted' else person[f] for f in PERSON_FIELDS))
+            ids.append(cursor.lastrowid)
+
+        images = [(person_id, path) for person, person_id in zip(people, ids) for path in person.get('images') or []]
+        if images:
+            cursor.executemany("INSERT INTO people_images (person_id, image_path) VALUES (%s, %s)", images)
+        self.index_people(cursor, [dict(person, id=person_id) for person, person_id in zip(people, ids)])
+        self.record_changes(cursor, ids)
+        return ids
+
+    def add_people(self, people):
+        """
+        Insert validated people in one transaction.
+        Returns the new ids in the same order, or None if the whole batch failed.
+        """
+        if not people:
+            return []
+        try:
+            with self.get_connection() as conn:
+                ids = self.insert_people(conn.cursor(), people)
+                conn.commit()
+            self.people_changed()
+            self.suggest.update_many([dict(person, id=person_id) for person, person_id in zip(people, ids)])
+            return ids
         except Error as e:
-            print(f"{Fore.RED}[-] Error adding predator: {e}{Style.RESET_ALL}")
-            return False
+            print(f"{Fore.RED}[-] Error adding people: {e}{Style.RESET_ALL}")
+            return None
 
+    # column order used by _person_from_row
+    PEOPLE_COLUMNS = 'id, name, address, phone, email, ipaddress, label, description, convicted, socials'
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+
+    def _person_from_row(self, row):
+        return {
+            'id': row[0],
+            'name': row[1],
+            'address': row[2],
+            'phone': row[3],
+            'email': row[4],
+            'ipaddress': row[5],
+            'label': row[6],
+            'description': row[7],
+            'convicted': bool(row[8]),
+            'socials': row[9]
+        }
 
     def get_all_people(self):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM people')
-            rows = cursor.fetchall()
-            conn.close()
-            people = []
-            for row in rows:
-                people.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'address': row[2],
-                    'phone': row[3],
-                    'email': row[4],
-                    'ipaddress': row[5],
-                    'label': row[6],
-                    'description': row[7],
-                    'convicted': bool(row[8]),
-                    'socials': row[9]
-                })
-            return people
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'SELECT {self.PEOPLE_COLUMNS} FROM people')
+                rows = cursor.fetchall()
+            return [self._person_from_row(row) for row in rows]
         except Error as e:
             print(f"{Fore.RED}[-] Error getting all people: {e}{Style.RESET_ALL}")
             return []
 
+    def _load_images(self, cursor, person_ids):
+        """{person_id: [image paths]} for many people with one query"""
+        images = {person_id: [] for person_id in person_ids}
+        if not images:
+            return images
+        placeholders = ', '.join(['%s'] * len(images))
+        cursor.execute(f'SELECT person_id, image_path FROM people_images WHERE person_id IN ({placeholders}) ORDER BY person_id, id',
+                       list(images))
+        for person_id, path in cursor.fetchall():
+            images[person_id].append(path)
+        return images
+
+    def _attach_images(self, cursor, people):
+        images = self._load_images(cursor, [person['id'] for person in people])
+        for person in people:
+            person['images'] = images[person['id']]
+
+    def get_images_for(self, person_ids):
+        """Images of many people in one round trip, {person_id: [image paths]}"""
+        try:
+            with self.get_connection() as conn:
+                return self._load_images(conn.cursor(), person_ids)
+        except Error as e:
+            print(f"{Fore.RED}[-] Error fetching predator images: {e}{Style.RESET_ALL}")
+            return {person_id: [] for person_id in person_ids}
+
+    def get_people(self, person_ids):
+        """
+        Many people by id with their images, on one connection with one query for the people
+        and one for the images. Returns (people in the order of person_ids, ids that don't exist)
+        or None on errors. Ids that are asked for twice are only returned once.
+        """
+        person_ids = list(dict.fromkeys(person_ids))
+        if not person_ids:
+            return [], []
+        if self.read_model:
+            result = self.read_model.get_people(person_ids)
+            if result is not MISSING:
+                return result
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT {self.PEOPLE_COLUMNS} FROM people WHERE id IN ({', '.join(['%s'] * len(person_ids))})", person_ids)
+                found = {person['id']: person for person in map(self._person_from_row, cursor.fetchall())}
+                self._attach_images(cursor, list(found.values()))
+            people = [found[person_id] for person_id in person_ids if person_id in found]
+            return people, [person_id for person_id in person_ids if person_id not in found]
+        except Error as e:
+            print(f"{Fore.RED}[-] Error fetching people: {e}{Style.RESET_ALL}")
+            return None
+
+    def get_person_details(self, person_ids, with_images=True):
+        """{person_id: (description, [image paths])} of the people that exist, for the read model. None on errors"""
+        details = {}
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                for start in range(0, len(person_ids), 500):
+                    chunk = list(person_ids[start:start + 500])
+                    cursor.execute(f"SELECT id, description FROM people WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+                    rows = cursor.fetchall()
+                    images = self._load_images(cursor, [row[0] for row in rows]) if with_images else {}
+                    for person_id, description in rows:
+                        details[person_id] = (description, images.get(person_id, []))
+            return details
+        except Error as e:
+            print(f"{Fore.RED}[-] Error fetching people details: {e}{Style.RESET_ALL}")
+            return None
+
+    def get_people_page(self, limit=None, after=None, with_images=False, label=None, convicted=None):
+        """
+        Keyset pagination on id, returns (people, next_cursor).
+        Pass next_cursor back as `after` to get the next page, it's None on the last page.
+        with_images adds an 'images' list to every person (one extra query for the whole page).
+        label (a slug from get_label_facets) and convicted (True/False) filter the list.
+        """
+        limit = max(1, min(limit or self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE))
+        if self.read_model:
+            page = self.read_model.get_people_page(limit, after, with_images, label, convicted)
+            if page is not MISSING:
+                return page
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                if label:
+                    # walks the (label_id, person_id) primary key, already in id order
+                    query = f'''
+                        SELECT {', '.join('p.' + column for column in self.PEOPLE_COLUMNS.split(', '))}
+                        FROM people_labels pl JOIN people p ON p.id = pl.person_id
+                        WHERE pl.label_id = (SELECT id FROM labels WHERE slug = %s) AND pl.person_id > %s
+                    '''
+                    params = [label, after or 0]
+                    if convicted is not None:
+                        query += ' AND pl.convicted = %s'
+                        params.append(int(convicted))
+                    query += ' ORDER BY pl.person_id LIMIT %s'
+                else:
+                    query = f'SELECT {self.PEOPLE_COLUMNS} FROM people WHERE id > %s'
+                    params = [after or 0]
+                    if convicted is not None:
+                        query += ' AND convicted = %s'
+                        params.append(int(convicted))
+                    query += ' ORDER BY id LIMIT %s'
+                # one extra row tells us if there is a next page
+                cursor.execute(query, params + [limit + 1])
+                rows = cursor.fetchall()
+                people = [self._person_from_row(row) for row in rows[:limit]]
+                if with_images:
+                    self._attach_images(cursor, people)
+            next_cursor = people[-1]['id'] if len(rows) > limit else None
+            return people, next_cursor
+        except Error as e:
+            print(f"{Fore.RED}[-] Error getting people page: {e}{Style.RESET_ALL}")
+            return [], None
+
+    def get_people_by_ip(self, cidr, limit=None, after=None, with_images=False):
+        """
+        People with an IP in a CIDR block (203.0.113.0/24, 2001:db8::/32) or equal to a single
+        address, paged like get_people_page. One range scan on people_ips, ValueError for a bad cidr.
+        """
+        first, last = ipranges.cidr_range(cidr)
+        limit = max(1, min(limit or self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE))
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT {self.PEOPLE_COLUMNS} FROM people
+                    WHERE id IN (SELECT person_id FROM people_ips WHERE ip BETWEEN %s AND %s) AND id > %s
+                    ORDER BY id LIMIT %s
+                ''', (first, last, after or 0, limit + 1))
+                rows = cursor.fetchall()
+                people = [self._person_from_row(row) for row in rows[:limit]]
+                if with_images:
+                    self._attach_images(cursor, people)
+            next_cursor = people[-1]['id'] if len(rows) > limit else None
+            return people, next_cursor
+        except Error as e:
+            print(f"{Fore.RED}[-] Error getting people by IP: {e}{Style.RESET_ALL}")
+            return [], None
+
+    def get_people_by_social(self, handle, platform=None, limit=None, after=None, with_images=False):
+        """
+        People with a social handle ('@someone', 'someone' or a profile URL), paged like get_people_page.
+        With a platform (or a URL) only accounts on that platform and bare handles match.
+        ValueError if there's no handle in it.
+        """
+        accounts = parse_social_accounts(handle)
+        if len(accounts) != 1:
+            raise ValueError(f"'{handle}' is not a social handle")
+        url_platform, handle = accounts.pop()
+        platform = (platform or url_platform).strip().lower()
+        limit = max(1, min(limit or self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE))
+        query = 'SELECT person_id FROM people_socials WHERE handle = %s'
+        params = [handle]
+        if platform:
+            query += " AND platform IN (%s, '')"
+            params.append(platform)
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT {self.PEOPLE_COLUMNS} FROM people
+                    WHERE id IN ({query}) AND id > %s
+                    ORDER BY id LIMIT %s
+                ''', params + [after or 0, limit + 1])
+                rows = cursor.fetchall()
+                people = [self._person_from_row(row) for row in rows[:limit]]
+                if with_images:
+                    self._attach_images(cursor, people)
+            next_cursor = people[-1]['id'] if len(rows) > limit else None
+            return people, next_cursor
+        except Error as e:
+            print(f"{Fore.RED}[-] Error getting people by social handle: {e}{Style.RESET_ALL}")
+            return [], None
+
+    def iter_people(self, after=None):
+        """
+        Yield every person (ordered by id) from an unbuffered cursor, so only one row
+        is in memory at a time. The pooled connection is held until the generator is done or closed.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor(buffered=False)
+            cursor.execute(f'SELECT {self.PEOPLE_COLUMNS} FROM people WHERE id > %s ORDER BY id', (after or 0,))
+            for row in cursor:
+                yield self._person_from_row(row)
+
+    def _like_escape(self, text):
+        return re.sub(r'([\\%_])', r'\\\1', text)
+
+    def _like_prefix(self, text):
+        """LIKE pattern matching values that start with text (so a B-tree index can be used)"""
+        return self._like_escape(text) + '%'
+
+    def search_people(self, query, limit=None, page=1, with_images=False):
+        """
+        Search people by name/description/label (FULLTEXT, ranked by relevance) and by
+        the start of phone/email/ipaddress (B-tree indexes). Returns (people, has_next_page),
+        each person gets a 'score', field matches rank above text matches.
+        """
+        query = (query or '').strip()
+        if not query:
+            return [], False
+        limit = max(1, min(limit or self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE))
+        offset = (max(page or 1, 1) - 1) * limit
+
+        # every word has to match, the last letters can be missing so it works while typing.
+        # words shorter than innodb_ft_min_token_size (3) aren't in the index so they're left out
+        words = [word for word in re.findall(r'\w+', query) if len(word) >= 3]
+        boolean_query = ' '.join(f'+{word}*' for word in words)
+
+        parts = []
+        params = []
+        if boolean_query:
+            parts.append('''
+                SELECT id, MATCH(name, description, label) AGAINST (%s IN BOOLEAN MODE) AS score
+                FROM people WHERE MATCH(name, description, label) AGAINST (%s IN BOOLEAN MODE)
+            ''')
+            params += [boolean_query, boolean_query]
+        like = self._like_prefix(query)
+        for column in ('phone', 'email', 'ipaddress'):
+            parts.append(f'SELECT id, 1000 AS score FROM people WHERE {column} LIKE %s')
+            params.append(like)
+
+        columns = ', '.join(f'p.{c}' for c in self.PEOPLE_COLUMNS.split(', '))
+        sql = f'''
+            SELECT {columns}, MAX(m.score) AS score
+            FROM ({' UNION ALL '.join(parts)}) m
+            JOIN people p ON p.id = m.id
+            GROUP BY p.id
+            ORDER BY score DESC, p.id
+            LIMIT %s OFFSET %s
+        '''
+        params += [limit + 1, offset]
+
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+                people = []
+                for row in rows[:limit]:
+                    person = self._person_from_row(row)
+                    person['score'] = float(row[10])
+                    people.append(person)
+                if with_images:
+                    self._attach_images(cursor, people)
+            return people, len(rows) > limit
+        except Error as e:
+            print(f"{Fore.RED}[-] Error searching people: {e}{Style.RESET_ALL}")
+            return [], False
+
+    def iter_people_with_images(self, label=None, convicted=None, after=None, dedicated=False):
+        """
+        Yield every person (ordered by id) with an 'images' list, people and people_images are
+        joined in one query and read from an unbuffered cursor so memory doesn't grow with the table.
+        label matches people whose label contains it, convicted filters on True/False.
+        dedicated reads on a connection outside the pool, for streaming to a client.
+        """
+        where = ["p.id > %s"]
+        params = [after or 0]
+        if label:
+            where.append("p.label LIKE %s")
+            params.append('%' + self._like_escape(label) + '%')
+        if convicted is not None:
+            where.append("p.convicted = %s")
+            params.append(int(convicted))
+        columns = ', '.join(f'p.{c}' for c in self.PEOPLE_COLUMNS.split(', '))
+        sql = f'''
+            SELECT {columns}, i.image_path
+            FROM people p LEFT JOIN people_images i ON i.person_id = p.id
+            WHERE {' AND '.join(where)}
+            ORDER BY p.id
+        '''
+        with (self.get_dedicated_connection() if dedicated else self.get_connection()) as conn:
+            cursor = conn.cursor(buffered=False)
+            cursor.execute(sql, params)
+            person = None
+            # rows of one person are next to each other, a person is done when the id changes
+            for row in cursor:
+                if person is None or person['id'] != row[0]:
+                    if person is not None:
+                        yield person
+                    person = self._person_from_row(row)
+                    person['images'] = []
+                if row[10] is not None:
+                    person['images'].append(row[10])
+            if person is not None:
+                yield person
+
+    def suggest_people(self, prefix, limit=10):
+        """Typeahead: people whose name, email or social handle starts with prefix (served from memory)"""
+        return self.suggest.search(prefix, max(1, min(limit or 10, 50)))
+
     def get_person(self, person_id):
+        if self.read_model:
+            person = self.read_model.get_person(person_id)
+            if person is not MISSING:
+                return person
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor(dictionary=True)
+            with self.get_connection() as conn:
+                cursor = conn.cursor(dictionary=True)
 
-            cursor.execute('SELECT * FROM people WHERE id=%s', (person_id,))
-            row = cursor.fetchone()
-            if not row:
-                return None
+                cursor.execute('SELECT * FROM people WHERE id=%s', (person_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return None
 
-            predator = {
-                'id': row['id'],
-                'name': row['name'],
-                'address': row['address'],
-                'phone': row['phone'],
-                'email': row['email'],
-                'ipaddress': row['ipaddress'],
-                'label': row['label'],
-                'description': row['description'],
-                'convicted': bool(row['convicted']),
-                'socials': row['socials']
-            }
+                predator = {
+                    'id': row['id'],
+                    'name': row['name'],
+                    'address': row['address'],
+                    'phone': row['phone'],
+                    'email': row['email'],
+                    'ipaddress': row['ipaddress'],
+                    'label': row['label'],
+                    'description': row['description'],
+                    'convicted': bool(row['convicted']),
+                    'socials': row['socials']
+                }
 
-            # Get images
-            cursor.execute('SELECT image_path FROM people_images WHERE person_id=%s', (person_id,))
-            images = [r['image_path'] for r in cursor.fetchall()]
-            predator['images'] = images
+                # Get images
+                cursor.execute('SELECT image_path FROM people_images WHERE person_id=%s', (person_id,))
+                images = [r['image_path'] for r in cursor.fetchall()]
+                predator['images'] = images
 
-            conn.close()
             return predator
         except Error as e:
             print(f"{Fore.RED}[-] Error fetching predator: {e}{Style.RESET_ALL}")
             return None
 
     def update_person(self, person_id, name, description, address=None, phone=None, email=None, ipaddress=None, label=None, convicted=False, socials=None):
+        """Set every field of a person, only the ones that are different get written (see patch_person)"""
+        changed = self.patch_person(person_id, {
+            'name': name, 'description': description, 'address': address, 'phone': phone, 'email': email,
+            'ipaddress': ipaddress, 'label': label, 'convicted': convicted, 'socials': socials
+        })
+        return changed is not None and changed is not False
+
+    def patch_person(self, person_id, fields=None, add_images=(), remove_images=(), uploads=(), images=None):
+        """
+        Change some fields of a person (a dict of PERSON_FIELDS) and their images in one transaction.
+        Only the columns that are really different are written, in one UPDATE. Images are added
+        (stored image paths, or uploads like add_person_images) and removed as deltas, `images`
+        is the whole new list instead. Returns the names of what changed ('images' for images),
+        None if there's no such person and False on errors.
+        """
+        import json
+        fields = {field: value for field, value in (fields or {}).items() if field in PERSON_FIELDS}
+        if isinstance(fields.get('socials'), list):
+            fields['socials'] = json.dumps(fields['socials'])
+        staged = []
+        created = []
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE people SET name=%s, description=%s, address=%s, phone=%s, email=%s, ipaddress=%s, label=%s, convicted=%s, socials=%s WHERE id=%s", 
-                           (name, description, address, phone, email, ipaddress, label, int(convicted), socials, person_id))
-            conn.commit()
-            conn.close()
-            return True
-        except Error as e:
+            for stream, filename in uploads:
+                staged.append(self.image_store.stage(stream, filename))
+
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    # locks the person first, like every other write to a person
+                    cursor.execute(f'SELECT {self.PEOPLE_COLUMNS} FROM people WHERE id = %s FOR UPDATE', (person_id,))
+                    row = cursor.fetchone()
+                    if not row:
+                        return None
+                    person = self._person_from_row(row)
+                    diff = {field: value for field, value in fields.items()
+                            if (bool(value) if field == 'convicted' else value) != person[field]}
+                    if diff:
+                        cursor.execute(f"UPDATE people SET {', '.join(f'{field} = %s' for field in diff)} WHERE id = %s",
+                                       [int(value) if field == 'convicted' else value for field, value in diff.items()] + [person_id])
+                        person.update(diff)
+                        self.index_people(cursor, [person], changed=diff)
+
+                    add_images, remove_images = list(add_images), list(remove_images)
+                    if images is not None or add_images:
+                        current = self._load_images(cursor, [person_id])[person_id]
+                        if images is not None:
+                            add_images += images
+                            remove_images += [path for path in current if path not in images]
+                        add_images = [path for path in dict.fromkeys(add_images) if path not in current]
+                    removed, orphans = self._delete_image_rows(cursor, person_id, remove_images) if remove_images else ([], [])
+                    added = self._insert_image_rows(cursor, person_id, add_images + self._place_uploads(cursor, staged, created))
+
+                    changed = list(diff) + (['images'] if removed or added else [])
+                    if changed:
+                        self.record_changes(cursor, [person_id])
+                    conn.commit()
+                except BaseException:
+                    # nobody else can see these files yet, the blob rows are still locked
+                    for path in created:
+                        self.image_store.remove(path)
+                    raise
+                self._remove_orphans(conn, orphans)
+            if changed:
+                self.people_changed()
+            if diff.keys() & {'name', 'email', 'socials'}:
+                self.suggest.update(person)
+            if removed:
+                self.photos.remove(removed)
+            if added:
+                self.thumbnails.submit(added)
+            return changed
+        except (Error, OSError) as e:
             print(f"{Fore.RED}[-] Error updating person: {e}{Style.RESET_ALL}")
             return False
+        finally:
+            for image in staged:
+                self.image_store.discard(image)
 
     def update_person_images(self, person_id, new_image_paths):
+        """Set the image list of a person, only the images that are new or gone are written (see patch_person)"""
+        changed = self.patch_person(person_id, images=list(new_image_paths))
+        return changed is not None and changed is not False
+
+    def add_person_images(self, person_id, uploads):
+        """
+        Store uploaded files, a list of (file object, filename), and attach them to a person.
+        Files are streamed to disk and hashed first, a file that's already stored (for anyone)
+        isn't written again. Returns the new image paths or None.
+        """
+        staged = []
+        created = []
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            for stream, filename in uploads:
+                staged.append(self.image_store.stage(stream, filename))
 
-            # Delete old images
-            cursor.execute('DELETE FROM people_images WHERE person_id=%s', (person_id,))
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    self._lock_person(cursor, person_id)
+                    paths = self._insert_image_rows(cursor, person_id, self._place_uploads(cursor, staged, created))
+                    if paths:
+                        self.record_changes(cursor, [person_id])
+                    conn.commit()
+                except BaseException:
+                    # nobody else can see these files yet, the blob rows are still locked
+                    for path in created:
+                        self.image_store.remove(path)
+                    raise
+            if paths:
+                self.people_changed()
+                self.thumbnails.submit(paths)
+            return paths
+        except (Error, OSError) as e:
+            print(f"{Fore.RED}[-] Error storing predator images: {e}{Style.RESET_ALL}")
+            return None
+        finally:
+            for image in staged:
+                self.image_store.discard(image)
 
-            # Insert new images
-            for path in new_image_paths:
-                cursor.execute('INSERT INTO people_images (person_id, image_path) VALUES (%s, %s)',
-                               (person_id, path))
+    def _place_uploads(self, cursor, staged, created):
+        """
+        Put staged uploads in the store and their image_blobs rows in the database, returns their
+        image paths. Files that didn't exist before are added to created, for cleaning up.
+        """
+        paths = []
+        for image in staged:
+            # the blob row stays locked until commit so _release_blobs can't delete it meanwhile
+            cursor.execute('''
+                INSERT INTO image_blobs (sha256, image_path, size) VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE sha256 = sha256
+            ''', (image.sha256, self.image_store.image_path(image.sha256, image.ext), image.size))
+            cursor.execute('SELECT image_path FROM image_blobs WHERE sha256 = %s FOR UPDATE', (image.sha256,))
+            path, new = self.image_store.place(image, cursor.fetchone()[0])
+            if new:
+                created.append(path)
+            paths.append(path)
+        return paths
 
-            conn.commit()
-            conn.close()
+    def _insert_image_rows(self, cursor, person_id, image_paths):
+        """Attach image paths to a person (with their blob when it's a stored one), returns them"""
+        if not image_paths:
+            return []
+        blobs = self._blob_shas(cursor, image_paths)
+        cursor.executemany('INSERT INTO people_images (person_id, image_path, blob_sha256) VALUES (%s, %s, %s)',
+                           [(person_id, path, blobs.get(path)) for path in image_paths])
+        return list(image_paths)
+
+    def _delete_image_rows(self, cursor, person_id, image_paths=None):
+        """
+        Detach some (None: all) images of a person and release their blobs.
+        Returns the removed row ids and the orphaned blobs (see _release_blobs).
+        """
+        query = 'SELECT id, blob_sha256 FROM people_images WHERE person_id = %s'
+        params = [person_id]
+        if image_paths is not None:
+            if not image_paths:
+                return [], []
+            query += f" AND image_path IN ({', '.join(['%s'] * len(image_paths))})"
+            params += list(image_paths)
+        cursor.execute(query + ' FOR UPDATE', params)
+        rows = cursor.fetchall()
+        orphans = []
+        if rows:
+            cursor.execute(f"DELETE FROM people_images WHERE id IN ({', '.join(['%s'] * len(rows))})",
+                           [row[0] for row in rows])
+            orphans = self._release_blobs(cursor, [row[1] for row in rows])
+        return [row[0] for row in rows], orphans
+
+    def remove_person_images(self, person_id, image_paths=None):
+        """Detach some (or all) images of a person, files nobody else uses get deleted"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._lock_person(cursor, person_id)
+                removed, orphans = self._delete_image_rows(cursor, person_id, image_paths)
+                if removed:
+                    self.record_changes(cursor, [person_id])
+                conn.commit()
+                self._remove_orphans(conn, orphans)
+            if removed:
+                self.people_changed()
+            self.photos.remove(removed)
             return True
         except Error as e:
-            print(f"{Fore.RED}[-] Error updating predator images: {e}{Style.RESET_ALL}")
+            print(f"{Fore.RED}[-] Error removing predator images: {e}{Style.RESET_ALL}")
             return False
 
-    def delete_person(self, person_id):
+    def iter_image_hashes(self):
+        """Yield (image id, person id, photo hash) of every image that has a hash, unbuffered"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor(buffered=False)
+            cursor.execute('SELECT id, person_id, dhash FROM people_images WHERE dhash IS NOT NULL')
+            for row in cursor:
+                yield row
+
+    def _hash_image(self, image_path):
+        """Store the photo hash of an image for every row that uses it (runs in the thumbnail threads)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, person_id FROM people_images WHERE image_path = %s AND dhash IS NULL', (image_path,))
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            photo_hash = dhash(self.image_store.file_path(image_path))
+            cursor.execute('UPDATE people_images SET dhash = %s WHERE image_path = %s AND dhash IS NULL', (photo_hash, image_path))
+            conn.commit()
+        self.photos.update([(image_id, person_id, photo_hash) for image_id, person_id in rows])
+
+    def match_photo(self, stream, max_distance=10, limit=20):
         """
-        Delete a predator. Images are deleted automatically in the DB due to ON DELETE CASCADE.
+        People that have the photo in stream (a file object), or one within max_distance bits
+        of its hash: [{'person_id', 'image_id', 'distance'}] closest first.
+        None while the index is still loading, ValueError if it's not an image.
         """
         try:
-            conn = self.get_connection()
+            photo_hash = dhash(stream)
+        except OSError as e: # what Pillow raises for files it can't read
+            raise ValueError(f"not an image: {e}")
+        max_distance = max(0, min(max_distance, MAX_DISTANCE))
+        return self.photos.search(photo_hash, max_distance, max(1, min(limit or 20, 100)))
+
+    def _lock_person(self, cursor, person_id):
+        # writes that don't update the people row itself take its lock first anyway, so every
+        # write to a person locks the person before its images, labels or the change sequence
+        cursor.execute('SELECT id FROM people WHERE id = %s FOR UPDATE', (person_id,))
+        cursor.fetchall()
+
+    def _blob_shas(self, cursor, image_paths):
+        """image_path -> sha256 for the paths that are stored blobs"""
+        if not image_paths:
+            return {}
+        cursor.execute(f"SELECT image_path, sha256 FROM image_blobs WHERE image_path IN ({', '.join(['%s'] * len(image_paths))})",
+                       list(image_paths))
+        return dict(cursor.fetchall())
+
+    def _release_blobs(self, cursor, shas):
+        """
+        Delete the image_blobs rows no people_images row points at anymore. Call it after deleting
+        people_images rows and before the commit. Returns the orphaned blobs, (sha256, image_path)
+        pairs whose files go with _remove_orphans once the commit went through.
+        """
+        orphans = []
+        for sha in sorted(set(sha for sha in shas if sha)):
+            cursor.execute('SELECT image_path FROM image_blobs WHERE sha256 = %s FOR UPDATE', (sha,))
+            row = cursor.fetchone()
+            if not row:
+                continue
+            # locking read so an upload committed after our snapshot is seen
+            cursor.execute('SELECT id FROM people_images WHERE blob_sha256 = %s LIMIT 1 FOR UPDATE', (sha,))
+            if cursor.fetchone():
+                continue
+            cursor.execute('DELETE FROM image_blobs WHERE sha256 = %s', (sha,))
+            orphans.append((sha, row[0]))
+        return orphans
+
+    def _remove_orphans(self, conn, orphans):
+        """
+        Delete the files of blobs a committed transaction released (see _release_blobs). A file that
+        was uploaded again in the meantime has a blob row again and stays, the locking read keeps
+        such an upload waiting until the file is gone. Files that can't be removed are only logged.
+        """
+        if not orphans:
+            return
+        try:
             cursor = conn.cursor()
-            cursor.execute('DELETE FROM people WHERE id = %s', (person_id,))
+            for sha, image_path in orphans:
+                cursor.execute('SELECT image_path FROM image_blobs WHERE sha256 = %s FOR UPDATE', (sha,))
+                if not cursor.fetchall():
+                    self.image_store.remove(image_path)
             conn.commit()
-            conn.close()
+        except (Error, OSError) as e:
+            print(f"{Fore.RED}[-] Error removing released image files: {e}{Style.RESET_ALL}")
+
+    def delete_person(self, person_id):
+        """
+        Delete a predator. Images are deleted automatically in the DB due to ON DELETE CASCADE,
+        their files too unless another person uses the same one.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._lock_person(cursor, person_id)
+                cursor.execute('SELECT id, blob_sha256 FROM people_images WHERE person_id = %s', (person_id,))
+                images = cursor.fetchall()
+                self._unindex_labels(cursor, [person_id])
+                cursor.execute('DELETE FROM people WHERE id = %s', (person_id,))
+                deleted = cursor.rowcount
+                orphans = self._release_blobs(cursor, [row[1] for row in images])
+                if deleted:
+                    self.record_changes(cursor, deleted_ids=[person_id])
+                conn.commit()
+                self._remove_orphans(conn, orphans)
+            self.people_changed()
+            self.suggest.remove(person_id)
+            self.photos.remove([row[0] for row in images])
             return True
         except Error as e:
             print(f"{Fore.RED}[-] Error deleting predator: {e}{Style.RESET_ALL}")
@@ -414,25 +1639,322 @@ class DatabaseManager:
 
     def get_person_images(self, person_id):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT image_path FROM people_images WHERE id=%s', (person_id,))
-            images = [r[0] for r in cursor.fetchall()]
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT image_path FROM people_images WHERE person_id=%s ORDER BY id', (person_id,))
+                images = [r[0] for r in cursor.fetchall()]
             
             return images
         except Error as e:
             print(f"{Fore.RED}[-] Error fetching predator images: {e}{Style.RESET_ALL}")
             return []
     
+    # -----------------------------
+    # Change feed, what clients need to catch up since their last sync
+    # -----------------------------
+    def record_changes(self, cursor, person_ids=(), deleted_ids=()):
+        """
+        Give people that were just written (or deleted) the next change_seq, inside the caller's
+        transaction and right before its commit. The people rows have to be locked by then
+        (written, deleted or _lock_person), the sequence row stays locked until the commit.
+        """
+        person_ids = list(person_ids)
+        deleted_ids = list(deleted_ids)
+        if not person_ids and not deleted_ids:
+            return None
+        cursor.execute("UPDATE change_sequence SET value = LAST_INSERT_ID(value + 1) WHERE name = 'people'")
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        seq = cursor.fetchone()[0]
+        for start in range(0, len(person_ids), 500):
+            chunk = person_ids[start:start + 500]
+            cursor.execute(f"UPDATE people SET change_seq = %s WHERE id IN ({', '.join(['%s'] * len(chunk))})", [seq] + chunk)
+        if deleted_ids:
+            cursor.executemany('''
+                INSERT INTO people_tombstones (person_id, change_seq) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE change_seq = VALUES(change_seq), deleted_at = CURRENT_TIMESTAMP
+            ''', [(person_id, seq) for person_id in deleted_ids])
+        return seq
+
+    def people_changed(self):
+        """Call after committing a record_changes, so the new version is seen right away by every worker"""
+        self.version_cache.invalidate()
+
+    def get_people_version(self):
+        """
+        (version, changed_at) of the people table, the change_seq of the last write and when that was
+        (UTC). Read from change_sequence, not from people, and cached. (None, None) on errors.
+        """
+        version = self.version_cache.get('people')
+        if version is not MISSING:
+            return version
+        epoch = self.version_cache.epoch()
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT value, UNIX_TIMESTAMP(changed_at) FROM change_sequence WHERE name = 'people'")
+                row = cursor.fetchone()
+        except Error as e:
+            print(f"{Fore.RED}[-] Error getting the people version: {e}{Style.RESET_ALL}")
+            return None, None
+        version = (row[0], datetime.fromtimestamp(int(row[1]), timezone.utc)) if row else (0, None)
+        self.version_cache.set('people', version, epoch=epoch)
+        return version
+
+    def get_change_token(self):
+        """Change token for the current people version, get_changes from it returns what's written after now"""
+        version, _ = self.get_people_version()
+        return None if version is None else change_token(version, 0)
+
+    def get_page_version(self):
+        """
+        Like get_people_version, for responses that show images. A finished thumbnail changes
+        their image URLs (see ImageStore.variant) without a write to people, so it's in here too.
+        """
+        version, changed_at = self.get_people_version()
+        if version is None:
+            return None, None
+        made_at = self.thumbnails.generation.changed_at()
+        if made_at is not None:
+            made_at = datetime.fromtimestamp(int(made_at), timezone.utc)
+            if changed_at is None or made_at > changed_at:
+                changed_at = made_at
+        return (version, self.thumbnails.generation.current()), changed_at
+
+    def get_changes(self, since=None, limit=None):
+        """
+        People added, changed or deleted after the change token `since` (see change_token), oldest
+        change first: {'changed': [people with images], 'deleted': [{'id', 'deleted_at'}], 'next', 'has_more'}.
+        Pass 'next' back as since, None starts from the beginning. ValueError for a bad token, None on errors.
+        """
+        seq, last_id = parse_change_token(since)
+        limit = max(1, min(limit or self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE))
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                # both reads are in the same transaction, so they see the same snapshot
+                cursor.execute(f'''
+                    SELECT {self.PEOPLE_COLUMNS}, change_seq, updated_at FROM people
+                    WHERE change_seq > %s OR (change_seq = %s AND id > %s)
+                    ORDER BY change_seq, id LIMIT %s
+                ''', (seq, seq, last_id, limit + 1))
+                changes = []
+                for row in cursor.fetchall():
+                    person = self._person_from_row(row)
+                    person['updated_at'] = row[-1].isoformat() if row[-1] else None
+                    changes.append((row[-2], person['id'], person, None))
+                cursor.execute('''
+                    SELECT person_id, change_seq, deleted_at FROM people_tombstones
+                    WHERE change_seq > %s OR (change_seq = %s AND person_id > %s)
+                    ORDER BY change_seq, person_id LIMIT %s
+                ''', (seq, seq, last_id, limit + 1))
+                for person_id, change_seq, deleted_at in cursor.fetchall():
+                    changes.append((change_seq, person_id, None, {'id': person_id, 'deleted_at': deleted_at.isoformat() if deleted_at else None}))
+                changes.sort(key=lambda change: change[:2])
+
+                page = changes[:limit]
+                changed = [change[2] for change in page if change[2] is not None]
+                self._attach_images(cursor, changed)
+            return {
+                'changed': changed,
+                'deleted': [change[3] for change in page if change[3] is not None],
+                'next': change_token(*page[-1][:2]) if page else change_token(seq, last_id),
+                'has_more': len(changes) > limit
+            }
+        except Error as e:
+            print(f"{Fore.RED}[-] Error getting changes: {e}{Style.RESET_ALL}")
+            return None
+
+    # -----------------------------
+    # Tables derived from people (duplicate keys, IPs, labels, socials), kept up to date on every write
+    # -----------------------------
+    def index_people(self, cursor, people, changed=None):
+        """
+        Update the derived tables for people (dicts with 'id') that were just written, inside the caller's
+        transaction. With `changed` (field names) only the tables made from those fields are updated.
+        """
+        indexes = [
+            (self._index_duplicates, {'name', 'phone', 'email', 'ipaddress', 'socials'}),
+            (self._index_ips, {'ipaddress'}),
+            (self._index_labels, {'label', 'convicted'}),
+            (self._index_socials, {'socials'})
+        ]
+        indexes = [index for index, fields in indexes if changed is None or fields & set(changed)]
+        for start in range(0, len(people), 500):
+            chunk = people[start:start + 500]
+            for index in indexes:
+                index(cursor, chunk)
+
+    def _index_ips(self, cursor, people):
+        ids = [person['id'] for person in people]
+        cursor.execute(f"DELETE FROM people_ips WHERE person_id IN ({', '.join(['%s'] * len(ids))})", ids)
+        rows = {(ipranges.to_key(ip), person['id']) for person in people for ip in ipranges.parse_ips(person.get('ipaddress'))}
+        if rows:
+            cursor.executemany('INSERT INTO people_ips (ip, person_id) VALUES (%s, %s)', sorted(rows))
+
+    def _index_socials(self, cursor, people):
+        ids = [person['id'] for person in people]
+        cursor.execute(f"DELETE FROM people_socials WHERE person_id IN ({', '.join(['%s'] * len(ids))})", ids)
+        rows = {(handle, platform, person['id']) for person in people for platform, handle in parse_social_accounts(person.get('socials'))}
+        if rows:
+            cursor.executemany('INSERT INTO people_socials (handle, platform, person_id) VALUES (%s, %s, %s)', sorted(rows))
+
+    def _unindex_labels(self, cursor, person_ids):
+        """Take people out of people_labels and the label counts (before they're changed or deleted)"""
+        id_list = ', '.join(['%s'] * len(person_ids))
+        cursor.execute(f'SELECT label_id, convicted FROM people_labels WHERE person_id IN ({id_list}) FOR UPDATE', list(person_ids))
+        counts = {}
+        for label_id, convicted in cursor.fetchall():
+            count = counts.setdefault(label_id, [0, 0])
+            count[0] += 1
+            count[1] += int(convicted)
+        if counts:
+            # sorted, so two writers always lock the label rows in the same order
+            cursor.executemany('UPDATE labels SET people_count = people_count - %s, convicted_count = convicted_count - %s WHERE id = %s',
+                               [(people, convicted, label_id) for label_id, (people, convicted) in sorted(counts.items())])
+            cursor.execute(f'DELETE FROM people_labels WHERE person_id IN ({id_list})', list(person_ids))
+
+    def _index_labels(self, cursor, people):
+        self._unindex_labels(cursor, [person['id'] for person in people])
+        parsed = [(person, parse_labels(person.get('label'))) for person in people]
+        names = {}
+        for _, labels in parsed:
+            for slug, name in labels:
+                names.setdefault(slug, name)
+        if not names:
+            return
+        cursor.executemany('INSERT IGNORE INTO labels (slug, name) VALUES (%s, %s)', sorted(names.items()))
+        cursor.execute(f"SELECT slug, id FROM labels WHERE slug IN ({', '.join(['%s'] * len(names))})", sorted(names))
+        label_ids = dict(cursor.fetchall())
+
+        rows = {(label_ids[slug], person['id'], bool(person.get('convicted'))) for person, labels in parsed for slug, _ in labels}
+        cursor.executemany('INSERT INTO people_labels (label_id, person_id, convicted) VALUES (%s, %s, %s)', sorted(rows))
+        counts = {}
+        for label_id, _, convicted in rows:
+            count = counts.setdefault(label_id, [0, 0])
+            count[0] += 1
+            count[1] += int(convicted)
+        cursor.executemany('UPDATE labels SET people_count = people_count + %s, convicted_count = convicted_count + %s WHERE id = %s',
+                           [(people, convicted, label_id) for label_id, (people, convicted) in sorted(counts.items())])
+
+    def get_label_facets(self, limit=100):
+        """Labels with how many people have them (and how many of those are convicted), biggest first"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT slug, name, people_count, convicted_count FROM labels
+                    WHERE people_count > 0 ORDER BY people_count DESC, slug LIMIT %s
+                ''', (limit,))
+                return [{
+                    'slug': row[0],
+                    'label': row[1],
+                    'people': row[2],
+                    'convicted': row[3],
+                    'not_convicted': row[2] - row[3]
+                } for row in cursor.fetchall()]
+        except Error as e:
+            print(f"{Fore.RED}[-] Error getting labels: {e}{Style.RESET_ALL}")
+            return []
+
+    def _index_duplicates(self, cursor, people):
+        """
+        Update the blocking keys and duplicate pairs of people (see dedup.py).
+        Only the people sharing one of their keys get looked at.
+        """
+        ids = [person['id'] for person in people]
+        id_list = ', '.join(['%s'] * len(ids))
+        keys = {(kind, value, person['id']) for person in people for kind, value in dedup.blocking_keys(person)}
+
+        cursor.execute(f'DELETE FROM people_keys WHERE person_id IN ({id_list})', ids)
+        cursor.execute(f'DELETE FROM people_duplicates WHERE person_a IN ({id_list}) OR person_b IN ({id_list})', ids + ids)
+        if not keys:
+            return
+        cursor.executemany('INSERT INTO people_keys (kind, value, person_id) VALUES (%s, %s, %s)', sorted(keys))
+
+        # block sizes first, so a huge block (a VPN exit, a common name) is never read
+        blocks = sorted({(kind, value) for kind, value, _ in keys})
+        block_list = ', '.join(['(%s, %s)'] * len(blocks))
+        cursor.execute(f'SELECT kind, value, COUNT(*) FROM people_keys WHERE (kind, value) IN ({block_list}) GROUP BY kind, value',
+                       [part for block in blocks for part in block])
+        small = [(kind, value) for kind, value, count in cursor.fetchall() if 1 < count <= dedup.MAX_BLOCK_SIZE]
+        if not small:
+            return
+
+        block_list = ', '.join(['(%s, %s)'] * len(small))
+        cursor.execute(f'SELECT kind, value, person_id FROM people_keys WHERE (kind, value) IN ({block_list})',
+                       [part for block in small for part in block])
+        members = {}
+        for kind, value, person_id in cursor.fetchall():
+            members.setdefault((kind, value), []).append(person_id)
+
+        changed = set(ids)
+        pairs = {}
+        for (kind, _), block in members.items():
+            for i, a in enumerate(block):
+                for b in block[i + 1:]:
+                    if a in changed or b in changed:
+                        pairs.setdefault((min(a, b), max(a, b)), set()).add(kind)
+        if pairs:
+            cursor.executemany('''
+                INSERT INTO people_duplicates (person_a, person_b, score, reasons) VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE score = VALUES(score), reasons = VALUES(reasons)
+            ''', [(a, b, dedup.score(kinds), ','.join(sorted(kinds))) for (a, b), kinds in sorted(pairs.items())])
+
+    def get_duplicates(self, min_score=0.5, limit=None, page=1):
+        """Most likely duplicate pairs first, returns (pairs, has_next_page)"""
+        limit = max(1, min(limit or self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE))
+        page = max(1, page or 1)
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT d.person_a, a.name, d.person_b, b.name, d.score, d.reasons
+                    FROM people_duplicates d
+                    JOIN people a ON a.id = d.person_a
+                    JOIN people b ON b.id = d.person_b
+                    WHERE d.score >= %s
+                    ORDER BY d.score DESC, d.person_a, d.person_b
+                    LIMIT %s OFFSET %s
+                ''', (min_score, limit + 1, (page - 1) * limit))
+                rows = cursor.fetchall()
+            pairs = [{
+                'person_a': {'id': row[0], 'name': row[1]},
+                'person_b': {'id': row[2], 'name': row[3]},
+                'score': round(row[4], 3),
+                'reasons': row[5].split(',')
+            } for row in rows[:limit]]
+            return pairs, len(rows) > limit
+        except Error as e:
+            print(f"{Fore.RED}[-] Error getting duplicates: {e}{Style.RESET_ALL}")
+            return [], False
+
+    def get_duplicates_of(self, person_id, min_score=0.0):
+        """People that might be the same as person_id, most likely first"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT p.id, p.name, d.score, d.reasons FROM (
+                        SELECT person_b AS other, score, reasons FROM people_duplicates WHERE person_a = %s
+                        UNION ALL
+                        SELECT person_a, score, reasons FROM people_duplicates WHERE person_b = %s
+                    ) d JOIN people p ON p.id = d.other
+                    WHERE d.score >= %s
+                    ORDER BY d.score DESC, p.id
+                ''', (person_id, person_id, min_score))
+                return [{'id': row[0], 'name': row[1], 'score': round(row[2], 3), 'reasons': row[3].split(',')}
+                        for row in cursor.fetchall()]
+        except Error as e:
+            print(f"{Fore.RED}[-] Error getting duplicates: {e}{Style.RESET_ALL}")
+            return []
+
     def get_mysql_users(self):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT User, Host FROM mysql.user")
-            users = cursor.fetchall()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT User, Host FROM mysql.user")
+                users = cursor.fetchall()
             users = [(u.decode() if isinstance(u, (bytes, bytearray)) else u, h.decode() if isinstance(h, (bytes, bytearray)) else h) for u, h in users] # clankergpt did this
-            conn.close()
             return users
         except Error as e:
             print(f"{Fore.RED}[-] Error fetching MySQL users: {e}{Style.RESET_ALL}")
@@ -446,81 +1968,109 @@ class DatabaseManager:
     
     def get_all_apikeys(self):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM api_keys")
-            apikeys = cursor.fetchall()
-            conn.close()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, label, key_prefix, administrator FROM api_keys")
+                apikeys = cursor.fetchall()
             keys = []
             for row in apikeys:
                 keys.append({
                     'id': row[0],
                     'label': row[1],
-                    'api_key': row[2],
+                    'key_prefix': row[2],
+                    'api_key': f"CS_{row[2]}_...", # the full key is only shown once when it's made
                     'administrator': row[3]
                 })
             return keys
         except Error as e:
             print(f"[-] Error has occured: {e}")
     
-    def validate_api_key(self, api_key):
+    def _fetch_api_key(self, key_hash):
+        """Uncached point lookup on the unique key_hash index"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, administrator FROM api_keys WHERE key_hash=%s", (key_hash,))
+            return cursor.fetchone()
+
+    def lookup_api_key(self, api_key):
+        """
+        Returns {'id': ..., 'administrator': bool} for a valid key or None.
+        Results (also for invalid keys) are cached, add_apikey/delete_apikey clear the cache.
+        """
+        if not api_key:
+            return None
+        key_hash = hash_key(api_key)
+        cached = self.apikey_cache.get(key_hash)
+        if cached is not MISSING:
+            return cached
+
+        epoch = self.apikey_cache.epoch()
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT id FROM api_keys WHERE api_key=%s", (api_key,))
-            result = cursor.fetchone()
-            conn.close()
-            # Returns True if a matching API key exists
-            return result is not None
+            row = self._fetch_api_key(key_hash)
         except Error as e:
             print(f"[-] Error has occured {e}")
-            return False
+            return None # errors are not cached
 
-    def validate_api_administration(self, api_key):
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT administrator FROM api_keys WHERE api_key=%s", (api_key,))
-            result = cursor.fetchone()
-            conn.close()
+        if row:
+            result = {'id': row[0], 'administrator': bool(row[1])}
+            self.apikey_cache.set(key_hash, result, epoch=epoch)
+        else:
+            result = None
+            self.apikey_cache.set(key_hash, None, ttl=apikeycachenegativettl, epoch=epoch)
+        return result
 
-            if result and result["administrator"] == 1:
-                return True
-                
-            return False
-        except Error as e:
-            print(f"[-] Error has Occurred: {e}")
-            return False
+    def validate_api_key(self, api_key):
+        # Returns True if a matching API key exists
+        return self.lookup_api_key(api_key) is not None
+
+    def validate_api_administration(self, api_key):
+        result = self.lookup_api_key(api_key)
+        return bool(result and result['administrator'])
 
-        
     def add_apikey(self, label=None, key=None, administrator=False):
+        """Store a key (only its hash), returns the new id or None"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO api_keys (label, api_key, administrator)
-                VALUES (%s, %s, %s)
-            ''', (label, key, administrator))
-            
-            key_id = cursor.lastrowid
-            
-            conn.commit()
-            conn.close()
-            return True
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO api_keys (label, key_prefix, key_hash, administrator)
+                    VALUES (%s, %s, %s, %s)
+                ''', (label, key_prefix(key), hash_key(key), administrator))
+                
+                key_id = cursor.lastrowid
+                
+                conn.commit()
+            self.apikey_cache.invalidate()
+            return key_id
         except Error as e:
             print(f"{Fore.RED}[-] Error has occurred: {e}{Style.RESET_ALL}")
-            return False
+            return None
 
     def delete_apikey(self, api_id):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
 
-            cursor.execute('DELETE FROM api_keys WHERE id = %s', (api_id,))
-            conn.commit()
-            conn.close()
+                cursor.execute('DELETE FROM api_keys WHERE id = %s', (api_id,))
+                conn.commit()
+            self.apikey_cache.invalidate()
             return True
         except Error as e:
             print(f"{Fore.RED}[-] Error has occurred: {e}{Style.RESET_ALL}")
-            return False
\ No newline at end of file
+            return False
+
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    """
+    The DatabaseManager shared by the whole process (web pages, API, auth), so there's one
+    pool, one API key cache and one suggestion index instead of one per module.
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = DatabaseManager()
+    return _db
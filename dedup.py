@@ -0,0 +1,102 @@
+"""
+Duplicate detection. Every person gets blocking keys (normalized phone, email, IP, social handles
+and a phonetic name key) in the people_keys table. Only people sharing a key are ever compared,
+and that's done when a person is written, so people_duplicates always holds the scored pairs.
+"""
+from suggest import normalize, parse_socials
+from ipranges import parse_ips
+from dotenv import load_dotenv
+import os
+import re
+
+load_dotenv()
+
+defaultcountrycode = os.getenv("DEDUP_COUNTRY_CODE", "1") # for phone numbers written without one
+
+# how much a shared key says two records are the same person, combined as 1 - (1-a)(1-b)...
+WEIGHTS = {
+    'email': 0.6,
+    'phone': 0.5,
+    'social': 0.4,
+    'name': 0.25,
+    'ip': 0.15
+}
+# keys shared by more people than this (a VPN exit, a common name) aren't evidence of anything
+MAX_BLOCK_SIZE = 50
+
+def normalize_phone(phone):
+    """E.164 (+<country code><number>) as far as it can be told without knowing the country"""
+    if not phone:
+        return None
+    phone = str(phone).strip()
+    digits = re.sub(r'\D', '', phone)
+    if phone.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif len(digits) == 10 or (len(digits) == 11 and digits.startswith('0')):
+        # national number, drop the trunk 0 and add the default country code
+        digits = defaultcountrycode + (digits[1:] if digits.startswith('0') else digits)
+    if not 8 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+# providers that ignore dots in the local part
+DOTLESS_DOMAINS = {'gmail.com', 'googlemail.com'}
+
+def normalize_email(email):
+    """Lowercase, no +tag, and no dots for gmail: J.Doe+spam@GMail.com -> jdoe@gmail.com"""
+    if not email or '@' not in str(email):
+        return None
+    local, _, domain = str(email).strip().lower().rpartition('@')
+    local = local.split('+', 1)[0]
+    if domain == 'googlemail.com':
+        domain = 'gmail.com'
+    if domain in DOTLESS_DOMAINS:
+        local = local.replace('.', '')
+    if not local or not domain:
+        return None
+    return f"{local}@{domain}"
+
+SOUNDEX_CODES = {c: str(code) for code, letters in enumerate(['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'])
+                 for c in letters}
+
+def soundex(word):
+    word = re.sub(r'[^a-z]', '', word)
+    if not word:
+        return None
+    key = word[0].upper()
+    last = SOUNDEX_CODES[word[0]]
+    for c in word[1:]:
+        code = SOUNDEX_CODES[c]
+        if code != '0' and code != last:
+            key += code
+        if c not in 'hw': # h and w don't separate equal codes
+            last = code
+    return (key + '000')[:4]
+
+def name_key(name):
+    """Soundex of every word, sorted: 'Jon Smyth' and 'Smith, John' both give J500 S530"""
+    codes = sorted(set(filter(None, (soundex(word) for word in normalize(name or '').split()))))
+    return ' '.join(codes) or None
+
+def blocking_keys(person):
+    """{(kind, value)} for a person dict (name, phone, email, ipaddress, socials)"""
+    keys = {
+        ('name', name_key(person.get('name'))),
+        ('phone', normalize_phone(person.get('phone'))),
+        ('email', normalize_email(person.get('email')))
+    }
+    keys = {(kind, value) for kind, value in keys if value}
+    for ip in parse_ips(person.get('ipaddress')):
+        keys.add(('ip', str(ip)))
+    for handle, _ in parse_socials(person.get('socials')):
+        keys.add(('social', handle))
+    return {(kind, value[:255]) for kind, value in keys}
+
+def score(kinds):
+    """Chance-like score (0-1) of two people sharing keys of these kinds"""
+    different = 1.0
+    for kind in set(kinds):
+        different *= 1 - WEIGHTS[kind]
+    return round(1 - different, 3)
@@ -0,0 +1,171 @@
+"""
+Exports the people database (with image paths) as CSV, NDJSON or a columnar format.
+
+    python3 exporter.py people.csv.gz
+    python3 exporter.py convicted.ndjson --convicted yes
+    python3 exporter.py - --format columns --compress zstd > people.columns.zst
+
+Rows are streamed from the database and written as they come, so memory use stays the same
+no matter how big the table is. The same export is available from the API at /api/export.
+
+The columns format is NDJSON where every line is a row group of up to 10000 people:
+{"rows": 2, "columns": {"id": [1, 2], "name": ["a", "b"], ...}}
+so field names aren't repeated for every person and it compresses very well.
+"""
+from colorama import Fore, Style
+from database import get_db, PERSON_FIELDS
+from contextlib import redirect_stdout
+import argparse
+import json
+import zlib
+import time
+import csv
+import io
+import sys
+
+FIELDS = ('id',) + PERSON_FIELDS + ('images',)
+FORMATS = ('csv', 'ndjson', 'columns')
+COMPRESSIONS = ('gzip', 'zstd')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'columns': 'application/x-ndjson'}
+EXTENSIONS = {'csv': '.csv', 'ndjson': '.ndjson', 'columns': '.columns.ndjson', 'gzip': '.gz', 'zstd': '.zst'}
+
+ROWS_PER_CHUNK = 500
+ROWS_PER_GROUP = 10000
+
+def csv_chunks(people):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for i, person in enumerate(people, 1):
+        # images are separated by ; like importer.py expects
+        writer.writerow([';'.join(person['images']) if f == 'images' else person[f] for f in FIELDS])
+        if i % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def ndjson_chunks(people):
+    lines = []
+    for person in people:
+        lines.append(json.dumps({f: person[f] for f in FIELDS}))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def columns_chunks(people):
+    group = {f: [] for f in FIELDS}
+    rows = 0
+    for person in people:
+        for f in FIELDS:
+            group[f].append(person[f])
+        rows += 1
+        if rows >= ROWS_PER_GROUP:
+            yield json.dumps({'rows': rows, 'columns': group}) + '\n'
+            group = {f: [] for f in FIELDS}
+            rows = 0
+    if rows:
+        yield json.dumps({'rows': rows, 'columns': group}) + '\n'
+
+WRITERS = {'csv': csv_chunks, 'ndjson': ndjson_chunks, 'columns': columns_chunks}
+
+def compressor(compression):
+    """Returns an object with compress()/flush() or None, zstd needs the zstandard package"""
+    if compression == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31) # 31 = gzip header
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdCompressor().compressobj()
+    return None
+
+def export_chunks(people, fmt='ndjson', compression=None):
+    """Yields the export as bytes, people is an iterator like DatabaseManager.iter_people_with_images"""
+    if fmt not in WRITERS:
+        raise ValueError(f"unknown format {fmt}, use one of {', '.join(FORMATS)}")
+    if compression and compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression {compression}, use one of {', '.join(COMPRESSIONS)}")
+    packer = compressor(compression)
+    for chunk in WRITERS[fmt](people):
+        data = chunk.encode()
+        if packer:
+            data = packer.compress(data)
+        if data:
+            yield data
+    if packer:
+        yield packer.flush()
+
+def filename(fmt, compression=None):
+    return 'people' + EXTENSIONS[fmt] + (EXTENSIONS[compression] if compression else '')
+
+def guess_options(path, fmt, compression):
+    """Format and compression from the file name unless they were given"""
+    name = path.lower()
+    if compression is None:
+        if name.endswith('.gz'):
+            compression = 'gzip'
+        elif name.endswith('.zst'):
+            compression = 'zstd'
+    if fmt is None:
+        if '.columns' in name:
+            fmt = 'columns'
+        elif '.csv' in name:
+            fmt = 'csv'
+        else:
+            fmt = 'ndjson'
+    return fmt, compression
+
+def parse_convicted(value):
+    if value is None or value == '':
+        return None
+    value = str(value).lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    raise ValueError("convicted has to be yes or no")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the CipherStorm people database")
+    parser.add_argument("file", help="file to write, - for stdout")
+    parser.add_argument("--format", choices=FORMATS, help="default: guessed from the file name, else ndjson")
+    parser.add_argument("--compress", choices=COMPRESSIONS, help="default: guessed from the file name (.gz/.zst)")
+    parser.add_argument("--label", help="only people whose label contains this")
+    parser.add_argument("--convicted", help="yes or no")
+    args = parser.parse_args()
+
+    fmt, compression = guess_options(args.file, args.format, args.compress)
+    try:
+        convicted = parse_convicted(args.convicted)
+        compressor(compression) # fail before touching the database
+    except ValueError as e:
+        print(f"{Fore.RED}[-] {e}{Style.RESET_ALL}", file=sys.stderr)
+        sys.exit(1)
+
+    start = time.monotonic()
+    count = 0
+    def counted(people):
+        nonlocal count
+        for person in people:
+            count += 1
+            yield person
+
+    out = sys.stdout.buffer if args.file == '-' else open(args.file, 'wb')
+    try:
+        # database messages go to stderr so they don't end up in the export
+        with redirect_stdout(sys.stderr):
+            db = get_db()
+            people = counted(db.iter_people_with_images(label=args.label, convicted=convicted))
+            for data in export_chunks(people, fmt, compression):
+                out.write(data)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"{Fore.GREEN}[+] Exported {count} people in {time.monotonic() - start:.1f}s{Style.RESET_ALL}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
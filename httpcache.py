@@ -0,0 +1,84 @@
+"""
+Conditional GETs and a response cache for pages that only change when the people table does.
+
+The version of the people table (DatabaseManager.get_people_version, the change_seq of the last
+write) goes into a strong ETag together with the URL, so:
+
+- a client that sends If-None-Match (or If-Modified-Since) with the current one gets a 304
+  without the people table being read at all
+- a page that was rendered for this version before is served from memory (RESPONSE_CACHE_*)
+
+A write makes a new version, so nothing ever has to be invalidated.
+"""
+from flask import Response, make_response, request, session
+from cache import TTLCache, MISSING
+from dotenv import load_dotenv
+from functools import wraps
+import hashlib
+import os
+
+load_dotenv()
+
+responsecachesize = int(os.getenv("RESPONSE_CACHE_SIZE", "128")) # pages per worker process
+responsecachettl = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+responsecachemaxbody = int(os.getenv("RESPONSE_CACHE_MAX_BODY", str(1024 * 1024))) # bigger pages aren't kept
+
+response_cache = TTLCache(maxsize=responsecachesize, ttl=responsecachettl)
+
+# not replayed from the cache
+SKIPPED_HEADERS = {'set-cookie', 'content-length', 'etag', 'last-modified', 'cache-control'}
+
+def make_etag(version, *parts):
+    return hashlib.sha256(repr((version,) + parts).encode()).hexdigest()[:32]
+
+def is_fresh(etag, last_modified):
+    """Does the client already have this version (If-None-Match wins over If-Modified-Since)"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since)
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # only for this client (it's behind a login or API key) and always checked with us first
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def versioned(get_version, vary=None):
+    """
+    Decorator for GET views whose output only depends on the URL, the people table and vary()
+    (for example the logged in user). get_version returns (version, last modified), the
+    version is read before the view runs so a cached page is never older than its version.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # a POST body isn't part of the key, and flashed messages are shown once so that page can't be reused
+            if request.method != 'GET' or '_flashes' in session:
+                return view(*args, **kwargs)
+            version, last_modified = get_version()
+            if version is None:
+                return view(*args, **kwargs)
+
+            key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))),
+                   tuple(vary()) if vary else ())
+            etag = make_etag(version, *key)
+            if is_fresh(etag, last_modified):
+                return add_validators(Response(status=304), etag, last_modified)
+
+            cached = response_cache.get((version,) + key)
+            if cached is not MISSING:
+                body, status, headers = cached
+                return add_validators(Response(body, status=status, headers=headers), etag, last_modified)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            body = response.get_data()
+            if len(body) <= responsecachemaxbody:
+                headers = [(name, value) for name, value in response.headers.items() if name.lower() not in SKIPPED_HEADERS]
+                response_cache.set((version,) + key, (body, response.status_code, headers))
+            return add_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,148 @@
+"""
+Content addressed storage for uploaded images.
+
+Every file is stored once under static/images/blobs/<aa>/<bb>/<sha256>.<ext> no matter how many
+people it's attached to, people_images rows point at it (see DatabaseManager.add_person_images).
+Uploads are streamed to a private temp file while being hashed, so two uploads with the same
+file name can't overwrite each other and nothing is ever held in memory.
+"""
+from dotenv import load_dotenv
+import tempfile
+import hashlib
+import os
+import re
+
+load_dotenv()
+
+imagedir = os.getenv("IMAGE_DIR", "static/images") # served as /static/images
+CHUNK_SIZE = 64 * 1024
+
+# resized copies made in the background by thumbnails.py, name -> longest side in pixels
+SIZES = {
+    'thumb': 240,
+    'web': 1280
+}
+
+# the extension comes from the bytes, so the same file always ends up at the same path
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif')
+]
+
+def sniff_extension(head, filename=None):
+    for signature, ext in SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if filename and '.' in filename:
+        ext = filename.rsplit('.', 1)[1].lower()
+        if ext.isalnum():
+            return 'jpg' if ext == 'jpeg' else ext
+    return 'bin'
+
+def safe_image_path(image_path):
+    """
+    True if an image path from outside (the API) can only point inside the image root:
+    relative, without '..' segments, backslashes or a drive letter
+    """
+    if not isinstance(image_path, str) or not image_path or '\0' in image_path or '\\' in image_path:
+        return False
+    if image_path.startswith('/') or re.match(r'^[A-Za-z]:', image_path):
+        return False
+    return '..' not in image_path.split('/')
+
+class StagedImage:
+    """An upload that's hashed and on disk but not in the store yet"""
+    def __init__(self, temp_path, sha256, size, ext):
+        self.temp_path = temp_path
+        self.sha256 = sha256
+        self.size = size
+        self.ext = ext
+
+class ImageStore:
+    def __init__(self, root=imagedir, url_prefix="images"):
+        self.root = root
+        self.url_prefix = url_prefix # image paths are relative to /static like the old ones
+        self.temp_dir = os.path.join(root, 'tmp')
+
+    def image_path(self, sha256, ext):
+        """The path that goes in people_images.image_path"""
+        return f"{self.url_prefix}/blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}.{ext}"
+
+    def file_path(self, image_path):
+        """Where an image_path from the database lives on disk, ValueError if that's outside the image root"""
+        relative = image_path[len(self.url_prefix) + 1:] if image_path.startswith(self.url_prefix + '/') else image_path
+        path = os.path.join(self.root, *relative.split('/'))
+        root = os.path.abspath(self.root)
+        if os.path.commonpath([root, os.path.abspath(path)]) != root:
+            raise ValueError(f"{image_path} is not in {self.root}")
+        return path
+
+    def derivative_path(self, image_path, size):
+        """Where the `size` copy of an image goes: images/derived/<path without extension>.<size>.webp"""
+        relative = image_path[len(self.url_prefix) + 1:] if image_path.startswith(self.url_prefix + '/') else image_path
+        return f"{self.url_prefix}/derived/{relative.rsplit('.', 1)[0]}.{size}.webp"
+
+    def variant(self, image_path, size):
+        """image_path of the `size` copy, the original until the copy is made (or for size 'original')"""
+        if size in SIZES and safe_image_path(image_path) and os.path.exists(self.file_path(self.derivative_path(image_path, size))):
+            return self.derivative_path(image_path, size)
+        return image_path
+
+    def variants(self, image_path):
+        """{'original': ..., 'thumb': ..., 'web': ...} for the API"""
+        return dict({'original': image_path}, **{size: self.variant(image_path, size) for size in SIZES})
+
+    def stage(self, stream, filename=None):
+        """Copy a file object (a werkzeug FileStorage works too) to a temp file, hashing it on the way"""
+        stream = getattr(stream, 'stream', stream)
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        os.makedirs(self.temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if len(head) < 16:
+                        head += chunk[:16]
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return StagedImage(temp_path, digest.hexdigest(), size, sniff_extension(head, filename))
+
+    def place(self, staged, image_path=None):
+        """
+        Move a staged upload into the store, at image_path if the blob is already known under
+        another extension. Returns (image_path, created), created is False when the file was
+        already there (the temp file is dropped then).
+        """
+        image_path = image_path or self.image_path(staged.sha256, staged.ext)
+        path = self.file_path(image_path)
+        if os.path.exists(path):
+            self.discard(staged)
+            return image_path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged.temp_path, path)
+        return image_path, True
+
+    def discard(self, staged):
+        try:
+            os.unlink(staged.temp_path)
+        except FileNotFoundError:
+            pass
+
+    def remove(self, image_path):
+        """Delete a file and its resized copies"""
+        for path in [image_path] + [self.derivative_path(image_path, size) for size in SIZES]:
+            try:
+                os.unlink(self.file_path(path))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,463 @@
+"""
+Imports big CSV/NDJSON dumps straight into the people and people_images tables.
+
+    python3 importer.py people.csv
+    python3 importer.py people.ndjson --rebuild-indexes
+
+CSV files need a header row, columns are the people fields (name, address, phone, email,
+ipaddress, label, description, convicted, socials) and optionally images (paths separated by ;).
+NDJSON files have one JSON object per line with the same keys (images can be a list).
+
+The file is loaded with LOAD DATA LOCAL INFILE into a staging table and merged into people
+in chunks. If the server doesn't allow LOAD DATA LOCAL it falls back to batched inserts.
+Either way every row is checked like the API does (validate_person, image paths) and rows that
+fail are skipped and printed with their row number (the line number for NDJSON).
+Progress is stored in the database, so running the same command again after a crash continues
+where it stopped. Best run while nobody else is adding people.
+"""
+import mysql.connector
+from mysql.connector import Error
+from colorama import Fore, Style
+from database import get_db, PERSON_FIELDS, validate_person
+from imagestore import safe_image_path
+import argparse
+import json
+import time
+import csv
+import os
+import sys
+
+STAGING_TABLE = "import_staging"
+MAX_REPORTED_ROWS = 100 # skipped rows printed one by one, the rest are only counted
+INSERT_BYTES = 4 * 1024 * 1024 # per multi-row INSERT of the merge, well under max_allowed_packet
+
+class Progress:
+    def __init__(self, what, every=2):
+        self.what = what
+        self.every = every
+        self.start = time.monotonic()
+        self.last = 0
+
+    def update(self, done, force=False):
+        now = time.monotonic()
+        if force or now - self.last >= self.every:
+            self.last = now
+            rate = done / (now - self.start) if now > self.start else 0
+            print(f"{Fore.CYAN}[*] {self.what}: {done} rows ({rate:.0f} rows/s){Style.RESET_ALL}")
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+def detect_format(path, fmt):
+    if fmt:
+        return fmt
+    return 'ndjson' if path.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+def parse_images(value):
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(v) for v in value if v]
+    value = str(value).strip()
+    if value.startswith('['):
+        try:
+            return [str(v) for v in json.loads(value) if v]
+        except ValueError:
+            pass
+    return [v.strip() for v in value.split(';') if v.strip()]
+
+def parse_line(line):
+    """One NDJSON line as a record, None if it isn't JSON"""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+def validate_record(record):
+    """validate_person plus the images, (person with 'images', None) or (None, error)"""
+    person, error = validate_person(record)
+    if error:
+        return None, error
+    images = parse_images(record.get('images'))
+    for path in images:
+        if not safe_image_path(path):
+            return None, f"image path {path} is outside the image folder"
+    person['images'] = images
+    return person, None
+
+class Importer:
+    def __init__(self, db, path, fmt, batch_size, chunk_size):
+        self.db = db
+        self.path = os.path.abspath(path)
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.fingerprint = file_fingerprint(self.path)
+        self.rejected = 0
+
+    # -----------------------------
+    # checkpoints
+    # -----------------------------
+    def setup(self):
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS import_checkpoints (
+                    source VARCHAR(255) PRIMARY KEY,
+                    fingerprint VARCHAR(64) NOT NULL,
+                    method VARCHAR(16) NOT NULL,
+                    stage VARCHAR(16) NOT NULL,
+                    position BIGINT NOT NULL DEFAULT 0,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.commit()
+
+    def get_checkpoint(self):
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT fingerprint, method, stage, position FROM import_checkpoints WHERE source = %s", (self.path,))
+            row = cursor.fetchone()
+        if row and row[0] == self.fingerprint:
+            return {'method': row[1], 'stage': row[2], 'position': row[3]}
+        return None
+
+    def save_checkpoint(self, cursor, method, stage, position):
+        """Written with the same cursor (and transaction) as the rows it's for"""
+        cursor.execute('''
+            INSERT INTO import_checkpoints (source, fingerprint, method, stage, position)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE fingerprint = VALUES(fingerprint), method = VALUES(method),
+                stage = VALUES(stage), position = VALUES(position)
+        ''', (self.path, self.fingerprint, method, stage, position))
+
+    def clear_checkpoint(self):
+        with self.db.get_connection() as conn:
+            conn.cursor().execute("DELETE FROM import_checkpoints WHERE source = %s", (self.path,))
+            conn.commit()
+
+    # -----------------------------
+    # indexes
+    # -----------------------------
+    def drop_indexes(self):
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            for name, _ in self.db.PEOPLE_INDEXES:
+                cursor.execute('''
+                    SELECT COUNT(*) FROM information_schema.statistics
+                    WHERE table_schema = %s AND table_name = 'people' AND index_name = %s
+                ''', (self.db.database, name))
+                if cursor.fetchone()[0]:
+                    print(f"{Fore.YELLOW}[*] Dropping index {name}...{Style.RESET_ALL}")
+                    cursor.execute(f"ALTER TABLE people DROP INDEX {name}")
+
+    def rebuild_indexes(self):
+        start = time.monotonic()
+        print(f"{Fore.YELLOW}[*] Rebuilding people indexes...{Style.RESET_ALL}")
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            for name, definition in self.db.PEOPLE_INDEXES:
+                self.db._ensure_index(cursor, 'people', name, definition)
+        print(f"{Fore.GREEN}[+] Indexes rebuilt in {time.monotonic() - start:.1f}s{Style.RESET_ALL}")
+
+    # -----------------------------
+    # LOAD DATA LOCAL INFILE + set based merge
+    # -----------------------------
+    def local_infile_connection(self):
+        return mysql.connector.connect(
+            host=self.db.host,
+            user=self.db.user,
+            password=self.db.password,
+            database=self.db.database,
+            allow_local_infile=True
+        )
+
+    def create_staging(self, cursor):
+        # values are staged as they are in the file and checked in merge, MEDIUMTEXT so a value
+        # that's too long for its column is still whole there (and rejected) instead of cut off
+        cursor.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        columns = ',\n'.join(f"{field} MEDIUMTEXT" for field in PERSON_FIELDS)
+        cursor.execute(f'''
+            CREATE TABLE {STAGING_TABLE} (
+                seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+                {columns},
+                images MEDIUMTEXT,
+                doc MEDIUMTEXT
+            )
+        ''')
+
+    def load_statement(self):
+        """LOAD DATA statement for this file, CSV values go thru a variable so '' becomes NULL"""
+        if self.fmt == 'ndjson':
+            # one row per line (blank ones too) so seq is the line number
+            return f'''
+                LOAD DATA LOCAL INFILE %s INTO TABLE {STAGING_TABLE}
+                CHARACTER SET utf8mb4
+                FIELDS TERMINATED BY '\\0' ESCAPED BY ''
+                LINES TERMINATED BY '\\n'
+                (doc)
+            '''
+
+        with open(self.path, newline='', encoding='utf-8') as f:
+            first_line = f.readline()
+            f.seek(0)
+            header = next(csv.reader(f))
+        known = set(PERSON_FIELDS) | {'images'}
+        variables = []
+        sets = []
+        for i, column in enumerate(header):
+            column = column.strip().lower()
+            variables.append(f"@c{i}")
+            if column in known:
+                sets.append(f"{column} = NULLIF(@c{i}, '')")
+        line_end = '\\r\\n' if first_line.endswith('\r\n') else '\\n'
+        return f'''
+            LOAD DATA LOCAL INFILE %s INTO TABLE {STAGING_TABLE}
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+            LINES TERMINATED BY '{line_end}'
+            IGNORE 1 LINES
+            ({', '.join(variables)})
+            SET {', '.join(sets)}
+        '''
+
+    def stage(self):
+        """Returns False if LOAD DATA LOCAL isn't allowed"""
+        start = time.monotonic()
+        print(f"{Fore.YELLOW}[*] Loading {self.path} into {STAGING_TABLE}...{Style.RESET_ALL}")
+        try:
+            conn = self.local_infile_connection()
+        except Error as e:
+            print(f"{Fore.YELLOW}[*] Can't open a LOAD DATA connection ({e}){Style.RESET_ALL}")
+            return False
+        try:
+            cursor = conn.cursor()
+            self.create_staging(cursor)
+            try:
+                cursor.execute(self.load_statement(), (self.path,))
+            except Error as e:
+                print(f"{Fore.YELLOW}[*] LOAD DATA LOCAL INFILE not allowed ({e}){Style.RESET_ALL}")
+                cursor.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+                return False
+            staged = cursor.rowcount
+            self.save_checkpoint(cursor, 'load', 'staged', 0)
+            conn.commit()
+        finally:
+            conn.close()
+        print(f"{Fore.GREEN}[+] Staged {staged} rows in {time.monotonic() - start:.1f}s{Style.RESET_ALL}")
+        return True
+
+    def last_id(self, cursor):
+        """
+        The highest person id ever given out. Deleted people count too (people_tombstones, and
+        the auto increment counter for deletes from before the change feed), their ids are in
+        the change feed, ETags and client caches already and must not come back as someone else.
+        """
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM people FOR UPDATE")
+        last_id = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(MAX(person_id), 0) FROM people_tombstones")
+        last_id = max(last_id, cursor.fetchone()[0])
+        # information_schema caches AUTO_INCREMENT for a day unless told not to
+        cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+        try:
+            cursor.execute('''
+                SELECT AUTO_INCREMENT FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'people'
+            ''', (self.db.database,))
+            row = cursor.fetchone()
+        finally:
+            cursor.execute("SET SESSION information_schema_stats_expiry = DEFAULT")
+        if row and row[0]:
+            last_id = max(last_id, row[0] - 1)
+        return last_id
+
+    def staged_records(self, cursor, position, end):
+        """(row number, record) of the staged rows after position up to end, like read_records"""
+        if self.fmt == 'ndjson':
+            cursor.execute(f"SELECT seq, doc FROM {STAGING_TABLE} WHERE seq > %s AND seq <= %s ORDER BY seq", (position, end))
+            for seq, doc in cursor.fetchall():
+                if doc and doc.strip():
+                    yield seq, parse_line(doc)
+        else:
+            columns = list(PERSON_FIELDS) + ['images']
+            cursor.execute(f"SELECT seq, {', '.join(columns)} FROM {STAGING_TABLE} WHERE seq > %s AND seq <= %s ORDER BY seq", (position, end))
+            for row in cursor.fetchall():
+                yield row[0], dict(zip(columns, row[1:]))
+
+    def insert_with_ids(self, cursor, people):
+        """Insert validated people with the next free ids (see last_id), and everything that comes with them"""
+        base = self.last_id(cursor)
+        for i, person in enumerate(people):
+            person['id'] = base + i + 1
+        sql = f"INSERT INTO people (id, {', '.join(PERSON_FIELDS)}) VALUES ({', '.join(['%s'] * (len(PERSON_FIELDS) + 1))})"
+        rows = []
+        size = 0
+        for person in people:
+            row = (person['id'],) + tuple(int(person[f]) if f == 'convicted' else person[f] for f in PERSON_FIELDS)
+            rows.append(row)
+            size += sum(len(value) for value in row if isinstance(value, str))
+            # executemany makes one multi-row INSERT of these, keep it small enough for one packet
+            if size >= INSERT_BYTES:
+                cursor.executemany(sql, rows)
+                rows = []
+                size = 0
+        if rows:
+            cursor.executemany(sql, rows)
+        images = [(person['id'], path) for person in people for path in person['images']]
+        if images:
+            cursor.executemany("INSERT INTO people_images (person_id, image_path) VALUES (%s, %s)", images)
+        self.db.index_people(cursor, people)
+        self.db.record_changes(cursor, [person['id'] for person in people])
+
+    def merge(self):
+        """Move staged rows into people chunk by chunk, each chunk (and its checkpoint) is one transaction"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COALESCE(MAX(seq), 0) FROM {STAGING_TABLE}")
+            last_seq = cursor.fetchone()[0]
+            position = self.get_checkpoint()['position']
+            conn.rollback()
+
+            progress = Progress("Merged")
+            merged = 0
+            while position < last_seq:
+                end = position + self.chunk_size
+                people = []
+                for row, record in self.staged_records(cursor, position, end):
+                    person, error = validate_record(record)
+                    if error:
+                        self.reject(row, error)
+                    else:
+                        people.append(person)
+                if people:
+                    self.insert_with_ids(cursor, people)
+                merged += len(people)
+                position = min(end, last_seq)
+                self.save_checkpoint(cursor, 'load', 'staged', position)
+                conn.commit()
+                progress.update(merged)
+            progress.update(merged, force=True)
+        self.report_rejected()
+
+    def reject(self, row, error):
+        self.rejected += 1
+        if self.rejected <= MAX_REPORTED_ROWS:
+            print(f"{Fore.YELLOW}[*] Row {row} skipped: {error}{Style.RESET_ALL}")
+
+    def report_rejected(self):
+        if self.rejected:
+            print(f"{Fore.YELLOW}[*] {self.rejected} rows were skipped{Style.RESET_ALL}")
+
+    # -----------------------------
+    # batched inserts (fallback)
+    # -----------------------------
+    def read_records(self):
+        """(row number, record) of every row in the file, the row number is the line number for NDJSON"""
+        if self.fmt == 'ndjson':
+            with open(self.path, encoding='utf-8') as f:
+                for number, line in enumerate(f, 1):
+                    line = line.strip()
+                    if line:
+                        yield number, parse_line(line)
+        else:
+            with open(self.path, newline='', encoding='utf-8') as f:
+                for number, row in enumerate(csv.DictReader(f), 1):
+                    yield number, {(k or '').strip().lower(): (v if v != '' else None) for k, v in row.items()}
+
+    def insert_batches(self, position):
+        progress = Progress("Inserted")
+        inserted = 0
+        batch = []
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+
+            def flush(done):
+                nonlocal inserted
+                if batch:
+                    self.db.insert_people(cursor, batch)
+                    inserted += len(batch)
+                    batch.clear()
+                self.save_checkpoint(cursor, 'batch', 'inserting', done)
+                conn.commit()
+                progress.update(inserted)
+
+            done = 0
+            for row, record in self.read_records():
+                done += 1
+                if done <= position:
+                    continue # already imported before a restart
+                person, error = validate_record(record)
+                if error:
+                    self.reject(row, error)
+                    continue
+                batch.append(person)
+                if len(batch) >= self.batch_size:
+                    flush(done)
+            flush(done)
+        progress.update(inserted, force=True)
+        self.report_rejected()
+
+    # -----------------------------
+    def run(self, use_load_data=True, rebuild_indexes=False):
+        self.setup()
+        checkpoint = self.get_checkpoint()
+        if checkpoint:
+            print(f"{Fore.YELLOW}[*] Resuming earlier import of {self.path} ({checkpoint['method']}, at {checkpoint['position']}){Style.RESET_ALL}")
+
+        if rebuild_indexes:
+            self.drop_indexes()
+
+        start = time.monotonic()
+        try:
+            if checkpoint and checkpoint['method'] == 'load':
+                method = 'load'
+                self.merge()
+            elif checkpoint:
+                method = 'batch'
+                self.insert_batches(checkpoint['position'])
+            elif use_load_data and self.stage():
+                method = 'load'
+                self.merge()
+            else:
+                method = 'batch'
+                print(f"{Fore.YELLOW}[*] Using batched inserts{Style.RESET_ALL}")
+                self.insert_batches(0)
+        finally:
+            if rebuild_indexes:
+                self.rebuild_indexes()
+
+        self.clear_checkpoint()
+        if method == 'load':
+            with self.db.get_connection() as conn:
+                conn.cursor().execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        # running workers catch up with their suggestion index (or rebuild it after a big import)
+        self.db.suggest.generation.bump()
+        self.db.people_changed()
+        print(f"{Fore.GREEN}[+] Import done in {time.monotonic() - start:.1f}s{Style.RESET_ALL}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a CSV/NDJSON dump into the CipherStorm people tables")
+    parser.add_argument("file", help="CSV (with a header row) or NDJSON file")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="default: guessed from the file extension")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per transaction for batched inserts")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="staged rows merged per transaction")
+    parser.add_argument("--no-load-data", action="store_true", help="don't try LOAD DATA LOCAL INFILE")
+    parser.add_argument("--rebuild-indexes", action="store_true", help="drop the people search indexes while loading and build them again after")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.file):
+        print(f"{Fore.RED}[-] {args.file} not found{Style.RESET_ALL}")
+        sys.exit(1)
+
+    db = get_db()
+    importer = Importer(db, args.file, detect_format(args.file, args.format), args.batch_size, args.chunk_size)
+    try:
+        importer.run(use_load_data=not args.no_load_data, rebuild_indexes=args.rebuild_indexes)
+    except Error as e:
+        print(f"{Fore.RED}[-] Import stopped: {e}{Style.RESET_ALL}")
+        print(f"{Fore.YELLOW}[*] Run the same command again to continue{Style.RESET_ALL}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,10 @@
 import flask
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from database import DatabaseManager
+from database import get_db
 from api.main import api
 from api.keygen import generate_key
+from exporter import parse_convicted
+from httpcache import versioned
 from flask import request, redirect, url_for, flash
 from colorama import Fore, Style
 from colorama import init
@@ -20,7 +22,7 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'index'
 
-db = DatabaseManager()
+db = get_db()
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = 'static/images'
@@ -29,6 +31,16 @@ UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@app.template_global()
+def image_url(image_path, size='web'):
+    """Static URL of the thumb/web copy of an image, the original until the copy is made"""
+    return url_for('static', filename=db.image_store.variant(image_path, size))
+
+def uploaded_images():
+    """(file, filename) pairs of the image uploads in this request, see DatabaseManager.add_person_images"""
+    return [(file, secure_filename(file.filename)) for file in request.files.getlist('images')
+            if file and allowed_file(file.filename)]
+
 
 class User(UserMixin):
     def __init__(self, user_data):
@@ -38,7 +50,7 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    user_data = db.get_user_by_id(int(user_id))
+    user_data = db.get_session_user(int(user_id))
     if user_data:
         return User(user_data)
     return None
@@ -184,9 +196,41 @@ def edit_user(user_id):
 
 @app.route('/predators', methods=['GET'])
 @login_required
+# the page has admin-only buttons, so a privilege change has to give a different page
+@versioned(db.get_page_version, vary=lambda: (current_user.get_id(), current_user.is_admin))
 def predators():
-    people = db.get_all_people()
-    return flask.render_template('database/db.html', people=people)
+    limit = request.args.get('limit', type=int)
+    after = request.args.get('after', type=int)
+    label = request.args.get('label') or None
+    convicted = request.args.get('convicted') or None
+    try:
+        people, next_cursor = db.get_people_page(limit=limit, after=after, label=label, convicted=parse_convicted(convicted))
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('predators'))
+    next_url = url_for('predators', limit=limit, after=next_cursor, label=label, convicted=convicted) if next_cursor else None
+    first_url = url_for('predators', limit=limit, label=label, convicted=convicted) if after else None
+    return flask.render_template('database/db.html', people=people, next_url=next_url, first_url=first_url,
+                                 facets=db.get_label_facets(), label=label, convicted=convicted)
+
+@app.route('/predators/search', methods=['GET'])
+@login_required
+def search_predators():
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', type=int)
+    page = request.args.get('page', 1, type=int)
+    if not query:
+        return redirect(url_for('predators'))
+
+    people, has_next = db.search_people(query, limit=limit, page=page)
+    next_url = url_for('search_predators', q=query, limit=limit, page=page + 1) if has_next else None
+    first_url = url_for('search_predators', q=query, limit=limit) if page > 1 else None
+    return flask.render_template('database/db.html', people=people, query=query, next_url=next_url, first_url=first_url)
+
+@app.route('/predators/suggest', methods=['GET'])
+@login_required
+def suggest_predators():
+    return flask.jsonify(db.suggest_people(request.args.get('q', ''), limit=request.args.get('limit', type=int)))
 
 @app.route('/predators/add', methods=['GET', 'POST'])
 @login_required
@@ -203,41 +247,11 @@ def add_predator():
         convicted = request.form.get('convicted', 'off') == 'on'
 
         # -----------------------
-        # Handle uploaded images
+        # Add predator to DB, with the uploaded images in the same transaction
         # -----------------------
-        images = request.files.getlist('images')
-        saved_filenames = []
-
-        for file in images:
-            if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(temp_path)
-                saved_filenames.append(filename)  # we'll move them after DB insert
-
-        # -----------------------
-        # Add predator to DB
-        # -----------------------
-        if db.add_person(name, description, address, phone, email, ipaddress, label, convicted, socials):
-            # Get the last added predator to retrieve its ID
-            predator = db.get_all_people()[-1]
-            person_id = predator['id']
-
-            # Create folder for this predator
-            predator_folder = os.path.join(app.config['UPLOAD_FOLDER'], f'predator_{person_id}')
-            os.makedirs(predator_folder, exist_ok=True)
-
-            final_paths = []
-            for filename in saved_filenames:
-                src = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                dst = os.path.join(predator_folder, filename)
-                os.rename(src, dst)
-                final_paths.append(f'images/predator_{person_id}/{filename}')
-
-            # Update images in DB
-            db.update_person_images(person_id, final_paths)
-
-            flash(f'{name} added successfully')
+        person_id = db.add_person(name, description, address, phone, email, ipaddress, label, convicted, socials, uploads=uploaded_images())
+        if person_id:
+            flash(f'{name} added successfully (ID {person_id})')
             return redirect(url_for('predators'))
         else:
             flash(f'Failed to add {name}')
@@ -272,11 +286,6 @@ def view_predator(person_id):
 @app.route('/predators/edit/<int:person_id>', methods=['GET', 'POST'])
 @login_required
 def edit_predator(person_id):
-    person = db.get_person(person_id)
-    if not person:
-        flash(f'Person with ID {person_id} not found')
-        return redirect(url_for('predators'))
-
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
         address = request.form.get('address', '').strip()
@@ -292,50 +301,43 @@ def edit_predator(person_id):
             flash('Name and Description are required.')
             return redirect(url_for('edit_predator', person_id=person_id))
 
-        if db.update_person(person_id, name, description, address, phone, email, ipaddress, label, convicted, socials):
-            images = request.files.getlist('images')
-            saved_filenames = []
-
-            # Save images temporarily
-            for file in images:
-                if file.filename != "":
-                    filename = secure_filename(file.filename)
-                    temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    if temp_path != "static/images/":
-                        file.save(temp_path)
-                        # print()
-                        saved_filenames.append(file.filename)
-                    
-            predator_folder = os.path.join(app.config['UPLOAD_FOLDER'], f'predator_{person_id}')
-            os.makedirs(predator_folder, exist_ok=True)
-
-            final_paths = []
-            for filename in saved_filenames:
-                src = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                dst = os.path.join(predator_folder, filename)
-                os.rename(src, dst)
-                final_paths.append(f'images/predator_{person_id}/{filename}')
-                
-            predator = db.get_person(person_id=person_id)
-            previous_paths = predator['images']
-            
-            for path in previous_paths:
-              final_paths.append(path)
-              
-            # Update images in DB
-            
-            db.update_person_images(person_id, final_paths)
-
-            flash(f'{name} updated successfully')
+        # only what's different gets written, new images are added to the ones the person already has
+        changed = db.patch_person(person_id, {
+            'name': name, 'description': description, 'address': address, 'phone': phone, 'email': email,
+            'ipaddress': ipaddress, 'label': label, 'convicted': convicted, 'socials': socials
+        }, uploads=uploaded_images())
+        if changed is None:
+            flash(f'Person with ID {person_id} not found')
+            return redirect(url_for('predators'))
+        elif changed is not False:
+            flash(f'{name} updated successfully' if changed else f'Nothing changed for {name}')
             return redirect(url_for('predators'))
         else:
             flash(f'Failed to update {name}')
             return redirect(url_for('edit_predator', person_id=person_id))
 
+    person = db.get_person(person_id)
+    if not person:
+        flash(f'Person with ID {person_id} not found')
+        return redirect(url_for('predators'))
     return flask.render_template('database/edit_db.html', person=person)
 
 # TODO: add image deletion (on this exact line)
 
+@app.route('/duplicates', methods=['GET'])
+@login_required
+def duplicates():
+    if not current_user.is_admin:
+        flash('Access denied.')
+        return redirect(url_for('dashboard'))
+
+    min_score = request.args.get('min_score', 0.5, type=float)
+    page = request.args.get('page', 1, type=int)
+    pairs, has_next = db.get_duplicates(min_score=min_score, page=page)
+    next_url = url_for('duplicates', min_score=min_score, page=page + 1) if has_next else None
+    first_url = url_for('duplicates', min_score=min_score) if page > 1 else None
+    return flask.render_template('admin-db/duplicates.html', pairs=pairs, min_score=min_score, next_url=next_url, first_url=first_url)
+
 @app.route('/sqlusers', methods=['GET'])
 @login_required
 def sqlusers():
@@ -375,10 +377,8 @@ def add_key():
                 key = generate_key()
             
             if db.add_apikey(label, key, administrator):
-                keys = db.get_all_apikeys()[-1]
-                idkey = keys['id']
-                
-                flash(f"{label} has been added")
+                # only the hash is stored, this is the only time the key can be shown
+                flash(f"{label} has been added, copy the key now as it won't be shown again: {key}")
                 return redirect(url_for('api'))
             else:
                 flash(f"Failed to add {label}")
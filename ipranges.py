@@ -0,0 +1,27 @@
+"""
+IP addresses as sortable 16 byte keys for the people_ips table. IPv4 addresses are stored as
+IPv4-mapped IPv6 (::ffff:a.b.c.d) so both kinds live in one indexed column and a CIDR block
+is always one contiguous range of keys.
+"""
+import ipaddress
+import re
+
+def parse_ips(value):
+    """Every IPv4/IPv6 address in a free form field (comma, space or ; separated)"""
+    ips = []
+    for part in re.split(r'[\s,;]+', str(value or '')):
+        try:
+            ips.append(ipaddress.ip_address(part.strip('[]')))
+        except ValueError:
+            continue
+    return ips
+
+def to_key(ip):
+    if ip.version == 4:
+        ip = ipaddress.IPv6Address(b'\x00' * 10 + b'\xff\xff' + ip.packed)
+    return ip.packed
+
+def cidr_range(cidr):
+    """(first key, last key) of a CIDR block or a single address, ValueError if it's neither"""
+    network = ipaddress.ip_network(str(cidr).strip(), strict=False)
+    return to_key(network.network_address), to_key(network.broadcast_address)
@@ -0,0 +1,138 @@
+"""
+Finds people that have the same (or a slightly edited) photo, using a 64 bit difference hash
+(dHash) per image. Two photos match when their hashes differ in at most a few bits.
+
+The hashes are kept in memory in a multi-index: every hash is split into 4 chunks of 16 bits
+and each chunk value has a bucket. If two hashes are within distance d, at least one of their
+chunks is within d // 4, so a lookup only checks the buckets of those few chunk values instead
+of every image.
+
+Hashes are made in the background together with the thumbnails (see thumbnails.py).
+"""
+from itertools import combinations
+from suggest import BackgroundIndex
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+MAX_DISTANCE = 15 # more than that and everything starts to match
+
+def dhash(source):
+    """
+    Difference hash of an image (a path or a file object): shrink to 9x8 grey pixels and set a
+    bit for every pixel that's brighter than its right neighbour. Needs Pillow.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image.draft('L', (64, 64)) # JPEGs get decoded at a fraction of their size
+        image = ImageOps.exif_transpose(image).convert('L').resize((9, 8), Image.LANCZOS)
+        pixels = image.tobytes() # one byte per grey pixel
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def chunk_neighbours(value, distance):
+    """Every CHUNK_BITS wide value within `distance` bit flips of value"""
+    yield value
+    for flips in range(1, distance + 1):
+        for bits in combinations(range(CHUNK_BITS), flips):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            yield flipped
+
+class HashIndex:
+    """Multi-index hashing of 64 bit hashes, entries are image id -> (person id, hash)"""
+    def __init__(self):
+        self._buckets = [{} for _ in range(CHUNKS)] # chunk value -> set of image ids
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _chunks(self, value):
+        return [(value >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNKS)]
+
+    def add(self, image_id, person_id, value):
+        self.remove(image_id)
+        self._entries[image_id] = (person_id, value)
+        for bucket, chunk in zip(self._buckets, self._chunks(value)):
+            bucket.setdefault(chunk, set()).add(image_id)
+
+    def remove(self, image_id):
+        entry = self._entries.pop(image_id, None)
+        if entry is None:
+            return
+        for bucket, chunk in zip(self._buckets, self._chunks(entry[1])):
+            ids = bucket.get(chunk)
+            if ids is not None:
+                ids.discard(image_id)
+                if not ids:
+                    del bucket[chunk]
+
+    def search(self, value, max_distance=10):
+        """(distance, image id, person id) of every hash within max_distance, closest first"""
+        candidates = set()
+        for bucket, chunk in zip(self._buckets, self._chunks(value)):
+            for neighbour in chunk_neighbours(chunk, max_distance // CHUNKS):
+                ids = bucket.get(neighbour)
+                if ids:
+                    candidates |= ids
+        results = []
+        for image_id in candidates:
+            person_id, other = self._entries[image_id]
+            distance = (value ^ other).bit_count()
+            if distance <= max_distance:
+                results.append((distance, image_id, person_id))
+        results.sort()
+        return results
+
+class PeoplePhotos(BackgroundIndex):
+    """Photo hashes of every people_images row, for finding the same photo on several people"""
+    def __init__(self, load, min_rebuild_interval=2):
+        # load returns (image id, person id, hash) rows, like DatabaseManager.iter_image_hashes
+        super().__init__(load, "people_photos", min_rebuild_interval)
+
+    def new_index(self):
+        return HashIndex()
+
+    def fill(self, index, rows):
+        for image_id, person_id, value in rows:
+            index.add(image_id, person_id, value)
+
+    def search(self, value, max_distance=10, limit=20):
+        """
+        People with a photo within max_distance bits, best match per person:
+        [{'person_id', 'image_id', 'distance'}], None while the index is still being built.
+        """
+        matches = self._query(lambda index: index.search(value, max_distance))
+        if matches is None:
+            return None
+        people = {}
+        for distance, image_id, person_id in matches:
+            if person_id not in people:
+                people[person_id] = {'person_id': person_id, 'image_id': image_id, 'distance': distance}
+                if len(people) >= limit:
+                    break
+        return list(people.values())
+
+    def update(self, rows):
+        """rows of (image id, person id, hash) that got a hash"""
+        def apply(index):
+            for image_id, person_id, value in rows:
+                index.add(image_id, person_id, value)
+        self._changed(apply)
+
+    def remove(self, image_ids):
+        def apply(index):
+            for image_id in image_ids:
+                index.remove(image_id)
+        self._changed(apply)
+
+    def reload(self):
+        """Rebuild in the background, for changes that are easier to reload than to track"""
+        self._changed()
@@ -0,0 +1,324 @@
+"""
+An optional copy of the people table in memory (PEOPLE_READ_MODEL=1), so get_person,
+get_people and get_people_page are answered without MySQL.
+
+Every person is a small __slots__ object with the short columns, kept with a sorted id list
+(and one per label) for the pages. Descriptions and image lists can be big, those go in an LRU
+with a memory budget (READ_MODEL_DETAIL_MB) and the ones that aren't in there are read from the
+database with one query per page. The first read starts loading it in the background (again in
+every forked worker), the database answers until that's done.
+
+It's kept up to date with the change feed (DatabaseManager.get_changes): before a read the
+people version is checked (cached, see get_people_version) and whatever changed since the last
+sync is applied. That covers writes from this worker (they call people_changed) and from every
+other worker or server.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from cache import MISSING
+from suggest import parse_labels
+from dotenv import load_dotenv
+import threading
+import time
+import os
+
+load_dotenv()
+
+readmodelenabled = os.getenv("PEOPLE_READ_MODEL", "0").lower() in ('1', 'true', 'yes')
+readmodeldetailmb = float(os.getenv("READ_MODEL_DETAIL_MB", "64")) # descriptions and image lists
+
+SYNC_PAGE_SIZE = 1000
+SYNC_PAGES = 5 # further behind than this (a big import) and it's loaded again instead
+
+def label_slugs(label):
+    return [slug for slug, _ in parse_labels(label)]
+
+def remove_sorted(ids, person_id):
+    i = bisect_left(ids, person_id)
+    if i < len(ids) and ids[i] == person_id:
+        del ids[i]
+
+class Person:
+    """The short columns of a people row"""
+    __slots__ = ('id', 'name', 'address', 'phone', 'email', 'ipaddress', 'label', 'convicted', 'socials')
+
+    def __init__(self, person):
+        for field in self.__slots__:
+            setattr(self, field, person.get(field))
+        self.convicted = bool(self.convicted)
+
+    def to_dict(self, description):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'address': self.address,
+            'phone': self.phone,
+            'email': self.email,
+            'ipaddress': self.ipaddress,
+            'label': self.label,
+            'description': description,
+            'convicted': self.convicted,
+            'socials': self.socials
+        }
+
+class DetailCache:
+    """LRU of person id -> (description, image paths) that stays under max_bytes (roughly)"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict() # person id -> (size, description, images)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _size(self, description, images):
+        return 100 + len(description or '') + sum(len(path) + 60 for path in images)
+
+    def get(self, person_id):
+        with self._lock:
+            entry = self._data.get(person_id)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(person_id)
+            self.hits += 1
+            return entry[1], list(entry[2])
+
+    def set(self, person_id, description, images):
+        size = self._size(description, images)
+        with self._lock:
+            self._remove(person_id)
+            if size > self.max_bytes:
+                return
+            self._data[person_id] = (size, description, tuple(images))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted, _, _) = self._data.popitem(last=False)
+                self._bytes -= evicted
+
+    def _remove(self, person_id):
+        entry = self._data.pop(person_id, None)
+        if entry is not None:
+            self._bytes -= entry[0]
+
+    def remove(self, person_id):
+        with self._lock:
+            self._remove(person_id)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'people': len(self._data), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+class PeopleReadModel:
+    """
+    The people table in memory. The read methods return MISSING when they can't answer
+    (still loading, or the database is unreachable for the sync), callers use the database then.
+    """
+    def __init__(self, db, detail_budget=int(readmodeldetailmb * 1024 * 1024)):
+        self.db = db
+        self.details = DetailCache(detail_budget)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._people = None # person id -> Person, None until the first load is done
+        self._ids = [] # sorted
+        self._by_label = {} # label slug -> sorted ids
+        self._version = None
+        self._token = None
+        self._lock = threading.Lock()
+        self._loading = False
+        self._applied = 0 # goes up with every synced change, see _details
+
+    def _check_fork(self):
+        # the load thread doesn't survive a fork (gunicorn --preload), a forked worker loads its own
+        if os.getpid() != self._pid:
+            self.details = DetailCache(self.details.max_bytes)
+            self._reset()
+
+    def start_build(self):
+        """Load everything in a background thread, does nothing if that's already running"""
+        self._check_fork()
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._load, daemon=True).start()
+
+    def _load(self):
+        from database import change_token
+        try:
+            start = time.monotonic()
+            # the version is read first, changes that are already in the rows are just applied again
+            version, _ = self.db.get_people_version()
+            if version is None:
+                return
+            people = {}
+            for person in self.db.iter_people():
+                people[person['id']] = Person(person)
+            ids = sorted(people)
+            by_label = {}
+            for person_id in ids:
+                for slug in label_slugs(people[person_id].label):
+                    by_label.setdefault(slug, []).append(person_id)
+            with self._lock:
+                self._people = people
+                self._ids = ids
+                self._by_label = by_label
+                self._version = version
+                self._token = change_token(version, 0)
+                self._applied += 1
+            self.details.clear()
+            print(f"[+] People read model loaded ({len(people)} people, {time.monotonic() - start:.1f}s)")
+        except Exception as e:
+            print(f"[-] Error loading the people read model: {e}")
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def _sync(self):
+        """Apply what changed since the last sync, False if the model can't be used right now"""
+        self._check_fork()
+        with self._lock:
+            loaded = self._people is not None
+            loading = self._loading
+        if not loaded and not loading:
+            self.start_build()
+        if not loaded or loading:
+            return False
+
+        version, _ = self.db.get_people_version()
+        with self._lock:
+            if version is None or version == self._version:
+                return True
+            start = token = self._token
+        # the database is read without holding the lock, reads from the model go on meanwhile
+        pages = []
+        for _ in range(SYNC_PAGES):
+            changes = self.db.get_changes(since=token, limit=SYNC_PAGE_SIZE)
+            if changes is None:
+                return False
+            pages.append(changes)
+            token = changes['next']
+            if not changes['has_more']:
+                break
+        else:
+            # too far behind, load it again and let the database answer until then
+            self.start_build()
+            return False
+        with self._lock:
+            # another sync or a load got there first, what it applied is at least as new
+            if self._token != start:
+                return True
+            for changes in pages:
+                for person in changes['changed']:
+                    self._put(Person(person))
+                    self.details.set(person['id'], person['description'], person['images'])
+                for deleted in changes['deleted']:
+                    self._drop(deleted['id'])
+                    self.details.remove(deleted['id'])
+            self._applied += 1
+            self._token = token
+            self._version = version
+        return True
+
+    def _put(self, person):
+        """Add or replace a person, under the lock"""
+        old = self._people.get(person.id)
+        if old is None:
+            insort(self._ids, person.id)
+        else:
+            self._unlabel(old)
+        self._people[person.id] = person
+        for slug in label_slugs(person.label):
+            insort(self._by_label.setdefault(slug, []), person.id)
+
+    def _drop(self, person_id):
+        old = self._people.pop(person_id, None)
+        if old is not None:
+            remove_sorted(self._ids, person_id)
+            self._unlabel(old)
+
+    def _unlabel(self, person):
+        for slug in label_slugs(person.label):
+            ids = self._by_label.get(slug, [])
+            remove_sorted(ids, person.id)
+            if not ids:
+                self._by_label.pop(slug, None)
+
+    def _details(self, person_ids):
+        """{person id: (description, images)} from the LRU, the rest with one get_person_details, or MISSING"""
+        details = {}
+        missing = []
+        for person_id in person_ids:
+            detail = self.details.get(person_id)
+            if detail is MISSING:
+                missing.append(person_id)
+            else:
+                details[person_id] = detail
+        if missing:
+            applied = self._applied
+            loaded = self.db.get_person_details(missing)
+            if loaded is None:
+                return MISSING
+            for person_id in missing:
+                details[person_id] = loaded.get(person_id, (None, []))
+                # a sync in the meantime may have put something newer in there already
+                if self._applied == applied:
+                    self.details.set(person_id, *details[person_id])
+        return details
+
+    def get_person(self, person_id):
+        """Like DatabaseManager.get_person (None if there's no such person) or MISSING"""
+        result = self.get_people([person_id])
+        if result is MISSING:
+            return MISSING
+        return result[0][0] if result[0] else None
+
+    def get_people(self, person_ids):
+        """Like DatabaseManager.get_people (person_ids without duplicates) or MISSING"""
+        if not self._sync():
+            return MISSING
+        with self._lock:
+            people = [self._people[person_id] for person_id in person_ids if person_id in self._people]
+        details = self._details([person.id for person in people])
+        if details is MISSING:
+            return MISSING
+        found = {person.id for person in people}
+        return ([dict(person.to_dict(details[person.id][0]), images=details[person.id][1]) for person in people],
+                [person_id for person_id in person_ids if person_id not in found])
+
+    def get_people_page(self, limit, after=None, with_images=False, label=None, convicted=None):
+        """Like DatabaseManager.get_people_page (limit already clamped) or MISSING"""
+        if not self._sync():
+            return MISSING
+        with self._lock:
+            ids = self._by_label.get(label, []) if label else self._ids
+            people = []
+            # one extra person tells us if there is a next page
+            i = bisect_right(ids, after or 0)
+            while i < len(ids) and len(people) <= limit:
+                person = self._people[ids[i]]
+                if convicted is None or person.convicted == bool(convicted):
+                    people.append(person)
+                i += 1
+        next_cursor = people[limit - 1].id if len(people) > limit else None
+        people = people[:limit]
+        details = self._details([person.id for person in people])
+        if details is MISSING:
+            return MISSING
+        page = []
+        for person in people:
+            description, images = details[person.id]
+            page.append(dict(person.to_dict(description), images=images) if with_images else person.to_dict(description))
+        return page, next_cursor
+
+    def stats(self):
+        return {'loaded': self._people is not None, 'people': len(self._people or ()), 'version': self._version,
+                'details': self.details.stats()}
@@ -1,14 +1,30 @@
-function filterTable() {
-    const input = document.getElementById('search');
-    const filter = input.value.toLowerCase();
-    const table = document.querySelector('table');
-    const tr = table.getElementsByTagName('tr');
-
-    for (let i = 1; i < tr.length; i++) {
-        const td = tr[i].getElementsByTagName('td')[1]; // Name column
-        if (td) {
-            const txtValue = td.textContent || td.innerText;
-            tr[i].style.display = txtValue.toLowerCase().indexOf(filter) > -1 ? '' : 'none';
+let suggestTimer = null;
+
+// fills the search box suggestions while typing (names, emails and social handles)
+function suggest(url) {
+    clearTimeout(suggestTimer);
+    suggestTimer = setTimeout(async () => {
+        const input = document.getElementById('search');
+        const list = document.getElementById('suggestions');
+        const query = input.value.trim();
+
+        if (query.length < 2) {
+            list.innerHTML = '';
+            return;
+        }
+
+        const response = await fetch(url + '?q=' + encodeURIComponent(query));
+        if (!response.ok) {
+            return;
+        }
+        const suggestions = await response.json();
+
+        list.innerHTML = '';
+        for (const s of suggestions) {
+            const option = document.createElement('option');
+            option.value = s.match;
+            option.label = s.field === 'name' ? s.name : s.match + ' (' + s.name + ')';
+            list.appendChild(option);
         }
-    }
-}
\ No newline at end of file
+    }, 150);
+}
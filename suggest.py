@@ -0,0 +1,378 @@
+from bisect import bisect_left, insort
+from urllib.parse import urlparse, parse_qs
+from cache import SharedGeneration
+import unicodedata
+import threading
+import json
+import time
+import os
+import re
+
+# how far behind (in change feed pages) PeopleSuggest catches up before it just rebuilds
+CATCH_UP_PAGES = 5
+CATCH_UP_PAGE_SIZE = 1000
+
+def normalize(text):
+    """Lowercase, no accents and single spaces, so 'José  DOE' and 'jose doe' are the same"""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
+
+def parse_socials(socials):
+    """
+    Socials are either a JSON list (API) or whatever was typed in the web form.
+    Returns (handle, original) pairs, a handle is the last part of a URL or the text without '@'.
+    For URLs of a script with an id (facebook.com/profile.php?id=N) it's the id instead.
+    """
+    if not socials:
+        return []
+    try:
+        items = json.loads(socials)
+        if not isinstance(items, list):
+            items = [items]
+    except (ValueError, TypeError):
+        items = re.split(r'[\s,;]+', socials)
+
+    handles = []
+    for item in items:
+        item = str(item).strip()
+        if not item:
+            continue
+        handle = item
+        if '://' in item or item.startswith('www.'):
+            url = urlparse(item if '://' in item else 'https://' + item)
+            segments = [s for s in url.path.split('/') if s]
+            if not segments:
+                continue
+            handle = segments[-1]
+            # 'profile.php' is the same for everyone, the id says who it is
+            ids = parse_qs(url.query).get('id')
+            if '.' in handle and ids:
+                handle = ids[0]
+        handle = normalize(handle.lstrip('@'))
+        if handle:
+            handles.append((handle, item))
+    return handles
+
+# sites with more than one domain, anything else is known by its domain
+SOCIAL_PLATFORMS = {
+    'x.com': 'twitter',
+    'twitter.com': 'twitter',
+    'fb.com': 'facebook',
+    'facebook.com': 'facebook',
+    'youtu.be': 'youtube',
+    'youtube.com': 'youtube',
+    't.me': 'telegram',
+    'telegram.me': 'telegram',
+    'discord.gg': 'discord',
+    'discord.com': 'discord'
+}
+
+def social_platform(original):
+    """'twitter' for https://x.com/someone, the domain for other URLs and '' for a bare handle"""
+    if '://' not in original and not original.startswith('www.'):
+        return ''
+    host = (urlparse(original if '://' in original else 'https://' + original).hostname or '').lower()
+    for prefix in ('www.', 'm.', 'mobile.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    if host in SOCIAL_PLATFORMS:
+        return SOCIAL_PLATFORMS[host]
+    return host.rsplit('.', 1)[0] if host.endswith('.com') else host
+
+def parse_social_accounts(socials):
+    """{(platform, handle)} of a socials field, see parse_socials and social_platform"""
+    return {(social_platform(original)[:50], handle[:255]) for handle, original in parse_socials(socials)}
+
+def parse_labels(label):
+    """
+    The labels in a label field ('Groomer, DNI; scammer'), as (slug, name) pairs.
+    The slug is the normalized name, so 'DNI' and 'dni ' are the same label.
+    """
+    labels = {}
+    for name in re.split(r'[,;\n]+', label or ''):
+        name = ' '.join(name.split())[:100]
+        slug = normalize(name)
+        if slug and slug not in labels:
+            labels[slug] = name
+    return list(labels.items())
+
+def person_terms(person):
+    """(term, field, value) entries a person can be found by"""
+    terms = []
+    name = person.get('name')
+    if name:
+        normalized = normalize(name)
+        terms.append((normalized, 'name', name))
+        # so 'doe' finds 'John Doe' as well
+        for word in normalized.split()[1:]:
+            terms.append((word, 'name', name))
+    email = person.get('email')
+    if email:
+        terms.append((normalize(email), 'email', email))
+    for handle, original in parse_socials(person.get('socials')):
+        terms.append((handle, 'social', original))
+    return terms
+
+class PrefixIndex:
+    """Sorted array of (term, id, field, value), a prefix lookup is one bisect"""
+    def __init__(self):
+        self._entries = []
+        self._by_id = {} # id -> (name, entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, person):
+        self.remove(person['id'])
+        entries = [(term, person['id'], field, value) for term, field, value in person_terms(person)]
+        for entry in entries:
+            insort(self._entries, entry)
+        self._by_id[person['id']] = (person.get('name'), entries)
+
+    def add_many(self, people):
+        """Like add for every person, with one sort at the end instead of an insort per entry"""
+        people = {person['id']: person for person in people}
+        self.remove_many(people)
+        for person_id, person in people.items():
+            entries = [(term, person_id, field, value) for term, field, value in person_terms(person)]
+            self._entries.extend(entries)
+            self._by_id[person_id] = (person.get('name'), entries)
+        self._entries.sort()
+
+    def remove_many(self, person_ids):
+        removed = set()
+        for person_id in person_ids:
+            removed.update(self._by_id.pop(person_id, (None, []))[1])
+        if removed:
+            self._entries = [entry for entry in self._entries if entry not in removed]
+
+    def remove(self, person_id):
+        _, entries = self._by_id.pop(person_id, (None, []))
+        for entry in entries:
+            i = bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    def search(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        i = bisect_left(self._entries, (prefix,))
+        while i < len(self._entries) and len(results) < limit:
+            term, person_id, field, value = self._entries[i]
+            if not term.startswith(prefix):
+                break
+            if person_id not in seen:
+                seen.add(person_id)
+                results.append({
+                    'id': person_id,
+                    'name': self._by_id[person_id][0],
+                    'field': field,
+                    'match': value
+                })
+            i += 1
+        return results
+
+class BackgroundIndex:
+    """
+    An in-memory index of the database that every worker keeps for itself.
+    Writes in this process update it right away, writes in other workers bump a shared
+    generation. The index then catches up with what changed (if the subclass can tell, see
+    position and changes_since) or gets rebuilt, both in the background (old one is used until then).
+    Subclasses say how to make an empty index (new_index) and how to fill it (fill).
+    """
+    def __init__(self, load, name, min_rebuild_interval=2):
+        self.load = load
+        self.min_rebuild_interval = min_rebuild_interval
+        self.generation = SharedGeneration(name)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._index = None
+        self._lock = threading.Lock()
+        self._seen = None
+        self._position = None
+        self._building = False
+        self._last_build = 0
+        self._catching_up = False
+
+    def _check_fork(self):
+        # the build thread doesn't survive a fork (gunicorn --preload), a forked worker builds its own
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def new_index(self):
+        raise NotImplementedError
+
+    def fill(self, index, rows):
+        raise NotImplementedError
+
+    def position(self):
+        """Where the data is right before a build, for changes_since (None: always rebuild)"""
+        return None
+
+    def changes_since(self, position):
+        """(changes, new position) of what was written after position, None if it's easier to rebuild"""
+        return None
+
+    def apply(self, index, changes):
+        raise NotImplementedError
+
+    def start_build(self):
+        """Rebuild in a background thread, does nothing if a rebuild is already running"""
+        self._check_fork()
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._last_build = time.monotonic()
+        threading.Thread(target=self._build, daemon=True).start()
+
+    def _build(self):
+        try:
+            generation = self.generation.current()
+            position = self.position()
+            index = self.new_index()
+            self.fill(index, self.load())
+            with self._lock:
+                self._index = index
+                self._seen = generation
+                self._position = position
+        except Exception as e:
+            print(f"[-] Error building {type(self).__name__} index: {e}")
+        finally:
+            with self._lock:
+                self._building = False
+
+    def start_catch_up(self):
+        """Apply other workers' writes in a background thread (or rebuild if that's not possible)"""
+        self._check_fork()
+        with self._lock:
+            if self._catching_up or self._building:
+                return
+            self._catching_up = True
+        threading.Thread(target=self._catch_up_or_rebuild, daemon=True).start()
+
+    def _catch_up_or_rebuild(self):
+        try:
+            caught_up = self._catch_up()
+        except Exception as e:
+            print(f"[-] Error catching up {type(self).__name__} index: {e}")
+            caught_up = False
+        finally:
+            with self._lock:
+                self._catching_up = False
+        if not caught_up and time.monotonic() - self._last_build >= self.min_rebuild_interval:
+            self.start_build()
+
+    def _catch_up(self):
+        """Apply other workers' writes to a stale index, False if it needs a rebuild for that"""
+        with self._lock:
+            index, position = self._index, self._position
+            generation = self.generation.current()
+            if index is None or self._seen == generation:
+                return True
+            if position is None or self._building:
+                return False
+        # the database is read without holding the index lock, searches go on meanwhile
+        caught_up = self.changes_since(position)
+        if caught_up is None:
+            return False
+        changes, position = caught_up
+        with self._lock:
+            if self._index is index:
+                self.apply(index, changes)
+                self._position = position
+                self._seen = generation
+        return True
+
+    def _query(self, search):
+        """search(index) on the current index, None while the first build is still running (started here)"""
+        self._check_fork()
+        with self._lock:
+            index = self._index
+            stale = self._seen != self.generation.current()
+            due = time.monotonic() - self._last_build >= self.min_rebuild_interval
+            catch_up = index is not None and stale and self._position is not None
+            rebuild = index is None or (stale and due and not catch_up)
+            if index is not None:
+                results = search(index)
+        # the index is brought up to date in the background, this search is answered from what's there
+        if catch_up:
+            self.start_catch_up()
+        elif rebuild:
+            self.start_build()
+        if index is None:
+            return None
+        return results
+
+    def _changed(self, apply=None):
+        self._check_fork()
+        with self._lock:
+            if self._index is not None and apply is not None:
+                apply(self._index)
+            before = self.generation.current()
+            after = self.generation.bump()
+            # if nobody else wrote in between, our own bump doesn't need a rebuild here
+            if apply is not None and self._seen == before and after == before + 1:
+                self._seen = after
+
+class PeopleSuggest(BackgroundIndex):
+    """Prefix index of names, emails and social handles for typeahead"""
+    def __init__(self, load, changes=None, change_token=None, min_rebuild_interval=2):
+        # load returns every person, like DatabaseManager.iter_people, other workers' writes are
+        # read from changes (DatabaseManager.get_changes) since change_token() at the last build
+        super().__init__(load, "people_suggest", min_rebuild_interval)
+        self.changes = changes
+        self.change_token = change_token
+
+    def new_index(self):
+        return PrefixIndex()
+
+    def fill(self, index, people):
+        index.add_many(people)
+
+    def position(self):
+        return self.change_token() if self.change_token else None
+
+    def changes_since(self, token):
+        changed = {}
+        deleted = set()
+        for _ in range(CATCH_UP_PAGES):
+            changes = self.changes(since=token, limit=CATCH_UP_PAGE_SIZE)
+            if changes is None:
+                return None
+            for person in changes['changed']:
+                changed[person['id']] = person
+                deleted.discard(person['id'])
+            for person in changes['deleted']:
+                changed.pop(person['id'], None)
+                deleted.add(person['id'])
+            token = changes['next']
+            if not changes['has_more']:
+                return (list(changed.values()), deleted), token
+        # too far behind (a big import), a rebuild is quicker
+        return None
+
+    def apply(self, index, changes):
+        changed, deleted = changes
+        index.remove_many(deleted)
+        index.add_many(changed)
+
+    def search(self, prefix, limit=10):
+        results = self._query(lambda index: index.search(prefix, limit))
+        return [] if results is None else results # [] while the first build is still running
+
+    def update(self, person):
+        self._changed(lambda index: index.add(person))
+
+    def update_many(self, people):
+        self._changed(lambda index: index.add_many(people))
+
+    def remove(self, person_id):
+        self._changed(lambda index: index.remove(person_id))
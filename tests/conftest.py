@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# shared generation files of the tests don't mix with a running server's
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="cipherstorm-tests-"))
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def execute(self, query, params=()):
+        query = ' '.join(query.split())
+        self.conn.queries.append((query, tuple(params)))
+        result = self.conn.respond(self, query, tuple(params))
+        # an int is the rowcount of a write, anything else the rows of a read
+        self.rows = [] if isinstance(result, int) else list(result or [])
+        self.rowcount = result if isinstance(result, int) else len(self.rows)
+
+    def executemany(self, query, seq):
+        for params in seq:
+            self.execute(query, params)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """
+    Stands in for a MySQL connection. respond(cursor, query, params) gives the rows of a query
+    (or the rowcount of a write), commit() raises commit_error when it's set.
+    """
+    def __init__(self, respond):
+        self.respond = respond
+        self.queries = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.commit_error = None
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self)
+
+    def commit(self):
+        if self.commit_error:
+            raise self.commit_error
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A DatabaseManager whose connections are a FakeConnection (db.conn) and images live in tmp_path"""
+    from database import DatabaseManager
+    from imagestore import ImageStore
+
+    manager = DatabaseManager()
+    manager._ready = True
+    manager.image_store = ImageStore(root=str(tmp_path))
+    manager.thumbnails.submit = lambda images: None
+    manager.conn = FakeConnection(lambda cursor, query, params: [])
+
+    @contextmanager
+    def connection():
+        try:
+            yield manager.conn
+        except BaseException:
+            manager.conn.rollback()
+            raise
+
+    monkeypatch.setattr(manager, "get_connection", connection)
+    return manager
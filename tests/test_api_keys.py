@@ -0,0 +1,123 @@
+from mysql.connector import Error
+
+from api.keygen import hash_key
+
+KEY = 'CS_abcd1234_secretsecretsecretsecret12'
+
+
+def keys(db, stored):
+    """Answer key lookups from stored (key hash -> (id, administrator))"""
+    def respond(cursor, query, params):
+        if query.startswith('SELECT id, administrator FROM api_keys'):
+            row = stored.get(params[0])
+            return [row] if row else []
+        if query.startswith('DELETE FROM api_keys'):
+            for key_hash, row in list(stored.items()):
+                if row[0] == params[0]:
+                    del stored[key_hash]
+            return 1
+        return []
+    db.conn.respond = respond
+
+
+def lookups(db):
+    return sum(1 for query, _ in db.conn.queries if query.startswith('SELECT id, administrator FROM api_keys'))
+
+
+def test_valid_keys_are_cached(db):
+    keys(db, {hash_key(KEY): (7, 1)})
+    assert db.lookup_api_key(KEY) == {'id': 7, 'administrator': True}
+    assert db.validate_api_administration(KEY)
+    assert lookups(db) == 1
+
+
+def test_invalid_keys_are_cached_for_a_short_time(db, monkeypatch):
+    import database
+    keys(db, {})
+    ttls = []
+    set_ = db.apikey_cache.set
+    monkeypatch.setattr(db.apikey_cache, 'set', lambda key, value, ttl=None, epoch=None: ttls.append(ttl) or set_(key, value, ttl, epoch))
+    assert not db.validate_api_key(KEY)
+    assert not db.validate_api_key(KEY)
+    assert lookups(db) == 1
+    assert ttls == [database.apikeycachenegativettl]
+
+
+def test_errors_are_not_cached(db):
+    def respond(cursor, query, params):
+        raise Error("lost connection")
+    db.conn.respond = respond
+    assert db.lookup_api_key(KEY) is None
+    keys(db, {hash_key(KEY): (7, 0)})
+    assert db.lookup_api_key(KEY) == {'id': 7, 'administrator': False}
+
+
+def test_deleted_keys_stop_working_in_every_worker(db):
+    from database import DatabaseManager
+    # another worker on the same machine, with its own cache
+    other = DatabaseManager()
+    other.get_connection = db.get_connection
+    keys(db, {hash_key(KEY): (7, 0)})
+    assert db.validate_api_key(KEY)
+    assert other.validate_api_key(KEY)
+    assert db.delete_apikey(7)
+    assert not db.validate_api_key(KEY)
+    assert not other.validate_api_key(KEY)
+
+
+def test_a_lookup_from_before_a_delete_is_not_cached(db):
+    stored = {hash_key(KEY): (7, 0)}
+    keys(db, stored)
+    fetch = db._fetch_api_key
+
+    def slow_fetch(key_hash):
+        row = fetch(key_hash)
+        # the key is deleted while this request is still reading it
+        db.delete_apikey(7)
+        return row
+    db._fetch_api_key = slow_fetch
+    assert db.validate_api_key(KEY)
+    db._fetch_api_key = fetch
+    assert not db.validate_api_key(KEY)
+
+
+def test_keys_are_stored_hashed(db):
+    from api.keygen import generate_key, key_prefix
+    key = generate_key()
+    prefix, secret = key[3:].split('_')
+    assert len(prefix) == 8 and len(secret) == 25
+    assert key_prefix(key) == prefix
+    assert key_prefix('CS_oldstylesecret') == 'oldstyle'
+    db.conn.respond = lambda cursor, query, params: 1
+    db.add_apikey('test', key, True)
+    (query, params), = db.conn.queries
+    assert query.startswith('INSERT INTO api_keys (label, key_prefix, key_hash, administrator)')
+    assert params == ('test', prefix, hash_key(key), True)
+    assert key not in str(params[2]) and len(params[2]) == 64
+
+
+def test_keys_are_looked_up_by_hash(db):
+    keys(db, {hash_key(KEY): (7, 0)})
+    db.lookup_api_key(KEY)
+    assert db.conn.queries == [('SELECT id, administrator FROM api_keys WHERE key_hash=%s', (hash_key(KEY),))]
+
+
+def test_plaintext_keys_are_hashed_once(db):
+    old = ['CS_oldstylesecretkey', 'CS_abcd1234_secret']
+
+    def respond(cursor, query, params):
+        if 'information_schema.columns' in query:
+            return [(1 if params[2] == 'api_key' else 0,)]
+        if query == 'SELECT id, api_key FROM api_keys':
+            return list(enumerate(old, 1))
+        return 0
+    db.conn.respond = respond
+    db._migrate_api_keys(db.conn.cursor())
+    updates = [params for query, params in db.conn.queries if query.startswith('UPDATE api_keys')]
+    assert updates == [('oldstyle', hash_key(old[0]), 1), ('abcd1234', hash_key(old[1]), 2)]
+    assert 'DROP COLUMN api_key' in db.conn.queries[-1][0]
+
+    db.conn.queries.clear()
+    db.conn.respond = lambda cursor, query, params: [(0,)]
+    db._migrate_api_keys(db.conn.cursor())
+    assert len(db.conn.queries) == 1
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def batch(db, monkeypatch):
+    import flask
+    import database
+    monkeypatch.setattr(database, '_db', db)
+    from api import main
+    monkeypatch.setattr(main, 'db', db)
+    asked = []
+    monkeypatch.setattr(db, 'get_people', lambda ids: asked.append(ids) or (
+        [{'id': person_id, 'images': []} for person_id in dict.fromkeys(ids) if person_id < 100],
+        [person_id for person_id in dict.fromkeys(ids) if person_id >= 100]))
+    app = flask.Flask(__name__)
+    view = main.get_people_batch.__wrapped__.__wrapped__ # without the API key check and ETags
+
+    def get(url, body=None):
+        method = 'POST' if body is not None else 'GET'
+        with app.test_request_context(url, method=method, data=json.dumps(body), content_type='application/json'):
+            response = view()
+        if isinstance(response, tuple):
+            return response[1], response[0].get_json()
+        return 200, response.get_json()
+    get.asked = asked
+    return get
+
+
+def test_ids_from_the_query_string_or_the_body(batch):
+    assert batch('/api/people/batch?ids=3,1&ids=200') == (200, {
+        'people': [{'id': 3, 'images': [], 'image_variants': []}, {'id': 1, 'images': [], 'image_variants': []}],
+        'missing': [200]})
+    status, body = batch('/api/people/batch', {'ids': [5, 5, 101]})
+    assert [person['id'] for person in body['people']] == [5] and body['missing'] == [101]
+
+
+def test_at_most_max_batch_ids(batch):
+    from api.main import MAX_BATCH_IDS
+    assert batch('/api/people/batch', {'ids': list(range(1, MAX_BATCH_IDS + 1))})[0] == 200
+    status, body = batch('/api/people/batch', {'ids': list(range(1, MAX_BATCH_IDS + 2))})
+    assert status == 400 and body['message'] == f"at most {MAX_BATCH_IDS} IDs per request"
+    assert len(batch.asked) == 1
+
+
+@pytest.mark.parametrize('body', [{'ids': 'nope'}, {'ids': [1, 'x']}, {'ids': [[1]]}, {}, []])
+def test_bad_ids(batch, body):
+    assert batch('/api/people/batch', body)[0] == 400
+    assert batch.asked == []
+
+
+def test_people_are_read_in_one_query_with_their_images(db):
+    def respond(cursor, query, params):
+        if query.startswith('SELECT id, name'):
+            return [(person_id, 'x', None, None, None, None, None, None, 0, None) for person_id in params if person_id != 4]
+        return [(2, 'a.png')] if 'people_images' in query else []
+    db.conn.respond = respond
+    people, missing = db.get_people([2, 4, 3, 2])
+    assert [(person['id'], person['images']) for person in people] == [(2, ['a.png']), (3, [])]
+    assert missing == [4]
+    assert len(db.conn.queries) == 2 and db.conn.queries[0][1] == (2, 4, 3)
+    assert db.get_people([]) == ([], [])
+    assert len(db.conn.queries) == 2
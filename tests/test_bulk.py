@@ -0,0 +1,80 @@
+from database import validate_person
+
+
+def people(*names):
+    return [dict(validate_person({'name': name})[0], images=[f'images/{name}.png']) for name in names]
+
+
+def test_bulk_ids_come_from_every_insert(db):
+    # another connection's inserts land in between, so the ids aren't consecutive
+    given = iter([10, 12, 15])
+
+    def respond(cursor, query, params):
+        if query.startswith('INSERT INTO people ('):
+            cursor.lastrowid = next(given)
+        if query.startswith('SELECT LAST_INSERT_ID()'):
+            return [(3,)]
+        return []
+    db.conn.respond = respond
+    assert db.add_people(people('a', 'b', 'c')) == [10, 12, 15]
+    images = [params for query, params in db.conn.queries if query.startswith('INSERT INTO people_images')]
+    assert images == [(10, 'images/a.png'), (12, 'images/b.png'), (15, 'images/c.png')]
+    changes = [params for query, params in db.conn.queries if query.startswith('UPDATE people SET change_seq')]
+    assert changes == [(3, 10, 12, 15)]
+
+
+def test_every_person_is_its_own_statement(db):
+    db.conn.respond = lambda cursor, query, params: [(1,)] if query.startswith('SELECT LAST_INSERT_ID()') else []
+    db.add_people(people('a', 'b'))
+    inserts = [params for query, params in db.conn.queries if query.startswith('INSERT INTO people (')]
+    assert [params[0] for params in inserts] == ['a', 'b']
+
+
+def test_a_failed_batch_returns_none(db):
+    from mysql.connector import Error
+
+    def respond(cursor, query, params):
+        raise Error("Got a packet bigger than 'max_allowed_packet' bytes")
+    db.conn.respond = respond
+    assert db.add_people(people('a')) is None
+
+
+def bulk(db, monkeypatch, body, content_type, query=''):
+    import flask
+    import database
+    monkeypatch.setattr(database, '_db', db)
+    from api import main
+    monkeypatch.setattr(main, 'db', db)
+    batches = []
+
+    def add_people(people):
+        if people:
+            batches.append([person['name'] for person in people])
+        return list(range(1, len(people) + 1))
+    monkeypatch.setattr(db, 'add_people', add_people)
+    app = flask.Flask(__name__)
+    with app.test_request_context('/api/people/bulk' + query, method='POST', data=body, content_type=content_type):
+        response, status = main.add_people_bulk.__wrapped__()
+    return response.get_json(), batches
+
+
+def test_bulk_ndjson_reports_every_line(db, monkeypatch):
+    body = '{"name": "a"}\n\nnot json\n{"name": ""}\n{"name": "b", "convicted": "maybe"}\n{"name": "c"}\n'
+    result, batches = bulk(db, monkeypatch, body, 'application/x-ndjson')
+    assert (result['inserted'], result['failed']) == (2, 3)
+    assert result['results'] == [{'index': 0, 'id': 1}, {'index': 2, 'error': 'invalid JSON'},
+                                 {'index': 3, 'error': 'name is required'},
+                                 {'index': 4, 'error': 'convicted has to be 1 or 0'}, {'index': 5, 'id': 2}]
+    assert batches == [['a', 'c']]
+
+
+def test_bulk_batches_are_limited(db, monkeypatch):
+    import json
+    body = json.dumps([{'name': str(i)} for i in range(5)])
+    result, batches = bulk(db, monkeypatch, body, 'application/json', '?batch_size=2')
+    assert result['inserted'] == 5
+    assert batches == [['0', '1'], ['2', '3'], ['4']]
+    result, batches = bulk(db, monkeypatch, body, 'application/json', '?batch_size=0')
+    assert len(batches) == 5
+    result, batches = bulk(db, monkeypatch, '{"name": "a"}', 'application/json')
+    assert result['results'][0]['error'].startswith('body has to be a JSON array')
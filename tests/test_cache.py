@@ -0,0 +1,24 @@
+import os
+
+from cache import SharedGeneration, TTLCache
+
+
+def test_generation_file_stays_small(tmp_path):
+    generation = SharedGeneration('test', directory=str(tmp_path))
+    assert generation.current() == 0
+    assert generation.changed_at() is None
+    for value in range(1, 1001):
+        assert generation.bump() == value
+    assert generation.current() == 1000
+    assert os.path.getsize(generation.path) == 8
+    assert generation.changed_at() is not None
+
+
+def test_bump_clears_every_cache(tmp_path):
+    first = TTLCache(generation=SharedGeneration('keys', directory=str(tmp_path)))
+    second = TTLCache(generation=SharedGeneration('keys', directory=str(tmp_path)))
+    first.set('key', 1)
+    second.set('key', 1)
+    first.invalidate()
+    assert first.get('key', None) is None
+    assert second.get('key', None) is None
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import pytest
+
+from database import change_token, parse_change_token
+
+DELETED_AT = datetime(2026, 1, 2, 3, 4, 5)
+
+
+class Feed:
+    """people.change_seq and people_tombstones, answered like MySQL would"""
+    def __init__(self, db, people, tombstones):
+        self.people = people # id -> change_seq
+        self.tombstones = tombstones # id -> change_seq
+        db.conn.respond = self.respond
+
+    def after(self, rows, params):
+        seq, _, last_id, limit = params
+        return sorted((s, i) for i, s in rows.items() if s > seq or (s == seq and i > last_id))[:limit]
+
+    def respond(self, cursor, query, params):
+        if query.startswith('SELECT id, name'):
+            return [(i, f'Person {i}', None, None, None, None, None, None, 0, None, s, None) for s, i in self.after(self.people, params)]
+        if query.startswith('SELECT person_id, change_seq, deleted_at FROM people_tombstones'):
+            return [(i, s, DELETED_AT) for s, i in self.after(self.tombstones, params)]
+        return []
+
+
+def read_all(db, limit):
+    pages = []
+    token = None
+    while True:
+        page = db.get_changes(since=token, limit=limit)
+        pages.append(([p['id'] for p in page['changed']], [d['id'] for d in page['deleted']]))
+        token = page['next']
+        if not page['has_more']:
+            return pages, token
+
+
+def test_changes_and_deletes_come_in_order(db):
+    # one bulk write (seq 2) with three people, person 4 was deleted at seq 3
+    Feed(db, people={1: 1, 2: 2, 3: 2, 5: 2, 6: 4}, tombstones={4: 3})
+    pages, token = read_all(db, limit=2)
+    assert pages == [([1, 2], []), ([3, 5], []), ([6], [4])]
+    assert token == '4.6'
+    page = db.get_changes(since=token)
+    assert page == {'changed': [], 'deleted': [], 'next': '4.6', 'has_more': False}
+
+
+def test_tombstones(db):
+    Feed(db, people={1: 1}, tombstones={2: 2, 3: 2})
+    page = db.get_changes(since='1.1')
+    assert page['deleted'] == [{'id': 2, 'deleted_at': DELETED_AT.isoformat()}, {'id': 3, 'deleted_at': DELETED_AT.isoformat()}]
+    assert page['next'] == '2.3'
+
+
+def test_tokens():
+    assert parse_change_token(None) == (0, 0)
+    assert parse_change_token(change_token(12, 7)) == (12, 7)
+    assert parse_change_token('12') == (12, 0)
+    for token in ('x', '1.y', '-1.0'):
+        with pytest.raises(ValueError):
+            parse_change_token(token)
+
+
+def test_a_write_gets_one_sequence_number(db):
+    db.conn.respond = lambda cursor, query, params: [(9,)] if query == 'SELECT LAST_INSERT_ID()' else 1
+    assert db.record_changes(db.conn.cursor(), [1, 2], deleted_ids=[3]) == 9
+    writes = [(query.split()[0:3], params) for query, params in db.conn.queries[2:]]
+    assert writes == [(['UPDATE', 'people', 'SET'], (9, 1, 2)), (['INSERT', 'INTO', 'people_tombstones'], (3, 9))]
+    db.conn.queries.clear()
+    assert db.record_changes(db.conn.cursor()) is None
+    assert db.conn.queries == []
@@ -0,0 +1,100 @@
+import pytest
+
+import dedup
+from dedup import blocking_keys, name_key, normalize_email, normalize_phone, score, soundex
+
+
+@pytest.mark.parametrize('phone, expected', [
+    ('(555) 123-4567', '+15551234567'),
+    ('+44 20 7946 0958', '+442079460958'),
+    ('0044 20 7946 0958', '+442079460958'),
+    ('05551234567', '+15551234567'),
+    ('123', None),
+    (None, None)])
+def test_normalize_phone(phone, expected):
+    assert normalize_phone(phone) == expected
+
+
+@pytest.mark.parametrize('email, expected', [
+    ('J.Doe+spam@GMail.com', 'jdoe@gmail.com'),
+    ('j.doe@googlemail.com', 'jdoe@gmail.com'),
+    (' J.Doe@Example.com ', 'j.doe@example.com'),
+    ('not an email', None),
+    ('@example.com', None)])
+def test_normalize_email(email, expected):
+    assert normalize_email(email) == expected
+
+
+def test_names():
+    assert [soundex(word) for word in ('robert', 'rupert', 'ashcraft', 'tymczak', 'pfister')] == [
+        'R163', 'R163', 'A261', 'T522', 'P236']
+    assert name_key('Jon Smyth') == name_key('Smith, John') == 'J500 S530'
+    assert name_key('') is None
+
+
+def test_blocking_keys():
+    keys = blocking_keys({'name': 'John Doe', 'phone': '555-123-4567', 'email': 'JOHN@x.com',
+                          'ipaddress': '10.0.0.1, 10.0.0.2', 'socials': '@johndoe'})
+    assert keys == {('name', 'D000 J500'), ('phone', '+15551234567'), ('email', 'john@x.com'),
+                    ('ip', '10.0.0.1'), ('ip', '10.0.0.2'), ('social', 'johndoe')}
+    assert blocking_keys({'name': None}) == set()
+
+
+def test_score():
+    assert score(['email']) == 0.6
+    assert score(['email', 'phone', 'email']) == 0.8
+    assert score([]) == 0
+
+
+class Keys:
+    """people_keys and people_duplicates as far as _index_duplicates needs them"""
+    def __init__(self, db):
+        self.keys = set()
+        self.pairs = {}
+        db.conn.respond = self.respond
+
+    def respond(self, cursor, query, params):
+        if query.startswith('DELETE FROM people_keys'):
+            self.keys = {key for key in self.keys if key[2] not in params}
+        elif query.startswith('DELETE FROM people_duplicates'):
+            self.pairs = {pair: value for pair, value in self.pairs.items() if not set(pair) & set(params)}
+        elif query.startswith('INSERT INTO people_keys'):
+            self.keys.add(params)
+        elif query.startswith('INSERT INTO people_duplicates'):
+            self.pairs[params[:2]] = params[2:]
+        elif query.startswith('SELECT kind, value, COUNT(*)'):
+            blocks = set(zip(params[::2], params[1::2]))
+            counts = {}
+            for kind, value, _ in self.keys:
+                if (kind, value) in blocks:
+                    counts[kind, value] = counts.get((kind, value), 0) + 1
+            return [block + (count,) for block, count in counts.items()]
+        elif query.startswith('SELECT kind, value, person_id'):
+            blocks = set(zip(params[::2], params[1::2]))
+            return sorted(key for key in self.keys if key[:2] in blocks)
+        return 0
+
+
+def person(person_id, **fields):
+    return dict({'id': person_id, 'name': None, 'phone': None, 'email': None, 'ipaddress': None, 'socials': None}, **fields)
+
+
+def test_people_sharing_keys_become_pairs(db):
+    table = Keys(db)
+    cursor = db.conn.cursor()
+    db._index_duplicates(cursor, [person(1, name='John Smith', email='john.smith@gmail.com')])
+    db._index_duplicates(cursor, [person(2, name='Jon Smyth', email='JohnSmith+x@googlemail.com'), person(3, name='Jane Doe')])
+    assert table.pairs == {(1, 2): (0.7, 'email,name')}
+    # person 2 changes their email, only the name is shared now
+    db._index_duplicates(cursor, [person(2, name='Jon Smyth', email='jon@example.com')])
+    assert table.pairs == {(1, 2): (0.25, 'name')}
+
+
+def test_big_blocks_are_not_evidence(db, monkeypatch):
+    monkeypatch.setattr(dedup, 'MAX_BLOCK_SIZE', 2)
+    table = Keys(db)
+    cursor = db.conn.cursor()
+    db._index_duplicates(cursor, [person(1, ipaddress='10.0.0.1'), person(2, ipaddress='10.0.0.1')])
+    assert list(table.pairs) == [(1, 2)]
+    db._index_duplicates(cursor, [person(3, ipaddress='10.0.0.1')])
+    assert 3 not in {person_id for pair in table.pairs for person_id in pair}
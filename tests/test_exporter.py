@@ -0,0 +1,88 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import exporter
+from exporter import export_chunks, guess_options, parse_convicted, filename
+
+
+def person(person_id, images=()):
+    return {'id': person_id, 'name': f'Person {person_id}', 'address': 'Main St, 1', 'phone': None, 'email': None,
+            'ipaddress': None, 'label': 'scammer', 'description': 'says "hi"\nand more', 'convicted': True,
+            'socials': None, 'images': list(images)}
+
+
+PEOPLE = [person(1, ['a.png', 'b.png']), person(2)]
+
+
+def export(fmt, compression=None, people=PEOPLE):
+    return b''.join(export_chunks(iter(people), fmt, compression))
+
+
+def test_csv(monkeypatch):
+    monkeypatch.setattr(exporter, 'ROWS_PER_CHUNK', 1)
+    rows = list(csv.DictReader(io.StringIO(export('csv').decode())))
+    assert [row['id'] for row in rows] == ['1', '2']
+    assert rows[0]['description'] == 'says "hi"\nand more'
+    assert rows[0]['images'] == 'a.png;b.png' and rows[1]['images'] == ''
+
+
+def test_csv_can_be_imported_again(tmp_path):
+    from importer import Importer, validate_record
+    dump = tmp_path / 'people.csv'
+    dump.write_bytes(export('csv'))
+    records = [validate_record(record)[0] for _, record in Importer(None, str(dump), 'csv', 1, 1).read_records()]
+    assert [(p['name'], p['description'], p['convicted'], p['images']) for p in records] == [
+        ('Person 1', 'says "hi"\nand more', True, ['a.png', 'b.png']), ('Person 2', 'says "hi"\nand more', True, [])]
+
+
+def test_ndjson():
+    lines = export('ndjson').decode().splitlines()
+    assert [json.loads(line) for line in lines] == PEOPLE
+
+
+def test_columns(monkeypatch):
+    monkeypatch.setattr(exporter, 'ROWS_PER_GROUP', 2)
+    groups = [json.loads(line) for line in export('columns', people=PEOPLE + [person(3)]).decode().splitlines()]
+    assert [group['rows'] for group in groups] == [2, 1]
+    assert groups[0]['columns']['id'] == [1, 2]
+    assert groups[0]['columns']['images'] == [['a.png', 'b.png'], []]
+    assert list(groups[1]['columns']) == list(exporter.FIELDS)
+
+
+def test_gzip():
+    assert gzip.decompress(export('ndjson', 'gzip')) == export('ndjson')
+
+
+def test_bad_options_fail_before_anything_is_read():
+    def people():
+        raise AssertionError("read the database")
+        yield
+    with pytest.raises(ValueError):
+        next(export_chunks(people(), 'xml'))
+    with pytest.raises(ValueError):
+        next(export_chunks(people(), 'csv', 'rar'))
+
+
+def test_options():
+    assert guess_options('people.csv.gz', None, None) == ('csv', 'gzip')
+    assert guess_options('people.columns.zst', None, None) == ('columns', 'zstd')
+    assert guess_options('-', None, None) == ('ndjson', None)
+    assert guess_options('people.csv', 'ndjson', 'gzip') == ('ndjson', 'gzip')
+    assert filename('columns', 'zstd') == 'people.columns.ndjson.zst'
+    assert [parse_convicted(value) for value in (None, '', 'Yes', '0')] == [None, None, True, False]
+    with pytest.raises(ValueError):
+        parse_convicted('maybe')
+
+
+def test_joined_rows_become_one_person_each(db):
+    def row(person_id, image):
+        return (person_id, f'Person {person_id}', None, None, None, None, None, None, 1, None, image)
+    db.conn.respond = lambda cursor, query, params: [row(1, 'a.png'), row(1, 'b.png'), row(2, None), row(3, 'c.png')]
+    people = list(db.iter_people_with_images(label='50%', convicted=True))
+    assert [(p['id'], p['images']) for p in people] == [(1, ['a.png', 'b.png']), (2, []), (3, ['c.png'])]
+    (query, params), = db.conn.queries
+    assert params == (0, '%50\\%%', 1)
@@ -0,0 +1,62 @@
+import flask
+import pytest
+
+import httpcache
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(httpcache, 'response_cache', httpcache.TTLCache(maxsize=16, ttl=60))
+    app = flask.Flask(__name__)
+    app.secret_key = 'test'
+    state = {'version': 1, 'admin': False, 'renders': 0}
+
+    @app.route('/page')
+    @httpcache.versioned(lambda: (state['version'], None), vary=lambda: ('user', state['admin']))
+    def page():
+        state['renders'] += 1
+        return f"admin={state['admin']}"
+
+    app.state = state
+    return app
+
+
+def test_a_new_version_gives_a_new_page(app):
+    client = app.test_client()
+    first = client.get('/page')
+    assert client.get('/page', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    app.state['version'] = 2
+    assert client.get('/page', headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+
+def test_vary_is_part_of_the_etag_and_cache_key(app):
+    client = app.test_client()
+    first = client.get('/page')
+    assert client.get('/page').get_data(as_text=True) == 'admin=False'
+    assert app.state['renders'] == 1
+    app.state['admin'] = True
+    again = client.get('/page', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 200
+    assert again.get_data(as_text=True) == 'admin=True'
+
+
+def test_made_thumbnails_change_the_page_version(db):
+    db.get_people_version = lambda: (5, None)
+    before, _ = db.get_page_version()
+    db.thumbnails.generation.bump()
+    after, changed_at = db.get_page_version()
+    assert before != after
+    assert changed_at is not None
+
+
+def test_making_thumbnails_bumps_the_generation(db):
+    from PIL import Image
+    image_path = 'images/photo.png'
+    Image.new('RGB', (400, 300), 'red').save(db.image_store.file_path(image_path))
+    db.thumbnails.store = db.image_store
+    db.thumbnails.hooks = []
+    before = db.thumbnails.generation.current()
+    assert db.thumbnails.generate(image_path) == 2
+    assert db.thumbnails.generation.current() == before + 1
+    assert db.thumbnails.generate(image_path) == 0
+    assert db.thumbnails.generation.current() == before + 1
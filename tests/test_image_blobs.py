@@ -0,0 +1,84 @@
+import os
+
+import pytest
+from mysql.connector import Error
+
+
+class Blobs:
+    """image_blobs and people_images of one person with one stored image, as far as the queries need"""
+    def __init__(self, db, sha='ab' * 32):
+        self.db = db
+        self.sha = sha
+        self.image_path = db.image_store.image_path(sha, 'png')
+        self.file = db.image_store.file_path(self.image_path)
+        self.blobs = {sha: self.image_path}
+        self.deleted = set() # deleted in the open transaction
+        db.conn.respond = self.respond
+        commit = db.conn.commit
+
+        def commit_blobs():
+            commit()
+            for deleted in self.deleted:
+                self.blobs.pop(deleted, None)
+            self.deleted.clear()
+        db.conn.commit = commit_blobs
+
+    def write_file(self):
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        with open(self.file, 'wb') as out:
+            out.write(b'\x89PNG\r\n\x1a\n')
+
+    def respond(self, cursor, query, params):
+        if query.startswith('SELECT id FROM people WHERE id'):
+            return [(1,)]
+        if query.startswith('SELECT id, blob_sha256 FROM people_images'):
+            return [(10, self.sha)]
+        if query.startswith('SELECT image_path FROM image_blobs WHERE sha256'):
+            sha = params[0]
+            return [(self.blobs[sha],)] if sha in self.blobs and sha not in self.deleted else []
+        if query.startswith('DELETE FROM image_blobs'):
+            self.deleted.add(params[0])
+            return 1
+        if query.startswith('DELETE FROM people WHERE'):
+            return 1
+        if query.startswith('SELECT LAST_INSERT_ID()'):
+            return [(7,)]
+        return []
+
+
+@pytest.fixture
+def blobs(db):
+    store = Blobs(db)
+    store.write_file()
+    return store
+
+
+def test_released_file_is_removed_after_commit(db, blobs):
+    assert db.remove_person_images(1, [blobs.image_path])
+    assert not blobs.blobs
+    assert not os.path.exists(blobs.file)
+
+
+def test_released_file_stays_when_the_commit_fails(db, blobs):
+    db.conn.commit_error = Error("lost connection")
+    assert not db.remove_person_images(1, [blobs.image_path])
+    assert blobs.blobs == {blobs.sha: blobs.image_path}
+    assert os.path.exists(blobs.file)
+
+
+def test_delete_person_keeps_files_when_the_commit_fails(db, blobs):
+    db.conn.commit_error = Error("deadlock")
+    assert not db.delete_person(1)
+    assert os.path.exists(blobs.file)
+
+
+def test_file_uploaded_again_after_the_commit_stays(db, blobs):
+    # someone stores the same file right after our commit, before the file is removed
+    commit = db.conn.commit
+
+    def commit_then_upload():
+        commit()
+        blobs.blobs[blobs.sha] = blobs.image_path
+    db.conn.commit = commit_then_upload
+    assert db.remove_person_images(1, [blobs.image_path])
+    assert os.path.exists(blobs.file)
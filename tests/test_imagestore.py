@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from imagestore import ImageStore, safe_image_path
+
+
+@pytest.mark.parametrize('path', ['images/blobs/ab/cd/abcd.png', 'images/old/photo 1.jpg', 'photo.jpg'])
+def test_safe_image_paths(path):
+    assert safe_image_path(path)
+
+
+@pytest.mark.parametrize('path', ['../../../etc/x', 'images/../../etc/passwd', '/etc/passwd', 'C:/Windows/x.png',
+                                  'images\\..\\x.png', '', None, 5])
+def test_unsafe_image_paths(path):
+    assert not safe_image_path(path)
+
+
+def test_file_path_stays_in_the_root(tmp_path):
+    store = ImageStore(root=str(tmp_path / 'images'))
+    assert store.file_path('images/blobs/ab/x.png') == str(tmp_path / 'images' / 'blobs' / 'ab' / 'x.png')
+    with pytest.raises(ValueError):
+        store.file_path('../../../etc/x')
+    with pytest.raises(ValueError):
+        store.file_path(store.derivative_path('images/../../x.png', 'thumb'))
+    assert store.variant('../../../etc/x', 'thumb') == '../../../etc/x'
+
+
+def test_thumbnails_of_a_path_outside_the_root_are_not_made(db, tmp_path):
+    (tmp_path.parent / 'secret.png').write_bytes(b'\x89PNG\r\n\x1a\n')
+    db.thumbnails.store = db.image_store
+    with pytest.raises(ValueError):
+        db.thumbnails.generate('../secret.png')
+
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'pixels' * 20000
+
+
+def test_uploads_are_stored_by_content(tmp_path):
+    import hashlib
+    import io
+    store = ImageStore(root=str(tmp_path / 'images'))
+    first = store.stage(io.BytesIO(PNG), 'photo.jpeg') # the bytes say png
+    second = store.stage(io.BytesIO(PNG), 'other.gif')
+    sha = hashlib.sha256(PNG).hexdigest()
+    assert (first.sha256, first.size, first.ext) == (sha, len(PNG), 'png')
+    assert store.place(first) == (f'images/blobs/{sha[:2]}/{sha[2:4]}/{sha}.png', True)
+    assert store.place(second) == (f'images/blobs/{sha[:2]}/{sha[2:4]}/{sha}.png', False)
+    assert open(store.file_path(store.image_path(sha, 'png')), 'rb').read() == PNG
+    assert os.listdir(store.temp_dir) == []
+
+
+def blob_table(db):
+    """image_blobs as far as add_person_images needs it"""
+    blobs = {}
+
+    def respond(cursor, query, params):
+        if query.startswith('INSERT INTO image_blobs'):
+            blobs.setdefault(params[0], params[1])
+            return 1
+        if query.startswith('SELECT image_path FROM image_blobs WHERE sha256'):
+            return [(blobs[params[0]],)]
+        if query.startswith('SELECT image_path, sha256 FROM image_blobs'):
+            return [(path, sha) for sha, path in blobs.items() if path in params]
+        if query.startswith('SELECT LAST_INSERT_ID()'):
+            return [(1,)]
+        return []
+    db.conn.respond = respond
+    return blobs
+
+
+def test_the_same_file_for_two_people_is_stored_once(db):
+    import io
+    blob_table(db)
+    first = db.add_person_images(1, [(io.BytesIO(PNG), 'a.png')])
+    second = db.add_person_images(2, [(io.BytesIO(PNG), 'b.png')])
+    assert first == second
+    rows = [params for query, params in db.conn.queries if query.startswith('INSERT INTO people_images')]
+    assert [row[0] for row in rows] == [1, 2] and rows[0][2] == rows[1][2]
+    files = [name for _, _, names in os.walk(db.image_store.root) for name in names]
+    assert len(files) == 1
+
+
+def test_new_files_are_removed_when_the_commit_fails(db):
+    import io
+    from mysql.connector import Error
+    blob_table(db)
+    db.conn.commit_error = Error("Deadlock found")
+    assert db.add_person_images(1, [(io.BytesIO(PNG), 'a.png')]) is None
+    assert [name for _, _, names in os.walk(db.image_store.root) for name in names] == []
@@ -0,0 +1,91 @@
+import pytest
+
+from importer import Importer
+
+
+@pytest.fixture
+def importer(db, tmp_path):
+    dump = tmp_path / "people.csv"
+    dump.write_text("name\n")
+    return Importer(db, str(dump), 'csv', batch_size=100, chunk_size=100)
+
+
+def ids(db, people, tombstones, auto_increment):
+    def respond(cursor, query, params):
+        if 'FROM people FOR UPDATE' in query:
+            return [(people,)]
+        if 'FROM people_tombstones' in query:
+            return [(tombstones,)]
+        if 'information_schema.TABLES' in query:
+            return [(auto_increment,)]
+        return []
+    db.conn.respond = respond
+
+
+def test_deleted_ids_are_not_given_out_again(db, importer):
+    # the people with ids 8-10 were deleted
+    ids(db, people=7, tombstones=10, auto_increment=11)
+    assert importer.last_id(db.conn.cursor()) == 10
+
+
+def test_ids_deleted_before_the_change_feed_are_not_given_out_again(db, importer):
+    ids(db, people=7, tombstones=0, auto_increment=13)
+    assert importer.last_id(db.conn.cursor()) == 12
+
+
+def test_last_id_of_an_empty_table(db, importer):
+    ids(db, people=0, tombstones=0, auto_increment=1)
+    assert importer.last_id(db.conn.cursor()) == 0
+
+
+def staged(db, importer, rows):
+    def respond(cursor, query, params):
+        if 'MAX(seq)' in query:
+            return [(len(rows),)]
+        if 'FROM import_checkpoints' in query:
+            return [(importer.fingerprint, 'load', 'staged', 0)]
+        if query.startswith('SELECT seq,'):
+            return [(seq,) + row for seq, row in enumerate(rows, 1) if params[0] < seq <= params[1]]
+        if 'LAST_INSERT_ID()' in query and query.startswith('SELECT'):
+            return [(1,)]
+        if 'FROM people FOR UPDATE' in query:
+            return [(0,)]
+        if 'FROM people_tombstones' in query or 'information_schema.TABLES' in query:
+            return [(0,)]
+        return []
+    db.conn.respond = respond
+
+
+def inserted(db, table):
+    return [params for query, params in db.conn.queries if query.startswith(f'INSERT INTO {table} ')]
+
+
+def test_staged_rows_are_checked_like_the_api(db, importer, capsys):
+    # name, address, phone, email, ipaddress, label, description, convicted, socials, images
+    row = dict.fromkeys(('address', 'phone', 'email', 'ipaddress', 'label', 'description', 'socials'))
+    staged(db, importer, [
+        ('  John Doe ', None, None, None, None, None, None, 'yes', None, 'a.png; b.png'),
+        ('Jane Doe', None, None, None, None, None, None, 'maybe', None, None),
+        ('Jim Doe', None, None, None, None, None, None, None, None, '../../etc/passwd'),
+        ('', None, None, None, None, None, None, '1', None, None),
+        ('J' * 256, None, None, None, None, None, None, '0', None, None)])
+    importer.merge()
+    people = inserted(db, 'people')
+    assert people == [(1, 'John Doe') + tuple(row.values())[:6] + (1, None)]
+    assert inserted(db, 'people_images') == [(1, 'a.png'), (1, 'b.png')]
+    out = capsys.readouterr().out
+    assert 'Row 2 skipped: convicted has to be 1 or 0' in out
+    assert 'Row 3 skipped: image path ../../etc/passwd is outside the image folder' in out
+    assert 'Row 4 skipped: name is required' in out
+    assert 'Row 5 skipped: name is longer than 255 characters' in out
+    assert '4 rows were skipped' in out
+
+
+def test_staged_ndjson_rows_are_numbered_by_line(db, tmp_path, capsys):
+    dump = tmp_path / "people.ndjson"
+    dump.write_text("")
+    importer = Importer(db, str(dump), 'ndjson', batch_size=100, chunk_size=2)
+    staged(db, importer, [('{"name": "John Doe", "images": ["a.png"]}',), ('',), ('not json',), ('{"name": "Jane Doe", "convicted": true}',)])
+    importer.merge()
+    assert [params[1] for params in inserted(db, 'people')] == ['John Doe', 'Jane Doe']
+    assert 'Row 3 skipped: record has to be a JSON object' in capsys.readouterr().out
@@ -0,0 +1,84 @@
+import ipaddress
+
+import pytest
+
+from ipranges import cidr_range, parse_ips, to_key
+
+
+def test_free_form_fields():
+    assert [str(ip) for ip in parse_ips('10.0.0.1, [2001:db8::1]; junk 192.168.1.300\n172.16.0.9')] == [
+        '10.0.0.1', '2001:db8::1', '172.16.0.9']
+    assert parse_ips(None) == []
+
+
+def key(ip):
+    return to_key(ipaddress.ip_address(ip))
+
+
+def inside(cidr, ip):
+    first, last = cidr_range(cidr)
+    return first <= key(ip) <= last
+
+
+def test_cidr_blocks():
+    assert inside('10.0.0.0/24', '10.0.0.0') and inside('10.0.0.0/24', '10.0.0.255')
+    assert not inside('10.0.0.0/24', '10.0.1.0') and not inside('10.0.0.0/24', '9.255.255.255')
+    assert inside('10.0.0.77/24', '10.0.0.5') # host bits are ignored
+    assert inside('2001:db8::/32', '2001:db8:ffff::1') and not inside('2001:db8::/32', '2001:db9::')
+    assert cidr_range(' 10.0.0.7 ') == (key('10.0.0.7'), key('10.0.0.7'))
+
+
+def test_ipv4_and_ipv6_dont_overlap():
+    assert not inside('0.0.0.0/0', '::1') and not inside('0.0.0.0/0', '2001:db8::1')
+    assert not inside('2001::/16', '10.0.0.1')
+    assert inside('::ffff:0:0/96', '10.0.0.1') # the IPv4-mapped block
+
+
+def test_keys_sort_like_addresses():
+    ips = ['10.0.0.2', '9.0.0.1', '10.0.0.10', '255.255.255.255', '0.0.0.0', '10.0.1.0']
+    assert sorted(ips, key=key) == sorted(ips, key=ipaddress.ip_address)
+
+
+@pytest.mark.parametrize('cidr', ['', 'nope', '10.0.0.0/33', '10.0.0.256'])
+def test_bad_blocks(cidr):
+    with pytest.raises(ValueError):
+        cidr_range(cidr)
+
+
+def test_people_by_ip(db):
+    rows = {'10.0.0.5': 1, '10.0.1.5': 2}
+
+    def respond(cursor, query, params):
+        if 'FROM people_ips' in query:
+            first, last, after, limit = params
+            ids = sorted(person_id for ip, person_id in rows.items() if first <= key(ip) <= last and person_id > after)
+            return [(person_id, 'x', None, None, None, None, None, None, 0, None) for person_id in ids][:limit]
+        return []
+    db.conn.respond = respond
+    people, cursor = db.get_people_by_ip('10.0.0.0/24')
+    assert [person['id'] for person in people] == [1] and cursor is None
+    people, _ = db.get_people_by_ip('10.0.0.0/16')
+    assert [person['id'] for person in people] == [1, 2]
+    with pytest.raises(ValueError):
+        db.get_people_by_ip('10.0.0.0/99')
+
+
+def test_ips_are_indexed_per_person(db):
+    db.conn.respond = lambda cursor, query, params: 0
+    db._index_ips(db.conn.cursor(), [{'id': 1, 'ipaddress': '10.0.0.1 10.0.0.1, ::1'}, {'id': 2, 'ipaddress': None}])
+    (delete, ids), *inserts = db.conn.queries
+    assert delete.startswith('DELETE FROM people_ips') and ids == (1, 2)
+    assert sorted(params for _, params in inserts) == [(key('::1'), 1), (key('10.0.0.1'), 1)]
+
+
+def test_bad_blocks_are_a_bad_request(db, monkeypatch):
+    import flask
+    import database
+    monkeypatch.setattr(database, '_db', db)
+    from api import main
+    monkeypatch.setattr(main, 'db', db)
+    app = flask.Flask(__name__)
+    with app.test_request_context('/api/people/by-ip?cidr=10.0.0.0/99'):
+        response, status = main.get_people_by_ip.__wrapped__()
+    assert status == 400
+    assert db.conn.queries == []
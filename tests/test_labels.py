@@ -0,0 +1,72 @@
+from suggest import parse_labels
+
+
+def test_labels_are_split_and_normalized():
+    assert parse_labels('Groomer, DNI;scammer\n dni ') == [('groomer', 'Groomer'), ('dni', 'DNI'), ('scammer', 'scammer')]
+    assert parse_labels(None) == []
+
+
+class Labels:
+    """labels and people_labels as far as the label index needs them"""
+    def __init__(self, db):
+        self.labels = {} # slug -> [id, name, people_count, convicted_count]
+        self.people = set() # (label_id, person_id, convicted)
+        db.conn.respond = self.respond
+
+    def by_id(self, label_id):
+        return next(label for label in self.labels.values() if label[0] == label_id)
+
+    def respond(self, cursor, query, params):
+        if query.startswith('SELECT label_id, convicted FROM people_labels'):
+            return [(label_id, convicted) for label_id, person_id, convicted in self.people if person_id in params]
+        if query.startswith('UPDATE labels SET people_count = people_count -'):
+            label = self.by_id(params[2])
+            label[2] -= params[0]
+            label[3] -= params[1]
+        elif query.startswith('UPDATE labels SET people_count = people_count +'):
+            label = self.by_id(params[2])
+            label[2] += params[0]
+            label[3] += params[1]
+        elif query.startswith('DELETE FROM people_labels'):
+            self.people = {row for row in self.people if row[1] not in params}
+        elif query.startswith('INSERT IGNORE INTO labels'):
+            self.labels.setdefault(params[0], [len(self.labels) + 1, params[1], 0, 0])
+        elif query.startswith('SELECT slug, id FROM labels'):
+            return [(slug, self.labels[slug][0]) for slug in params]
+        elif query.startswith('INSERT INTO people_labels'):
+            self.people.add(params)
+        elif query.startswith('SELECT slug, name, people_count, convicted_count'):
+            rows = [(slug, name, count, convicted) for slug, (_, name, count, convicted) in self.labels.items() if count > 0]
+            return sorted(rows, key=lambda row: (-row[2], row[0]))[:params[0]]
+        return 0
+
+
+def facets(db):
+    return [(facet['slug'], facet['people'], facet['convicted'], facet['not_convicted']) for facet in db.get_label_facets()]
+
+
+def test_counts_follow_every_change(db):
+    table = Labels(db)
+    cursor = db.conn.cursor()
+    db._index_labels(cursor, [{'id': 1, 'label': 'Scammer, DNI', 'convicted': True},
+                              {'id': 2, 'label': 'scammer', 'convicted': False},
+                              {'id': 3, 'label': None, 'convicted': True}])
+    assert facets(db) == [('scammer', 2, 1, 1), ('dni', 1, 1, 0)]
+    # person 2 gets another label and is convicted now
+    db._index_labels(cursor, [{'id': 2, 'label': 'DNI; groomer', 'convicted': True}])
+    assert facets(db) == [('dni', 2, 2, 0), ('groomer', 1, 1, 0), ('scammer', 1, 1, 0)]
+    # person 1 is deleted, labels nobody has anymore aren't listed
+    db._unindex_labels(cursor, [1])
+    assert facets(db) == [('dni', 1, 1, 0), ('groomer', 1, 1, 0)]
+    assert table.labels['scammer'][2:] == [0, 0]
+
+
+def test_label_rows_are_updated_in_a_fixed_order(db):
+    Labels(db)
+    cursor = db.conn.cursor()
+    db._index_labels(cursor, [{'id': 1, 'label': 'b, a, c', 'convicted': False}])
+    db.conn.queries.clear()
+    db._index_labels(cursor, [{'id': 1, 'label': 'c, a', 'convicted': False}])
+    updates = [params[2] for query, params in db.conn.queries if query.startswith('UPDATE labels')]
+    # taken out of all three (sorted by id), then added to a and c
+    assert updates[:3] == sorted(updates[:3]) and updates[3:] == sorted(updates[3:])
@@ -0,0 +1,77 @@
+from mysql.connector import Error
+
+
+def row(person_id):
+    return (person_id, f'Person {person_id}', None, None, None, None, None, None, 0, None)
+
+
+def table(db, ids, images=None):
+    """people with these ids, answers keyset queries like MySQL would"""
+    images = images or {}
+
+    def respond(cursor, query, params):
+        if query.startswith('SELECT person_id, image_path FROM people_images'):
+            return [(person_id, path) for person_id in params for path in images.get(person_id, [])]
+        after, limit = params[-2], params[-1]
+        return [row(person_id) for person_id in sorted(ids) if person_id > after][:limit]
+    db.conn.respond = respond
+
+
+def test_pages_follow_the_cursor_to_the_end(db):
+    table(db, [1, 2, 5, 8, 9])
+    people, cursor = db.get_people_page(limit=2)
+    assert [p['id'] for p in people] == [1, 2] and cursor == 2
+    people, cursor = db.get_people_page(limit=2, after=cursor)
+    assert [p['id'] for p in people] == [5, 8] and cursor == 8
+    people, cursor = db.get_people_page(limit=2, after=cursor)
+    assert [p['id'] for p in people] == [9] and cursor is None
+
+
+def test_a_full_last_page_has_no_cursor(db):
+    table(db, [1, 2, 3, 4])
+    people, cursor = db.get_people_page(limit=2, after=2)
+    assert [p['id'] for p in people] == [3, 4] and cursor is None
+    assert db.get_people_page(limit=2, after=4) == ([], None)
+
+
+def test_page_size_is_clamped(db):
+    table(db, range(1, 5000))
+    people, _ = db.get_people_page(limit=100000)
+    assert len(people) == db.MAX_PAGE_SIZE
+    people, _ = db.get_people_page(limit=0)
+    assert len(people) == db.DEFAULT_PAGE_SIZE
+
+
+def test_filtered_pages(db):
+    table(db, [1, 2, 3])
+    db.get_people_page(limit=10, after=1, label='scammer', convicted=False)
+    (query, params), = db.conn.queries
+    assert 'pl.person_id > %s' in query and 'ORDER BY pl.person_id' in query
+    assert params == ('scammer', 1, 0, 11)
+
+
+def test_errors_end_the_list(db):
+    def respond(cursor, query, params):
+        raise Error("lost connection")
+    db.conn.respond = respond
+    assert db.get_people_page(limit=2) == ([], None)
+
+
+def test_page_images_are_one_query(db):
+    table(db, [1, 2, 3], images={1: ['a.png', 'b.png'], 3: ['c.png']})
+    people, _ = db.get_people_page(limit=10, with_images=True)
+    assert [p['images'] for p in people] == [['a.png', 'b.png'], [], ['c.png']]
+    assert len(db.conn.queries) == 2
+    assert db.conn.queries[1][1] == (1, 2, 3)
+
+
+def test_many_people_and_their_images(db):
+    table(db, [1, 2, 3], images={2: ['b.png']})
+    assert db.get_images_for([2, 3]) == {2: ['b.png'], 3: []}
+    assert db.get_images_for([]) == {}
+    assert len(db.conn.queries) == 1
+
+    def respond(cursor, query, params):
+        raise Error("lost connection")
+    db.conn.respond = respond
+    assert db.get_images_for([2, 3]) == {2: [], 3: []}
@@ -0,0 +1,90 @@
+import io
+import random
+
+import pytest
+
+import suggest
+from photomatch import HashIndex, PeoplePhotos, MAX_DISTANCE, dhash
+
+
+def test_search_finds_every_hash_within_the_distance():
+    rng = random.Random(5)
+    index = HashIndex()
+    hashes = {}
+    for image_id in range(2000):
+        hashes[image_id] = rng.getrandbits(64)
+        index.add(image_id, image_id // 2, hashes[image_id])
+    # a few near copies of one hash
+    value = hashes[7]
+    for image_id, bits in ((5000, [1]), (5001, [3, 40, 60]), (5002, [0, 17, 33, 49, 63, 2, 9, 12, 20, 30])):
+        near = value
+        for bit in bits:
+            near ^= 1 << bit
+        hashes[image_id] = near
+        index.add(image_id, image_id, near)
+    for max_distance in (0, 3, 10, 12):
+        expected = sorted(((value ^ other).bit_count(), image_id, image_id if image_id >= 5000 else image_id // 2)
+                          for image_id, other in hashes.items() if (value ^ other).bit_count() <= max_distance)
+        assert index.search(value, max_distance) == expected
+    index.remove(5000)
+    assert [image_id for _, image_id, _ in index.search(value, 3)] == [7, 5001]
+    assert len(index) == 2002
+
+
+def image(color, size=(200, 150), fmt='PNG', quality=95):
+    pytest.importorskip('PIL')
+    from PIL import Image, ImageDraw
+    picture = Image.new('RGB', size, color)
+    draw = ImageDraw.Draw(picture)
+    draw.ellipse((size[0] // 4, size[1] // 4, size[0] * 3 // 4, size[1] * 3 // 4), fill='white')
+    draw.rectangle((0, 0, size[0] // 5, size[1]), fill='black')
+    out = io.BytesIO()
+    picture.save(out, fmt, **({'quality': quality} if fmt == 'JPEG' else {}))
+    out.seek(0)
+    return out
+
+
+def test_edited_copies_of_a_photo_hash_close():
+    Image = pytest.importorskip('PIL.Image')
+    original = dhash(image('blue'))
+    assert (original ^ dhash(image('blue', size=(800, 600), fmt='JPEG', quality=40))).bit_count() <= 6
+    other = io.BytesIO()
+    Image.frombytes('L', (64, 48), random.Random(1).randbytes(64 * 48)).save(other, 'PNG')
+    other.seek(0)
+    assert (original ^ dhash(other)).bit_count() > MAX_DISTANCE
+
+
+class Thread:
+    """Runs the target right away instead of in the background"""
+    def __init__(self, target, daemon=None):
+        self.target = target
+
+    def start(self):
+        self.target()
+
+
+def photos(monkeypatch, rows):
+    monkeypatch.setattr(suggest.threading, 'Thread', Thread)
+    return PeoplePhotos(lambda: iter(rows))
+
+
+def test_best_match_per_person(monkeypatch):
+    value = 0b1010
+    index = photos(monkeypatch, [(1, 10, value ^ 0b1), (2, 10, value), (3, 20, value ^ 0b111), (4, 30, ~value & (2 ** 64 - 1))])
+    assert index.search(value) is None # still building
+    assert index.search(value) == [{'person_id': 10, 'image_id': 2, 'distance': 0},
+                                   {'person_id': 20, 'image_id': 3, 'distance': 3}]
+    assert index.search(value, limit=1) == [{'person_id': 10, 'image_id': 2, 'distance': 0}]
+    index.remove([2])
+    index.update([(5, 40, value)])
+    assert [match['person_id'] for match in index.search(value, max_distance=1)] == [40, 10]
+
+
+def test_match_photo_checks_its_input(db, monkeypatch):
+    pytest.importorskip('PIL')
+    with pytest.raises(ValueError):
+        db.match_photo(io.BytesIO(b'not an image'))
+    searches = []
+    monkeypatch.setattr(db.photos, 'search', lambda value, max_distance, limit: searches.append((max_distance, limit)) or [])
+    db.match_photo(image('red'), max_distance=64, limit=1000)
+    assert searches == [(15, 100)]
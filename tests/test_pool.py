@@ -0,0 +1,94 @@
+import pytest
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+
+import database
+from database import ConnectionPool
+
+
+class Connection:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.in_transaction = False
+        self.rollbacks = 0
+        self.closed = False
+        self.ping_error = None
+
+    def ping(self, reconnect=False):
+        if self.ping_error:
+            raise self.ping_error
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(database.mysql.connector, 'connect', Connection)
+    return ConnectionPool(size=2, recycle=3600, timeout=0.05, ping_interval=60, host='db')
+
+
+def test_connections_are_reused(pool):
+    with pool.connection() as first:
+        assert first.kwargs == {'host': 'db', 'consume_results': True}
+    with pool.connection() as second:
+        assert second is first
+    assert pool.stats()['created'] == 1
+    assert pool.stats()['checkouts'] == 2
+    assert pool.stats()['idle'] == 1
+
+
+def test_open_transactions_are_rolled_back(pool):
+    with pool.connection() as conn:
+        conn.in_transaction = True
+    assert conn.rollbacks == 1
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            raise ValueError
+    assert conn.rollbacks == 2
+    assert pool.stats()['in_use'] == 0
+
+
+def test_waits_for_a_free_connection_until_the_timeout(pool):
+    with pool.connection(), pool.connection():
+        with pytest.raises(PoolError):
+            with pool.connection():
+                pass
+    assert pool.stats()['timeouts'] == 1
+    assert pool.stats()['in_use'] == 0
+
+
+def test_old_and_dead_connections_are_replaced(pool):
+    with pool.connection() as first:
+        pass
+    pool.recycle = 0
+    with pool.connection() as second:
+        assert second is not first
+    assert first.closed
+    pool.recycle = 3600
+    pool.ping_interval = 0
+    second.ping_error = Error("gone away")
+    with pool.connection() as third:
+        assert third is not second
+    assert second.closed
+    assert pool.stats()['recycled'] == 1
+    assert pool.stats()['failed_checks'] == 1
+
+
+def test_forked_workers_get_their_own_connections(pool, monkeypatch):
+    with pool.connection() as parents:
+        pass
+    with pool.connection() as checked_out:
+        child = pool.stats()['pid'] + 1
+        monkeypatch.setattr(database.os, 'getpid', lambda: child)
+        with pool.connection() as conn:
+            assert conn is not parents and conn is not checked_out
+    # the parent's sockets are left alone, and what it had checked out doesn't come back here
+    assert not parents.closed and not checked_out.closed
+    assert pool.stats()['pid'] == child
+    assert pool.stats()['idle'] == 1
+    assert pool.stats()['in_use'] == 0
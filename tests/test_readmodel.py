@@ -0,0 +1,131 @@
+import pytest
+
+from cache import MISSING
+from readmodel import PeopleReadModel
+
+
+class People:
+    """The DatabaseManager methods the read model uses, on a dict of people"""
+    def __init__(self, people):
+        self.people = {person['id']: dict(person) for person in people}
+        self.version = 1
+        self.changes = {'changed': [], 'deleted': [], 'next': '2.0', 'has_more': False}
+        self.detail_queries = []
+
+    def get_people_version(self):
+        return self.version, None
+
+    def iter_people(self):
+        return iter(sorted(self.people.values(), key=lambda person: person['id']))
+
+    def get_changes(self, since=None, limit=None):
+        return self.changes
+
+    def get_person_details(self, person_ids, with_images=True):
+        self.detail_queries.append(list(person_ids))
+        return {person_id: (self.people[person_id]['description'], [f'images/{person_id}.png'])
+                for person_id in person_ids if person_id in self.people}
+
+
+def person(person_id, label=None, convicted=False):
+    return {'id': person_id, 'name': f'Person {person_id}', 'address': None, 'phone': None, 'email': None,
+            'ipaddress': None, 'label': label, 'description': f'about {person_id}', 'convicted': convicted,
+            'socials': None}
+
+
+@pytest.fixture
+def people():
+    return People([person(1, 'Scammer'), person(2, convicted=True), person(3, 'scammer, DNI', convicted=True),
+                   person(5), person(8, 'DNI')])
+
+
+@pytest.fixture
+def model(people):
+    model = PeopleReadModel(people)
+    model._loading = True
+    model._load()
+    return model
+
+
+def ids(page):
+    return [person['id'] for person in page[0]], page[1]
+
+
+def test_pages(model, people):
+    assert ids(model.get_people_page(2)) == ([1, 2], 2)
+    assert ids(model.get_people_page(2, after=2)) == ([3, 5], 5)
+    assert ids(model.get_people_page(2, after=5)) == ([8], None)
+    assert ids(model.get_people_page(10, label='scammer')) == ([1, 3], None)
+    assert ids(model.get_people_page(10, convicted=True)) == ([2, 3], None)
+    assert ids(model.get_people_page(10, label='dni', convicted=False)) == ([8], None)
+    assert ids(model.get_people_page(10, label='nobody')) == ([], None)
+
+
+def test_page_details_are_one_query(model, people):
+    page, _ = model.get_people_page(10, with_images=True)
+    assert page[0]['description'] == 'about 1' and page[0]['images'] == ['images/1.png']
+    assert people.detail_queries == [[1, 2, 3, 5, 8]]
+    page, _ = model.get_people_page(10)
+    assert 'images' not in page[0]
+    assert len(people.detail_queries) == 1
+
+
+def test_get_people(model):
+    found, missing = model.get_people([8, 4, 1])
+    assert [person['id'] for person in found] == [8, 1]
+    assert missing == [4]
+    assert model.get_person(4) is None
+
+
+def test_synced_changes_move_people_between_labels(model, people):
+    people.version = 2
+    people.changes = {'changed': [dict(person(1, 'DNI'), images=[]), dict(person(9, 'scammer'), images=[])],
+                      'deleted': [{'id': 3}], 'next': '2.9', 'has_more': False}
+    assert ids(model.get_people_page(10, label='scammer')) == ([9], None)
+    assert ids(model.get_people_page(10, label='dni')) == ([1, 8], None)
+    assert ids(model.get_people_page(10)) == ([1, 2, 5, 8, 9], None)
+
+
+def test_changes_are_read_without_the_lock(model, people):
+    people.version = 2
+
+    def get_changes(since=None, limit=None):
+        assert not model._lock.locked()
+        return {'changed': [dict(person(9), images=[])], 'deleted': [], 'next': '2.9', 'has_more': False}
+    people.get_changes = get_changes
+    assert ids(model.get_people_page(10)) == ([1, 2, 3, 5, 8, 9], None)
+
+
+def test_changes_are_dropped_when_someone_else_synced_first(model, people):
+    people.version = 2
+
+    def get_changes(since=None, limit=None):
+        # another request syncs further while this one reads
+        model._token = '3.0'
+        return {'changed': [dict(person(9), images=[])], 'deleted': [], 'next': '2.9', 'has_more': False}
+    people.get_changes = get_changes
+    assert ids(model.get_people_page(10)) == ([1, 2, 3, 5, 8], None)
+    assert model._token == '3.0'
+
+
+
+def test_forked_workers_load_their_own_copy(model, people, monkeypatch):
+    import readmodel
+    started = []
+
+    class Thread:
+        def __init__(self, target, daemon=None):
+            self.target = target
+
+        def start(self):
+            started.append(self.target)
+    monkeypatch.setattr(readmodel.threading, 'Thread', Thread)
+    assert model.get_person(1)['name'] == 'Person 1'
+    # a load that was running when the worker was forked never finishes there
+    model._loading = True
+    child = model._pid + 1
+    monkeypatch.setattr(readmodel.os, 'getpid', lambda: child)
+    assert model.get_person(1) is MISSING
+    assert len(started) == 1
+    started[0]()
+    assert model.get_person(1)['name'] == 'Person 1'
@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+
+import pytest
+from mysql.connector import Error, errorcode
+from mysql.connector.errors import PoolError
+
+import database
+from database import DatabaseManager
+from conftest import FakeConnection
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    """A DatabaseManager that hasn't checked its schema yet, pooled connections are one FakeConnection"""
+    monkeypatch.setattr(database.mysql.connector, 'connect', lambda **kwargs: pytest.fail("opened a connection"))
+    manager = DatabaseManager()
+    manager.conn = FakeConnection(lambda cursor, query, params: [])
+
+    @contextmanager
+    def connection():
+        yield manager.conn
+    monkeypatch.setattr(manager.pool, 'connection', connection)
+    applied = []
+    monkeypatch.setattr(DatabaseManager, 'MIGRATIONS', [
+        (1, "one", lambda self, cursor: applied.append(1)),
+        (2, "two", lambda self, cursor: applied.append(2)),
+        (3, "three", lambda self, cursor: applied.append(3))])
+    monkeypatch.setattr(DatabaseManager, 'SCHEMA_VERSION', 3)
+    manager.applied = applied
+    return manager
+
+
+def schema(manager, version, lock=1):
+    def respond(cursor, query, params):
+        if query == 'SELECT MAX(version) FROM schema_version':
+            if version is None:
+                raise Error(errno=errorcode.ER_NO_SUCH_TABLE)
+            return [(version,)]
+        if query.startswith('SELECT COALESCE(MAX(version), 0)'):
+            return [(version or 0,)]
+        if query.startswith('SELECT GET_LOCK'):
+            return [(lock,)]
+        if query.startswith('SELECT RELEASE_LOCK'):
+            return [(1,)]
+        return 0
+    manager.conn.respond = respond
+
+
+def versions(manager):
+    return [params[0] for query, params in manager.conn.queries if query.startswith('INSERT INTO schema_version')]
+
+
+def test_migrations_are_numbered_in_order():
+    numbers = [number for number, _, _ in database.DatabaseManager.MIGRATIONS]
+    assert numbers == list(range(1, len(numbers) + 1))
+    assert database.DatabaseManager.SCHEMA_VERSION == numbers[-1]
+
+
+def test_nothing_is_read_until_the_first_query(manager):
+    assert manager.conn.queries == []
+
+
+def test_a_current_schema_is_one_query(manager):
+    schema(manager, 3)
+    with manager.get_connection():
+        pass
+    with manager.get_connection():
+        pass
+    assert manager.conn.queries == [('SELECT MAX(version) FROM schema_version', ())]
+    assert manager.applied == []
+
+
+def test_only_newer_migrations_run_in_order(manager):
+    schema(manager, 1)
+    manager.initialize_database()
+    assert manager.applied == [2, 3]
+    assert versions(manager) == [2, 3]
+    assert manager.conn.commits == 2
+    assert manager.conn.queries[-1][0].startswith('SELECT RELEASE_LOCK')
+
+
+def test_old_installs_without_schema_version_run_everything(manager):
+    schema(manager, None)
+    manager.initialize_database()
+    assert manager.applied == [1, 2, 3]
+
+
+def test_a_failed_migration_keeps_the_versions_before_it(manager, monkeypatch):
+    def broken(self, cursor):
+        raise Error("Duplicate column name")
+    monkeypatch.setattr(DatabaseManager, 'MIGRATIONS', DatabaseManager.MIGRATIONS[:2] + [(3, "three", broken)])
+    schema(manager, 0)
+    with pytest.raises(Error):
+        manager.initialize_database()
+    assert versions(manager) == [1, 2]
+    assert not manager._ready
+    assert manager.conn.queries[-1][0].startswith('SELECT RELEASE_LOCK')
+
+
+def test_waiting_too_long_for_another_worker_fails(manager):
+    schema(manager, 0, lock=0)
+    with pytest.raises(PoolError):
+        manager.initialize_database()
+    assert manager.applied == []
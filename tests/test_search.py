@@ -0,0 +1,51 @@
+from mysql.connector import Error
+
+
+def row(person_id, score):
+    return (person_id, f'Person {person_id}', None, None, None, None, None, None, 0, None, score)
+
+
+def search(db, rows):
+    db.conn.respond = lambda cursor, query, params: rows
+    return db.conn.queries
+
+
+def test_words_must_all_match_as_prefixes(db):
+    queries = search(db, [row(1, 1000), row(2, 3.5)])
+    people, has_next = db.search_people(' john do smi ')
+    (query, params), = queries
+    assert 'AGAINST (%s IN BOOLEAN MODE)' in query
+    # "do" is shorter than the FULLTEXT token size, the phone/email/ip prefixes use the whole query
+    assert params[:2] == ('+john* +smi*', '+john* +smi*')
+    assert params[2:5] == ('john do smi%',) * 3
+    assert [(person['id'], person['score']) for person in people] == [(1, 1000.0), (2, 3.5)]
+    assert not has_next
+
+
+def test_short_queries_only_match_fields(db):
+    queries = search(db, [])
+    db.search_people('1_%')
+    (query, params), = queries
+    assert 'MATCH' not in query
+    assert params[:3] == ('1\\_\\%%',) * 3
+
+
+def test_pages(db):
+    queries = search(db, [row(person_id, 1.0) for person_id in range(1, 4)])
+    people, has_next = db.search_people('john', limit=2, page=3)
+    assert [person['id'] for person in people] == [1, 2]
+    assert has_next
+    assert queries[0][1][-2:] == (3, 4) # one extra row to know there's a next page, offset of page 3
+    db.search_people('john', limit=10000)
+    assert queries[1][1][-2] == db.MAX_PAGE_SIZE + 1
+
+
+def test_empty_queries_and_errors_find_nothing(db):
+    queries = search(db, [row(1, 1.0)])
+    assert db.search_people('   ') == ([], False)
+    assert queries == []
+
+    def respond(cursor, query, params):
+        raise Error("lost connection")
+    db.conn.respond = respond
+    assert db.search_people('john') == ([], False)
@@ -0,0 +1,35 @@
+from dedup import blocking_keys
+from suggest import parse_social_accounts, parse_socials
+
+
+def test_profile_php_links_are_told_apart_by_id():
+    first = 'https://www.facebook.com/profile.php?id=100012345678901'
+    second = 'https://m.facebook.com/profile.php?id=100098765432109&ref=share'
+    assert parse_socials(first) == [('100012345678901', first)]
+    assert parse_social_accounts(f'{first}, {second}') == {('facebook', '100012345678901'), ('facebook', '100098765432109')}
+    # two people with a different profile.php link don't share a duplicate key
+    keys = blocking_keys({'socials': first}) & blocking_keys({'socials': second})
+    assert not {key for key in keys if key[0] == 'social'}
+
+
+def test_handles():
+    assert parse_social_accounts('@JohnDoe https://x.com/johndoe/ www.instagram.com/jdoe') == {
+        ('', 'johndoe'), ('twitter', 'johndoe'), ('instagram', 'jdoe')}
+    assert parse_social_accounts('https://www.facebook.com/john.doe') == {('facebook', 'john.doe')}
+
+
+def test_migration_reindexes_people_with_id_links(db):
+    link = 'https://www.facebook.com/profile.php?id=100012345678901'
+    row = (4, 'John Doe', None, None, None, None, None, None, 0, link)
+
+    def respond(cursor, query, params):
+        if query.startswith('SELECT id, name') and params == (0,):
+            return [row]
+        return []
+    db.conn.respond = respond
+    db._reindex_social_ids(db.conn.cursor())
+    selects = [query for query, _ in db.conn.queries if query.startswith('SELECT id, name')]
+    assert all("socials LIKE '%id=%'" in query for query in selects)
+    assert ("INSERT INTO people_socials (handle, platform, person_id) VALUES (%s, %s, %s)",
+            ('100012345678901', 'facebook', 4)) in db.conn.queries
+    assert ("INSERT INTO people_keys (kind, value, person_id) VALUES (%s, %s, %s)", ('social', '100012345678901', 4)) in db.conn.queries
@@ -0,0 +1,156 @@
+import json
+
+import pytest
+from mysql.connector import Error
+
+
+def test_dedicated_connections_are_not_pooled(db, monkeypatch):
+    import database
+    opened = []
+
+    class Connection:
+        closed = False
+
+        def close(self):
+            self.closed = True
+    monkeypatch.setattr(database.mysql.connector, 'connect', lambda **kwargs: opened.append(Connection()) or opened[-1])
+    with db.pool.dedicated() as conn:
+        assert db.pool.stats()['in_use'] == 0
+    assert conn.closed
+    assert db.pool.stats()['dedicated'] == 1
+
+
+def test_abandoned_streams_are_not_drained(db, monkeypatch):
+    import database
+    calls = []
+
+    class Connection:
+        connection_id = 42
+        unread_result = True
+
+        def __init__(self, **kwargs):
+            calls.append(('connect', kwargs['consume_results']))
+
+        def shutdown(self):
+            calls.append('shutdown')
+
+        def close(self):
+            calls.append('close')
+    monkeypatch.setattr(database.mysql.connector, 'connect', Connection)
+    with db.pool.dedicated():
+        pass
+    assert calls == [('connect', False), 'shutdown']
+
+
+def test_abandoned_streams_are_killed_without_shutdown(db, monkeypatch):
+    import database
+    calls = []
+
+    class Connection:
+        connection_id = 42
+        unread_result = True
+
+        def __init__(self, **kwargs):
+            pass
+
+        def shutdown(self):
+            raise NotImplementedError
+
+        def close(self):
+            calls.append('close')
+    monkeypatch.setattr(database.mysql.connector, 'connect', Connection)
+    monkeypatch.setattr(db.pool, "connection", db.get_connection)
+    with db.pool.dedicated():
+        pass
+    assert ('KILL QUERY %s', (42,)) in db.conn.queries
+    assert calls == ['close']
+
+
+def test_people_stream_is_cut_off_on_errors(db, monkeypatch):
+    import flask
+    import database
+    # api.main takes the process wide DatabaseManager when it's imported
+    monkeypatch.setattr(database, '_db', db)
+    from api import main
+    monkeypatch.setattr(main, 'db', db)
+
+    def people(after=None, dedicated=False):
+        assert dedicated
+        yield {'id': 1, 'images': []}
+        raise Error("lost connection")
+    monkeypatch.setattr(db, 'iter_people_with_images', people)
+    app = flask.Flask(__name__)
+    with app.app_context():
+        chunks = main.stream_people()
+        body = next(chunks) + next(chunks)
+        with pytest.raises(Error):
+            body += ''.join(chunks)
+    with pytest.raises(ValueError):
+        json.loads(body)
+
+
+def test_exports_are_limited(db, monkeypatch):
+    import threading
+    import flask
+    import database
+    monkeypatch.setattr(database, '_db', db)
+    from api import main
+    monkeypatch.setattr(main, 'db', db)
+    monkeypatch.setattr(main, 'export_slots', threading.BoundedSemaphore(1))
+    connections = []
+    empty = dict.fromkeys(('address', 'phone', 'email', 'ipaddress', 'label', 'description', 'convicted', 'socials'))
+
+    def people(label=None, convicted=None, after=None, dedicated=False):
+        assert dedicated
+        connections.append('open')
+        try:
+            yield dict(empty, id=1, name='John Doe', images=[])
+            yield dict(empty, id=2, name='Jane Doe', images=[])
+        finally:
+            connections.append('closed')
+    monkeypatch.setattr(db, 'iter_people_with_images', people)
+    export = main.export_people.__wrapped__
+    app = flask.Flask(__name__)
+    with app.test_request_context('/api/export?format=csv'):
+        first = export()
+        assert first.status_code == 200
+        assert export()[1] == 429
+        first.close() # the client went away
+        assert connections == ['open', 'closed']
+        second = export()
+        assert b'Jane Doe' in b''.join(second.response)
+        second.close()
+    with app.test_request_context('/api/export?format=xml'):
+        assert export()[1] == 400
+        assert export()[1] == 400
+
+
+def test_failed_exports_close_the_connection(db, monkeypatch):
+    import threading
+    import flask
+    import database
+    monkeypatch.setattr(database, '_db', db)
+    from api import main
+    monkeypatch.setattr(main, 'db', db)
+    monkeypatch.setattr(main, 'export_slots', threading.BoundedSemaphore(1))
+    connections = []
+
+    def people(label=None, convicted=None, after=None, dedicated=False):
+        connections.append('open')
+        try:
+            yield {'id': 1, 'images': []}
+        finally:
+            connections.append('closed')
+
+    def chunks(people, fmt, compression):
+        next(people)
+        raise Error("lost connection")
+        yield b''
+    monkeypatch.setattr(db, 'iter_people_with_images', people)
+    monkeypatch.setattr(main.exporter, 'export_chunks', chunks)
+    app = flask.Flask(__name__)
+    with app.test_request_context('/api/export'):
+        with pytest.raises(Error):
+            main.export_people.__wrapped__()
+    assert connections == ['open', 'closed']
+    assert main.export_slots.acquire(blocking=False)
@@ -0,0 +1,60 @@
+import pytest
+
+import suggest
+from suggest import PeopleSuggest
+
+
+class Thread:
+    """Runs the target right away instead of in the background"""
+    def __init__(self, target, daemon=None):
+        self.target = target
+
+    def start(self):
+        self.target()
+
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setattr(suggest.threading, 'Thread', Thread)
+    people = [{'id': 1, 'name': 'John Doe', 'email': None, 'socials': None}]
+    return PeopleSuggest(lambda: iter(people))
+
+
+def names(results):
+    return [result['name'] for result in results]
+
+
+def test_first_search_starts_the_build(index):
+    assert index.search('john') == [] # still building when the search was made
+    assert names(index.search('john')) == ['John Doe']
+
+
+def test_forked_workers_build_their_own_index(index, monkeypatch):
+    index.search('john')
+    assert names(index.search('john')) == ['John Doe']
+    # a build that was running when the worker was forked never finishes there
+    index._building = True
+    child = index._pid + 1
+    monkeypatch.setattr(suggest.os, 'getpid', lambda: child)
+    assert index.search('john') == []
+    assert not index._building
+    assert names(index.search('john')) == ['John Doe']
+
+
+def test_other_workers_writes_are_caught_up_after_answering(monkeypatch):
+    monkeypatch.setattr(suggest.threading, 'Thread', Thread)
+    people = [{'id': 1, 'name': 'John Doe', 'email': None, 'socials': None}]
+    feed = []
+
+    def changes(since=None, limit=None):
+        feed.append(since)
+        return {'changed': [{'id': 2, 'name': 'Johnny Smith', 'email': None, 'socials': None}],
+                'deleted': [{'id': 1}], 'next': '2.2', 'has_more': False}
+    index = PeopleSuggest(lambda: iter(people), changes, lambda: '1.1')
+    index.search('john')
+    assert names(index.search('john')) == ['John Doe']
+    index.generation.bump() # another worker wrote
+    assert names(index.search('john')) == ['John Doe'] # answered from the index there was
+    assert feed == ['1.1']
+    assert names(index.search('john')) == ['Johnny Smith']
+    assert feed == ['1.1']
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import thumbnails
+from imagestore import ImageStore
+from thumbnails import ThumbnailPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    return ThumbnailPool(ImageStore(root=str(tmp_path / 'images')), workers=1)
+
+
+def write_image(store, image_path, size):
+    Image = pytest.importorskip('PIL.Image')
+    path = store.file_path(image_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new('RGB', size, 'red').save(path, 'PNG')
+
+
+def test_copies_are_made_once(pool):
+    from PIL import Image
+    hooked = []
+    pool.hooks.append(hooked.append)
+    write_image(pool.store, 'images/blobs/ab/cd/abcd.png', (3000, 1500))
+    before = pool.generation.current()
+    assert pool.generate('images/blobs/ab/cd/abcd.png') == 2
+    assert pool.generation.current() == before + 1
+    for size, max_size in (('web', 1280), ('thumb', 240)):
+        variant = pool.store.variant('images/blobs/ab/cd/abcd.png', size)
+        assert variant == f'images/derived/blobs/ab/cd/abcd.{size}.webp'
+        with Image.open(pool.store.file_path(variant)) as image:
+            assert image.format == 'WEBP' and image.size == (max_size, max_size // 2)
+    assert pool.generate('images/blobs/ab/cd/abcd.png') == 0
+    assert pool.generate('images/blobs/ab/cd/abcd.png', force=True) == 2
+    assert hooked == ['images/blobs/ab/cd/abcd.png'] * 3
+
+
+def test_small_images_are_not_made_bigger(pool):
+    from PIL import Image
+    write_image(pool.store, 'images/small.png', (100, 50))
+    pool.generate('images/small.png')
+    with Image.open(pool.store.file_path(pool.store.variant('images/small.png', 'web'))) as image:
+        assert image.size == (100, 50)
+
+
+def test_missing_files_are_skipped(pool):
+    assert pool.generate('images/gone.png') == 0
+    assert pool.store.variant('images/gone.png', 'thumb') == 'images/gone.png'
+
+
+class Executor:
+    def __init__(self, max_workers=None, thread_name_prefix=None):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+
+
+def test_queued_images_are_not_queued_again(pool, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'ThreadPoolExecutor', Executor)
+    pool.submit(['a.png', 'b.png'])
+    pool.submit(['a.png'])
+    assert pool._executor.submitted == [('a.png',), ('b.png',)]
+    pool._run('a.png') # done, so it can be queued again
+    pool.submit(['a.png'])
+    assert pool._executor.submitted[-1] == ('a.png',)
+
+
+def test_forked_workers_start_their_own_threads(pool, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'ThreadPoolExecutor', Executor)
+    pool.submit(['a.png'])
+    parent = pool._executor
+    child = os.getpid() + 1
+    monkeypatch.setattr(thumbnails.os, 'getpid', lambda: child)
+    pool.submit(['a.png'])
+    assert pool._executor is not parent
+    assert pool._executor.submitted == [('a.png',)]
+
+
+def test_no_workers_no_thumbnails(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'ThreadPoolExecutor', Executor)
+    pool = ThumbnailPool(ImageStore(root=str(tmp_path)), workers=0)
+    pool.submit(['a.png'])
+    assert pool._executor is None
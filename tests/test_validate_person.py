@@ -0,0 +1,26 @@
+from database import validate_person
+
+
+def test_every_column_is_length_checked():
+    for field, limit in (('address', 255), ('phone', 50), ('email', 255), ('ipaddress', 255)):
+        person, error = validate_person({'name': 'John Doe', field: 'x' * (limit + 1)})
+        assert person is None
+        assert error == f"{field} is longer than {limit} characters"
+        person, error = validate_person({'name': 'John Doe', field: 'x' * limit})
+        assert error is None
+
+
+def test_text_columns_are_checked_in_bytes():
+    person, error = validate_person({'name': 'John Doe', 'description': 'é' * 40000})
+    assert error == "description is longer than 65535 bytes"
+
+
+def test_partial_updates_are_length_checked():
+    person, error = validate_person({'phone': '1' * 51}, partial=True)
+    assert error == "phone is longer than 50 characters"
+    assert validate_person({'phone': '+15551234567'}, partial=True) == ({'phone': '+15551234567'}, None)
+
+
+def test_name_is_required():
+    assert validate_person({'name': ' '}) == (None, "name is required")
+    assert validate_person({'name': 'x' * 256})[1] == "name is longer than 255 characters"
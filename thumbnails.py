@@ -0,0 +1,145 @@
+"""
+Makes the resized copies (see imagestore.SIZES) of uploaded images in background threads,
+so pages can show a small WebP instead of the multi-megabyte original. The photo hash used
+by photomatch.py is made at the same time.
+
+New uploads are queued by DatabaseManager, images from before can be done with:
+
+    python3 thumbnails.py
+    python3 thumbnails.py --force    # redo all of them
+
+Needs Pillow (pip install pillow), without it the originals are just shown everywhere.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from colorama import Fore, Style
+from dotenv import load_dotenv
+from imagestore import SIZES
+from cache import SharedGeneration
+import argparse
+import threading
+import tempfile
+import time
+import os
+
+load_dotenv()
+
+thumbnailworkers = int(os.getenv("THUMBNAIL_WORKERS", "2")) # threads per worker process, Pillow resizes without the GIL
+WEBP_QUALITY = 80
+
+def render(source, target, max_size):
+    """Write a WebP copy of source that fits in max_size x max_size, never made bigger"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale right away, a lot faster for big photos
+        image.draft('RGB', (max_size, max_size))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if image.mode in ('LA', 'P', 'PA') else 'RGB')
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.webp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                image.save(out, 'WEBP', quality=WEBP_QUALITY, method=4)
+            os.replace(temp_path, target)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+class ThumbnailPool:
+    """
+    Background threads that make the resized copies of images. submit() returns right away,
+    an image that's already queued isn't queued again.
+    """
+    def __init__(self, store, workers=thumbnailworkers, hooks=()):
+        self.store = store
+        self.workers = workers
+        self.hooks = list(hooks) # called with the image_path after its copies are made
+        # bumped whenever copies are made, pages showing image_variants depend on it (see get_page_version)
+        self.generation = SharedGeneration("thumbnails")
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = set()
+
+    def _get_executor(self):
+        # threads don't survive a fork, a forked worker gets its own
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumbnails')
+            self._pid = os.getpid()
+            self._pending = set()
+        return self._executor
+
+    def submit(self, image_paths):
+        if self.workers <= 0:
+            return
+        with self._lock:
+            executor = self._get_executor()
+            for image_path in image_paths:
+                if image_path not in self._pending:
+                    self._pending.add(image_path)
+                    executor.submit(self._run, image_path)
+
+    def _run(self, image_path):
+        try:
+            self.generate(image_path)
+        except ImportError:
+            print(f"{Fore.YELLOW}[*] Pillow is not installed, no thumbnails are made (pip install pillow){Style.RESET_ALL}")
+        except Exception as e:
+            print(f"{Fore.RED}[-] Error making thumbnails for {image_path}: {e}{Style.RESET_ALL}")
+        finally:
+            with self._lock:
+                self._pending.discard(image_path)
+
+    def generate(self, image_path, force=False):
+        """Make the missing copies of one image right now, returns how many were made"""
+        source = self.store.file_path(image_path)
+        if not os.path.isfile(source):
+            return 0 # a URL or a file that's gone
+        made = 0
+        # biggest first, every smaller copy is made from the one before instead of the full original
+        for size, max_size in sorted(SIZES.items(), key=lambda item: -item[1]):
+            target = self.store.file_path(self.store.derivative_path(image_path, size))
+            if force or not os.path.exists(target):
+                render(source, target, max_size)
+                made += 1
+            source = target
+        if made:
+            self.generation.bump()
+        for hook in self.hooks:
+            hook(image_path)
+        return made
+
+def main():
+    from database import get_db
+
+    parser = argparse.ArgumentParser(description="Make the thumbnails of every image in the CipherStorm database")
+    parser.add_argument("--force", action="store_true", help="remake copies that already exist")
+    parser.add_argument("--workers", type=int, default=max(os.cpu_count() or 1, 1))
+    args = parser.parse_args()
+
+    db = get_db()
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT image_path FROM people_images")
+        image_paths = [row[0] for row in cursor.fetchall()]
+
+    start = time.monotonic()
+    pool = db.thumbnails # its hooks store the photo hashes too
+    def generate(image_path):
+        try:
+            return pool.generate(image_path, force=args.force), 0
+        except Exception as e:
+            print(f"{Fore.RED}[-] {image_path}: {e}{Style.RESET_ALL}")
+            return 0, 1
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(generate, image_paths))
+    made = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    print(f"{Fore.GREEN}[+] {len(image_paths)} images checked, {made} copies made, {failed} failed in {time.monotonic() - start:.1f}s{Style.RESET_ALL}")
+
+if __name__ == '__main__':
+    main()